@@ -7,34 +7,18 @@ class IMPORT_FROM_MB():
     def __init__(self):
         self.VALUE = None
 
-    # when the function block is executed the 'call' method is used
-    def call(self, TABLE='COIL', LEN=1, IDX=4):
+        # the reader bound for each (TABLE, IDX, LEN) the block has been called with
+        self.readers = {}
 
-        # TABLE is a string included by the ST programmer that identifies the Modbus
-        # data table to import the value from
-        match TABLE:
-            case 'COIL':
-                input_blk = mbd.coilblock
-            case 'DATA':
-                input_blk = mbd.datablock
-            case 'INPUT_REG':
-                input_blk = mbd.inputRegblock
-            case 'HOLDING_REG':
-                input_blk = mbd.holdingRegblock
-            case _:
-                print(f"unrecognized Modbus table {TABLE}")
-                return
-
-        # the file mbd.py has the code and global data structures through which
-        # we interact with Modbus
-        OK, values = mbd.getTableValues(input_blk, IDX, LEN)
-        if OK:
-            if LEN==1:
-                self.VALUE = values[0] 
-            else:
-                self.VALUE = values
-        else:
-            print(f"Error importing from Modbus table {TABLE}") 
+    # when the function block is executed the 'call' method is used.
+    # TABLE is a string included by the ST programmer that identifies the Modbus
+    # data table to import the value from.  The first call with a given TABLE,
+    # IDX and LEN finds the table and checks the range, later ones just copy it
+    def call(self, TABLE='COIL', LEN=1, IDX=4):
+        reader = self.readers.get((TABLE, IDX, LEN))
+        if reader is None:
+            reader = self.readers[(TABLE, IDX, LEN)] = mb_reader(TABLE, IDX, LEN)
+        self.VALUE = reader()
 
 
 # EXPORT_TO_MB pushes the offered value out to the Modbus data table that is named,
@@ -44,35 +28,914 @@ class EXPORT_TO_MB():
     def __init__(self):
         self.value = None
 
+        # the writer bound for each (TABLE, IDX, LEN, START) the block has been called with
+        self.writers = {}
+
     def call(self, VALUE=None, TABLE='COIL', START=0, LEN=1, IDX=4):
-        match TABLE:
-            case 'COIL':
-                input_blk = mbd.coilblock
-            case 'DATA':
-                input_blk = mbd.datablock
-            case 'INPUT_REG':
-                input_blk = mbd.inputRegblock
-            case 'HOLDING_REG':
-                input_blk = mbd.holdingRegblock
-            case _:
-                print(f"unrecognized Modbus table {TABLE}")
-                return
+        writer = self.writers.get((TABLE, IDX, LEN, START))
+        if writer is None:
+            writer = self.writers[(TABLE, IDX, LEN, START)] = mb_writer(TABLE, IDX, LEN, START)
+        writer(VALUE)
+
+# the mbd attribute holding each Modbus table an ST program names
+mb_table_attrs = {'COIL': 'coilblock', 'DATA': 'datablock', 'INPUT_REG': 'inputRegblock',
+    'HOLDING_REG': 'holdingRegblock'}
+
+# the Modbus table named, once it is known to hold entries first through end-1.
+# Naming a table that is not there, or entries past its end, is an error in the
+# ST program whatever the cycle, so it raises a LookupError naming call, the call
+# that reaches for them, and whatever runs the program (mbp.py) reports it and stops
+def find_mb_table(call, table_name, first, end):
+    if table_name not in mb_table_attrs:
+        raise LookupError(f"{call}: unrecognized Modbus table {table_name}")
+
+    table = getattr(mbd, mb_table_attrs[table_name])
+    if table is None or first < 0 or end <= first or table.size < end:
+        raise LookupError(f"{call}: Modbus table {table_name} does not hold entries {first} through {end-1}")
+    return table
 
-        if LEN==1:
-            OK = mbd.setTableValues(input_blk, IDX, [VALUE])
+# a function returning the value of entries idx through idx+length-1 of a Modbus
+# table, straight out of its buffer; one entry by itself, more as a list.  Entries
+# in a range of mb_batch come from its cache instead (range_reader)
+def mb_reader(table_name, idx, length):
+    table = find_mb_table(f"IMPORT_FROM_MB(TABLE := '{table_name}', IDX := {idx}, LEN := {length})",
+        table_name, idx, idx+length)
+    parts = mb_batch.parts(table_name, idx, idx+length)
+    if any(rng is not None for rng, lo, hi in parts):
+        return range_reader(table, parts, length)
+
+    copy_out = table.copy_out
+    unpack = table.unpack
+
+    # a table no other process writes has one entry read straight from its buffer
+    if length == 1 and table.segment is None:
+        view = table.view
+        if table.bits:
+            return lambda: view[idx] != 0
+        return functools.partial(view.__getitem__, idx)
+
+    if length == 1:
+        return lambda: unpack(copy_out(idx, 1))[0]
+    return lambda: unpack(copy_out(idx, length))
+
+# a function putting a value into entry idx of a Modbus table, or, for length
+# above 1, the values START through START+length-1 of a list into the entries from
+# idx on.  Entries in a range of mb_batch go into its cache instead (range_writer)
+def mb_writer(table_name, idx, length, start):
+    table = find_mb_table(f"EXPORT_TO_MB(TABLE := '{table_name}', IDX := {idx}, LEN := {length})",
+        table_name, idx, idx+length)
+    parts = mb_batch.parts(table_name, idx, idx+length)
+    if any(rng is not None for rng, lo, hi in parts):
+        return range_writer(table, parts, length, start)
+
+    copy_in = table.copy_in
+    pack = table.pack
+
+    # and one entry written straight into it
+    if length == 1 and table.segment is None:
+        view = table.view
+        if table.bits:
+            def write(value):
+                view[idx] = 1 if value else 0
         else:
-            OK = mbd.setTableValues(input_blk, IDX, VALUE[START:START+LEN])
-        if not OK:
-            print(f"problem exporting value {VALUE} to Modbus table {TABLE}")
+            def write(value):
+                view[idx] = int(value) & 0xFFFF
+        return write
+
+    if length == 1:
+        return lambda value: copy_in(idx, pack((value,)))
+    return lambda values: copy_in(idx, pack(values[start:start+length]))
+
+# the reader of mb_reader for entries of a table some of which are in ranges of
+# mb_batch, parts being what mb_batch.parts returns for them.  Those in a range
+# come from its cache, so that the call sees what the cycle exported to them, and
+# the ranges are read from the table at the top of every cycle from now on
+def range_reader(table, parts, length):
+    for rng, lo, hi in parts:
+        if rng is not None:
+            mb_batch.import_range(rng)
+
+    if len(parts) == 1:
+        rng, lo, hi = parts[0]
+        get = rng.cache.__getitem__
+        if length == 1:
+            return functools.partial(get, lo-rng.first)
+        return functools.partial(get, slice(lo-rng.first, hi-rng.first))
+
+    copy_out = table.copy_out
+    unpack = table.unpack
+    def read():
+        values = []
+        for rng, lo, hi in parts:
+            if rng is None:
+                values.extend(unpack(copy_out(lo, hi-lo)))
+            else:
+                values.extend(rng.cache[lo-rng.first:hi-rng.first])
+        return values
+    return read
+
+# the writer of mb_writer for entries of a table some of which are in ranges of
+# mb_batch.  Those in a range go into its cache, to be written to the table at
+# the bottom of the cycle with what the constant calls exported
+def range_writer(table, parts, length, start):
+    if length == 1:
+        rng, lo, hi = parts[0]
+        return lambda value: rng.put(lo-rng.first, [value])
+
+    copy_in = table.copy_in
+    pack = table.pack
+    first = parts[0][1]
+    def write(values):
+        values = values[start:start+length]
+        for rng, lo, hi in parts:
+            # a list shorter than LEN fills only the entries it reaches
+            entries = values[lo-first:hi-first]
+            if len(entries) == 0:
+                break
+            if rng is None:
+                copy_in(lo, pack(entries))
+            else:
+                rng.put(lo-rng.first, entries)
+    return write
+
+# An mb_range is a range of entries first through end-1 of one Modbus table that
+# the constant IMPORT_FROM_MB and EXPORT_TO_MB calls of the program reach, ranges
+# touching or overlapping merged into one.  cache holds the entries for the cycle,
+# read from the table in one step at its top if some call imports from the range,
+# and dirty the spans of cache the exports changed, written to the table at its bottom.
+# read and write are bound to the table when the first cycle begins
+class mb_range():
+    def __init__(self, table_name, first, end):
+        self.table_name = table_name
+        self.first = first
+        self.end = end
+        self.bits = table_name in ('COIL', 'DATA')
+        self.imported = False
+        self.cache = None
+        self.dirty = []
+        self.read = None
+        self.write = None
+
+    def bind(self):
+        table = find_mb_table(f"IMPORT_FROM_MB and EXPORT_TO_MB calls with TABLE := '{self.table_name}'",
+            self.table_name, self.first, self.end)
+        copy_out = table.copy_out
+        copy_in = table.copy_in
+        unpack = table.unpack
+        pack = table.pack
+        cache = self.cache
+        first = self.first
+        size = self.end-self.first
+
+        def read():
+            cache[:] = unpack(copy_out(first, size))
+
+        def write(lo, hi):
+            copy_in(first+lo, pack(cache[lo:hi]))
+
+        self.read = read
+        self.write = write
+
+    # put entries into the cache from lo on, for an export whose arguments are not constant
+    def put(self, lo, entries):
+        if self.bits:
+            entries = list(map(operator.truth, entries))
+        self.cache[lo:lo+len(entries)] = entries
+        self.dirty.append((lo, lo+len(entries)))
+
+# one call site, the range it falls in and where in the range it starts.  run is
+# what the call does, compiled when the site is planned, and what the generated
+# code calls: for an import, return the value from the cache, for an export, put
+# the value in the cache and note the span.  The values exported to registers
+# are converted when the span is written, once a cycle, and those to bits here,
+# so that an import from the cache later in the cycle sees a bool
+class mb_site():
+    __slots__ = ('kind', 'rng', 'offset', 'length', 'start', 'run')
+
+    def __init__(self, kind, rng, offset, length, start):
+        self.kind = kind
+        self.rng = rng
+        self.offset = offset
+        self.length = length
+        self.start = start
+        if kind == 'IMPORT':
+            self.run = self.importer()
+        else:
+            self.run = self.exporter()
+
+    def importer(self):
+        get = self.rng.cache.__getitem__
+        if self.length == 1:
+            return functools.partial(get, self.offset)
+        return functools.partial(get, slice(self.offset, self.offset+self.length))
+
+    def exporter(self):
+        cache = self.rng.cache
+        dirty = self.rng.dirty
+        bits = self.rng.bits
+        lo = self.offset
+        span = (lo, lo+self.length)
+
+        if self.length == 1:
+            if bits:
+                def run(value):
+                    cache[lo] = operator.truth(value)
+                    dirty.append(span)
+            else:
+                def run(value):
+                    cache[lo] = value
+                    dirty.append(span)
+            return run
+
+        first = self.start
+        end = self.start+self.length
+        def run(values):
+            entries = values[first:end]
+            if bits:
+                entries = list(map(operator.truth, entries))
+
+            # a list shorter than LEN fills only the entries it reaches
+            cache[lo:lo+len(entries)] = entries
+            dirty.append((lo, lo+len(entries)))
+        return run
+
+# mb_batch turns the constant IMPORT_FROM_MB and EXPORT_TO_MB calls of a program
+# into bulk transfers: one read per range at the top of each cycle, and one write
+# per changed stretch of a range at the bottom, rather than a table lookup and a
+# transfer on every call.  pyST.py lists the calls, as (kind, TABLE, IDX, LEN, START),
+# in the order it numbers them, and the generated code runs mb_sites[n] for call n.
+# Within a cycle, every call that reaches the entries of a range, constant or not,
+# goes through its cache: an import sees what the exports earlier in the cycle put
+# there, and the table sees those exports at the bottom of the cycle.  Entries that
+# no range holds are read and written in the table at the call itself
+class mb_batcher():
+    def __init__(self):
+        self.ranges = []
+        self.import_ranges = []
+        self.export_ranges = []
+        self.bound = False
+
+    def plan(self, site_specs):
+        # merge the entries the calls reach into ranges, table by table
+        spans = {}
+        for kind, table_name, idx, length, start in site_specs:
+            spans.setdefault(table_name, []).append((idx, idx+length))
+
+        ranges = {}
+        for table_name, table_spans in spans.items():
+            table_spans.sort()
+            merged = []
+            for first, end in table_spans:
+                if merged and first <= merged[-1].end:
+                    merged[-1].end = max(merged[-1].end, end)
+                else:
+                    merged.append(mb_range(table_name, first, end))
+            for rng in merged:
+                rng.cache = [False if rng.bits else 0]*(rng.end-rng.first)
+            ranges[table_name] = merged
+            self.ranges.extend(merged)
+
+        sites = []
+        for kind, table_name, idx, length, start in site_specs:
+            for rng in ranges[table_name]:
+                if rng.first <= idx < rng.end:
+                    break
+            if kind == 'IMPORT':
+                rng.imported = True
+            sites.append(mb_site(kind, rng, idx-rng.first, length, start))
+
+        return sites
+
+    # the entries first through end-1 of the table named, in order, as (rng, lo, hi)
+    # parts: entries lo through hi-1 of the table, and the mb_range holding them, or
+    # None where no range does
+    def parts(self, table_name, first, end):
+        parts = []
+        pos = first
+        for rng in self.ranges:
+            if rng.table_name != table_name or rng.end <= pos or rng.first >= end:
+                continue
+            if rng.first > pos:
+                parts.append((None, pos, rng.first))
+            hi = min(rng.end, end)
+            parts.append((rng, max(pos, rng.first), hi))
+            pos = hi
+        if pos < end:
+            parts.append((None, pos, end))
+        return parts
+
+    # have the range read from its table at the top of every cycle, for an import
+    # whose arguments are not constant.  In the middle of a cycle the range is read
+    # at once, keeping what the cycle has exported to it
+    def import_range(self, rng):
+        if rng.imported:
+            return
+        rng.imported = True
+        if not self.bound:
+            # the first cycle is yet to begin, and will read it
+            return
+
+        self.import_ranges.append(rng)
+        exported = list(rng.cache)
+        rng.read()
+        for lo, hi in rng.dirty:
+            rng.cache[lo:hi] = exported[lo:hi]
+
+    # bind the ranges to the tables, which mbd has by the time the first cycle begins
+    def bind(self):
+        for rng in self.ranges:
+            rng.bind()
+        self.import_ranges = [rng for rng in self.ranges if rng.imported]
+        self.export_ranges = list(self.ranges)
+        self.bound = True
+
+    def begin_cycle(self):
+        if not self.bound:
+            self.bind()
+        for rng in self.import_ranges:
+            rng.read()
+
+    def end_cycle(self):
+        for rng in self.export_ranges:
+            dirty = rng.dirty
+            if not dirty:
+                continue
+
+            # the changed spans, merged into stretches written in one step each
+            if len(dirty) > 1:
+                dirty.sort()
+            lo, hi = dirty[0]
+            for first, end in dirty[1:]:
+                if first > hi:
+                    rng.write(lo, hi)
+                    lo = first
+                hi = max(hi, end)
+            rng.write(lo, hi)
+            dirty.clear()
+
+mb_batch = mb_batcher()
+
+# the states of a timer in the timer_pool
+timer_idle    = 0
+timer_running = 1
+timer_expired = 2
+
+# the timing wheel of the timer_pool: wheel_levels levels of wheel_size buckets,
+# 1 millisecond apart at level 0 and wheel_size times further apart at each level up
+wheel_bits   = 6
+wheel_size   = 1 << wheel_bits
+wheel_mask   = wheel_size-1
+wheel_levels = 6
+
+# where in the wheel a timer is: in no bucket, or due too far ahead for any
+no_bucket  = -1
+far_bucket = -2
+
+# timer_pool keeps the timing of every TON, TOF and TP of the program, each in the
+# slot it is given when it is created, in arrays rather than in the objects:
+#       - begin    . the cycle time, in milliseconds, at which the timer started
+#       - deadline . the cycle time at which it expires
+#       - state    . idle, running or expired
+#       - bucket   . the bucket of the wheel a running timer is in
+# All of them go by one clock, now, set by tick once a cycle from the time the
+# cycle was released, rather than each reading the clock when it is called.
+#
+# The running timers are kept in a hierarchical timing wheel, so that tick touches
+# the timers expiring in the cycle and no others.  A timer due at deadline is in
+# level k when the highest bit in which deadline and now differ is one of bits 6k
+# through 6k+5, in the bucket those bits of deadline number.  Advancing now to a later time
+# expires everything in the levels below the one where the two times first differ,
+# and in that level the buckets passed over; the timers in the bucket landed on are
+# due within the new stretch of the level and go down to the levels below it.
+# masks[k] has a bit set for each bucket of level k holding timers, so the empty
+# buckets cost nothing.  Stopping or retiming a timer takes it out of its bucket
+class timer_pool():
+    def __init__(self):
+        self.now = 0
+        self.begin = array.array('q')
+        self.deadline = array.array('q')
+        self.state = bytearray()
+        self.bucket = array.array('i')
+
+        self.buckets = [set() for _ in range(wheel_levels*wheel_size)]
+        self.masks = [0]*wheel_levels
+        self.far = set()
+
+    # a slot for a new timer
+    def add(self):
+        self.begin.append(0)
+        self.deadline.append(0)
+        self.state.append(timer_idle)
+        self.bucket.append(no_bucket)
+        return len(self.state)-1
+
+    # set the clock to the time of the cycle, in milliseconds, and expire the timers due by then
+    def tick(self, now):
+        then = self.now
+        if now <= then:
+            return
+        self.now = now
+
+        level = ((then ^ now).bit_length()-1)//wheel_bits
+        if level >= wheel_levels:
+            # past all the wheel holds, and the far timers may now fit in it
+            for lvl in range(0, wheel_levels):
+                self.expire_buckets(lvl, self.masks[lvl])
+            far = self.far
+            self.far = set()
+            for slot in far:
+                self.place(slot)
+            return
+
+        for lvl in range(0, level):
+            self.expire_buckets(lvl, self.masks[lvl])
+
+        shift = level*wheel_bits
+        lo = (then >> shift) & wheel_mask
+        hi = (now >> shift) & wheel_mask
+        self.expire_buckets(level, self.masks[level] & ((1 << hi)-1) & ~((2 << lo)-1))
+
+        if self.masks[level] >> hi & 1:
+            idx = level*wheel_size+hi
+            slots = self.buckets[idx]
+            self.buckets[idx] = set()
+            self.masks[level] &= ~(1 << hi)
+            for slot in slots:
+                self.place(slot)
+
+    # expire the timers in the buckets of level whose bits are set in mask
+    def expire_buckets(self, level, mask):
+        self.masks[level] &= ~mask
+        state = self.state
+        bucket = self.bucket
+        while mask:
+            low = mask & -mask
+            mask ^= low
+            idx = level*wheel_size+low.bit_length()-1
+            slots = self.buckets[idx]
+            self.buckets[idx] = set()
+            for slot in slots:
+                state[slot] = timer_expired
+                bucket[slot] = no_bucket
+
+    # put the running timer in slot in the bucket for its deadline, or expire it if that has come
+    def place(self, slot):
+        deadline = self.deadline[slot]
+        now = self.now
+        if deadline <= now:
+            self.state[slot] = timer_expired
+            self.bucket[slot] = no_bucket
+            return
+
+        level = ((deadline ^ now).bit_length()-1)//wheel_bits
+        if level >= wheel_levels:
+            self.far.add(slot)
+            self.bucket[slot] = far_bucket
+            return
+
+        pos = (deadline >> level*wheel_bits) & wheel_mask
+        idx = level*wheel_size+pos
+        self.buckets[idx].add(slot)
+        self.masks[level] |= 1 << pos
+        self.bucket[slot] = idx
+
+    # take the timer in slot out of the wheel
+    def unplace(self, slot):
+        idx = self.bucket[slot]
+        if idx == no_bucket:
+            return
+        self.bucket[slot] = no_bucket
+        if idx == far_bucket:
+            self.far.discard(slot)
+            return
+
+        slots = self.buckets[idx]
+        slots.discard(slot)
+        if not slots:
+            self.masks[idx >> wheel_bits] &= ~(1 << (idx & wheel_mask))
+
+    # start the timer in slot to expire preset milliseconds from now
+    def start(self, slot, preset):
+        self.begin[slot] = self.now
+        self.arm(slot, self.now+preset)
+
+    # have the running timer in slot expire preset milliseconds after it began instead
+    def retime(self, slot, preset):
+        self.arm(slot, self.begin[slot]+preset)
+
+    def arm(self, slot, deadline):
+        self.unplace(slot)
+        self.deadline[slot] = deadline
+        self.state[slot] = timer_running
+        self.place(slot)
+
+    def stop(self, slot):
+        self.unplace(slot)
+        self.state[slot] = timer_idle
 
+    def elapsed(self, slot):
+        return self.now-self.begin[slot]
+
+# the timers of the program
+st_timers = timer_pool()
+
+# The IEC 61131-3 timers.  Called with IN and PT (a TIME, in milliseconds), an
+# input left out keeping the value it had.  Q and ET are set by the call, from
+# the timer_pool slot that does the timing
+#
+# TON sets Q once IN has been TRUE for PT, and clears it when IN is FALSE
+class TON():
+    __slots__ = ('IN', 'PT', 'Q', 'ET', 'slot')
+
+    def __init__(self):
+        self.IN = False
+        self.PT = 0
+        self.Q = False
+        self.ET = 0
+        self.slot = st_timers.add()
+
+    def call(self, IN=None, PT=None):
+        pool = st_timers
+        slot = self.slot
+        if PT is not None and PT != self.PT:
+            self.PT = PT
+            if pool.state[slot] == timer_running:
+                pool.retime(slot, PT)
+        if IN is not None:
+            self.IN = IN
+
+        if not self.IN:
+            pool.stop(slot)
+            self.Q = False
+            self.ET = 0
+            return
+
+        if pool.state[slot] == timer_idle:
+            pool.start(slot, self.PT)
+        if pool.state[slot] == timer_expired:
+            self.Q = True
+            self.ET = self.PT
+        else:
+            self.Q = False
+            self.ET = pool.elapsed(slot)
+
+# TOF sets Q while IN is TRUE and for PT after IN goes FALSE
+class TOF():
+    __slots__ = ('IN', 'PT', 'Q', 'ET', 'slot')
+
+    def __init__(self):
+        self.IN = False
+        self.PT = 0
+        self.Q = False
+        self.ET = 0
+        self.slot = st_timers.add()
+
+    def call(self, IN=None, PT=None):
+        pool = st_timers
+        slot = self.slot
+        if PT is not None and PT != self.PT:
+            self.PT = PT
+            if pool.state[slot] == timer_running:
+                pool.retime(slot, PT)
+        if IN is not None:
+            self.IN = IN
+
+        if self.IN:
+            pool.stop(slot)
+            self.Q = True
+            self.ET = 0
+            return
+
+        # Q still set with the timer idle is IN having just gone FALSE
+        if self.Q and pool.state[slot] == timer_idle:
+            pool.start(slot, self.PT)
+        if pool.state[slot] == timer_running:
+            self.ET = pool.elapsed(slot)
+        elif pool.state[slot] == timer_expired:
+            self.Q = False
+            self.ET = self.PT
+
+# TP sets Q for PT from IN going TRUE, whatever IN does meanwhile.  ET stays at
+# PT after the pulse until IN is FALSE
+class TP():
+    __slots__ = ('IN', 'PT', 'Q', 'ET', 'slot', 'in_last')
+
+    def __init__(self):
+        self.IN = False
+        self.PT = 0
+        self.Q = False
+        self.ET = 0
+        self.slot = st_timers.add()
+        self.in_last = False
+
+    def call(self, IN=None, PT=None):
+        pool = st_timers
+        slot = self.slot
+        if PT is not None and PT != self.PT:
+            self.PT = PT
+            if pool.state[slot] == timer_running:
+                pool.retime(slot, PT)
+        if IN is not None:
+            self.IN = IN
+
+        # IN going TRUE starts a pulse, unless one is under way
+        if self.IN and not self.in_last and pool.state[slot] != timer_running:
+            pool.start(slot, self.PT)
+        self.in_last = self.IN
+
+        state = pool.state[slot]
+        if state == timer_running:
+            self.Q = True
+            self.ET = pool.elapsed(slot)
+        elif state == timer_expired and self.IN:
+            self.Q = False
+            self.ET = self.PT
+        else:
+            pool.stop(slot)
+            self.Q = False
+            self.ET = 0
+
+# the range of CV for the counters, that of an INT
+counter_min = -32768
+counter_max = 32767
+
+# The IEC 61131-3 counters, which count rising edges of CU (up) and CD (down)
+#
+# CTU counts up from 0, reset by R.  Q is CV reaching PV
+class CTU():
+    __slots__ = ('CU', 'R', 'PV', 'Q', 'CV', 'cu_last')
+
+    def __init__(self):
+        self.CU = False
+        self.R = False
+        self.PV = 0
+        self.Q = False
+        self.CV = 0
+        self.cu_last = False
+
+    def call(self, CU=None, R=None, PV=None):
+        if CU is not None:
+            self.CU = CU
+        if R is not None:
+            self.R = R
+        if PV is not None:
+            self.PV = PV
+
+        if self.R:
+            self.CV = 0
+        elif self.CU and not self.cu_last and self.CV < counter_max:
+            self.CV += 1
+        self.cu_last = self.CU
+        self.Q = self.CV >= self.PV
+
+# CTD counts down from PV, loaded by LD.  Q is CV reaching 0
+class CTD():
+    __slots__ = ('CD', 'LD', 'PV', 'Q', 'CV', 'cd_last')
+
+    def __init__(self):
+        self.CD = False
+        self.LD = False
+        self.PV = 0
+        self.Q = False
+        self.CV = 0
+        self.cd_last = False
+
+    def call(self, CD=None, LD=None, PV=None):
+        if CD is not None:
+            self.CD = CD
+        if LD is not None:
+            self.LD = LD
+        if PV is not None:
+            self.PV = PV
+
+        if self.LD:
+            self.CV = self.PV
+        elif self.CD and not self.cd_last and self.CV > counter_min:
+            self.CV -= 1
+        self.cd_last = self.CD
+        self.Q = self.CV <= 0
+
+# CTUD counts up on CU and down on CD, an edge of both at once leaving CV as it
+# is.  R resets CV to 0 and, failing that, LD loads it with PV.  QU is CV reaching
+# PV, QD CV reaching 0
+class CTUD():
+    __slots__ = ('CU', 'CD', 'R', 'LD', 'PV', 'QU', 'QD', 'CV', 'cu_last', 'cd_last')
+
+    def __init__(self):
+        self.CU = False
+        self.CD = False
+        self.R = False
+        self.LD = False
+        self.PV = 0
+        self.QU = False
+        self.QD = False
+        self.CV = 0
+        self.cu_last = False
+        self.cd_last = False
+
+    def call(self, CU=None, CD=None, R=None, LD=None, PV=None):
+        if CU is not None:
+            self.CU = CU
+        if CD is not None:
+            self.CD = CD
+        if R is not None:
+            self.R = R
+        if LD is not None:
+            self.LD = LD
+        if PV is not None:
+            self.PV = PV
+
+        up = self.CU and not self.cu_last
+        down = self.CD and not self.cd_last
+        if self.R:
+            self.CV = 0
+        elif self.LD:
+            self.CV = self.PV
+        elif up and not down:
+            if self.CV < counter_max:
+                self.CV += 1
+        elif down and not up:
+            if self.CV > counter_min:
+                self.CV -= 1
+        self.cu_last = self.CU
+        self.cd_last = self.CD
+        self.QU = self.CV >= self.PV
+        self.QD = self.CV <= 0
+
+# The IEC 61131-3 edge detectors and bistables.  Each has a call for one instance,
+# and a step that does the same for many instances at once, as fb_array keeps
+# them: every field an int holding a bit per instance, and ones the int with the
+# bit of every instance set, so that NOT x is x ^ ones
+#
+# R_TRIG sets Q for the one call in which CLK has gone TRUE
+class R_TRIG():
+    __slots__ = ('CLK', 'Q', 'M')
+
+    def __init__(self):
+        self.CLK = False
+        self.Q = False
+        self.M = False
+
+    def call(self, CLK=None):
+        if CLK is not None:
+            self.CLK = bool(CLK)
+        self.Q = self.CLK and not self.M
+        self.M = self.CLK
+
+    @staticmethod
+    def step(lanes, ones):
+        lanes['Q'] = lanes['CLK'] & (lanes['M'] ^ ones)
+        lanes['M'] = lanes['CLK']
+
+# F_TRIG sets Q for the one call in which CLK has gone FALSE.  M starts FALSE, so
+# CLK FALSE on the first call is not taken for an edge
+class F_TRIG():
+    __slots__ = ('CLK', 'Q', 'M')
+
+    def __init__(self):
+        self.CLK = False
+        self.Q = False
+        self.M = False
+
+    def call(self, CLK=None):
+        if CLK is not None:
+            self.CLK = bool(CLK)
+        self.Q = self.M and not self.CLK
+        self.M = self.CLK
+
+    @staticmethod
+    def step(lanes, ones):
+        lanes['Q'] = lanes['M'] & (lanes['CLK'] ^ ones)
+        lanes['M'] = lanes['CLK']
+
+# RS is set by S and reset by R1, the reset winning
+class RS():
+    __slots__ = ('S', 'R1', 'Q1')
+
+    def __init__(self):
+        self.S = False
+        self.R1 = False
+        self.Q1 = False
+
+    def call(self, S=None, R1=None):
+        if S is not None:
+            self.S = bool(S)
+        if R1 is not None:
+            self.R1 = bool(R1)
+        self.Q1 = not self.R1 and (self.S or self.Q1)
+
+    @staticmethod
+    def step(lanes, ones):
+        lanes['Q1'] = (lanes['R1'] ^ ones) & (lanes['S'] | lanes['Q1'])
+
+# SR is set by S1 and reset by R, the set winning
+class SR():
+    __slots__ = ('S1', 'R', 'Q1')
+
+    def __init__(self):
+        self.S1 = False
+        self.R = False
+        self.Q1 = False
+
+    def call(self, S1=None, R=None):
+        if S1 is not None:
+            self.S1 = bool(S1)
+        if R is not None:
+            self.R = bool(R)
+        self.Q1 = self.S1 or (not self.R and self.Q1)
+
+    @staticmethod
+    def step(lanes, ones):
+        lanes['Q1'] = lanes['S1'] | ((lanes['R'] ^ ones) & lanes['Q1'])
+
+# An fb_array is an ST array of R_TRIG, F_TRIG, RS or SR instances that pyST.py
+# found called in a FOR loop it could turn into one call_range.  Rather than an
+# object per instance it keeps each field of the block as an int with a bit per
+# instance, instance 0 in the lowest, so that call_range evaluates a stretch of
+# instances with a handful of operations on ints however many there are.  The
+# values of an ST array of BOOL go in and out packed and unpacked as mbstruct does
+# the bits of a coil payload.  Indexing gives an fb_item, through which one instance
+# is called and its fields read as the ST program does with an instance of its own
+class fb_array():
+    def __init__(self, fb_class, size):
+        self.fb_class = fb_class
+        self.size = size
+        self.fields = {name: 0 for name in fb_class.__slots__}
+        self.items = [fb_item(self, idx) for idx in range(0, size)]
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+    def __len__(self):
+        return self.size
+
+    # call instances lo through hi-1.  Each input is a sequence holding the value for
+    # each of them, or one value for them all; a sequence of another length is a
+    # ValueError, which mbp.py reports as it stops the program
+    def call_range(self, lo, hi, **inputs):
+        count = hi-lo
+        ones = (1 << count)-1
+        keep = ~(ones << lo)
+        fields = self.fields
+        for name, value in inputs.items():
+            if isinstance(value, (list, tuple)):
+                if len(value) != count:
+                    raise ValueError(f"{len(value)} values of {name} for {count} instances of {self.fb_class.__name__}")
+                lane = int.from_bytes(mbstruct.make_bitmask_list(value), 'little')
+            else:
+                lane = ones if value else 0
+            fields[name] = fields[name] & keep | lane << lo
+
+        lanes = {name: field >> lo & ones for name, field in fields.items()}
+        self.fb_class.step(lanes, ones)
+        for name, lane in lanes.items():
+            fields[name] = fields[name] & keep | lane << lo
+
+    # the values of field of instances lo through hi-1
+    def values(self, name, lo, hi):
+        count = hi-lo
+        lane = self.fields[name] >> lo & ((1 << count)-1)
+        return mbstruct.unpack_bit_list(lane.to_bytes((count+7)//8, 'little'), count)
+
+# one instance of an fb_array
+class fb_item():
+    __slots__ = ('batch', 'idx')
+
+    def __init__(self, batch, idx):
+        object.__setattr__(self, 'batch', batch)
+        object.__setattr__(self, 'idx', idx)
+
+    def call(self, **inputs):
+        self.batch.call_range(self.idx, self.idx+1, **inputs)
+
+    def __getattr__(self, name):
+        fields = self.batch.fields
+        if name not in fields:
+            raise AttributeError(name)
+        return fields[name] >> self.idx & 1 == 1
+
+    def __setattr__(self, name, value):
+        fields = self.batch.fields
+        if name not in fields:
+            raise AttributeError(name)
+        bit = 1 << self.idx
+        fields[name] = fields[name] | bit if value else fields[name] & ~bit
+
+
+# whether build_loc_map has laid out the variables, which it does once only
+loc_map_built = False
 
 # pyST.py creates a json string that is converted to a dictionary
 # to carry information about all of the global variables.
 # build_loc_map calls the responsible interface-memory map structure's 'add_var' to register
-# that variable
+# that variable, and then compiles the transfers between the interface and the variables
 def build_loc_map(var_dict_list):
-    global IX_seq, IW_seq, QX_seq, QW_seq
-    global MW_seq, MD_seq, ML_seq
+    global loc_map_built
+    if loc_map_built:
+        return
+    loc_map_built = True
+
+    seqs = mem_class_seqs()
 
     for var_dict in var_dict_list:
         name = var_dict['name']
@@ -86,16 +949,111 @@ def build_loc_map(var_dict_list):
         mem_adrs = mem_code[2:]
 
         mb_idx   = var_dict['mb_idx']
-        cmd = f"{mem_class}_seq.add_var(var_dict['name'], var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)" 
+        seqs[mem_class].add_var(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)
+
+    # resolve the variable names once here rather than on every cycle
+    for seq in seqs.values():
+        seq.bind(globals())
+
+# the value of the variable or array element a location map names, in namespace
+def mapped_value(namespace, name):
+    base, indices = split_mapped_name(name)
+    value = namespace[base]
+    for idx in indices:
+        value = value[idx]
+    return value
 
-        exec(cmd)
+def set_mapped_value(namespace, name, value):
+    base, indices = split_mapped_name(name)
+    if len(indices) == 0:
+        namespace[base] = value
+        return
+    container = namespace[base]
+    for idx in indices[:-1]:
+        container = container[idx]
+    container[indices[-1]] = value
+
+# memory classes whose process images the interface writes, so that what is in the
+# image, not yet imported into the variables, is the current value
+input_classes = ('IX', 'IW')
+
+# carry the state of the PLC program of module old, another translation of this one
+# whose scan loop has stopped at a cycle boundary, over to this one before its scan
+# loop starts.  Each variable both location maps hold by the same name with the same
+# type takes its value in old, from the process image for an input, and the process
+# image of this program is updated to match.  Variables not in the location maps and
+# function block instances keep the initial values of their declarations
+def take_over(old):
+    build_loc_map(loc_map)
+    old_seqs = old.mem_class_seqs()
+    seqs = mem_class_seqs()
+    old_vars = vars(old)
+    prev = {var_dict['name']: var_dict for var_dict in old.loc_map}
+
+    carried = 0
+    for var_dict in loc_map:
+        name = var_dict['name']
+        prev_dict = prev.get(name)
+        if prev_dict is None or prev_dict['var_type'] != var_dict['var_type']:
+            continue
+
+        old_class = prev_dict['mem_code'][:2]
+        if old_class in input_classes:
+            OK, values = old_seqs[old_class].read_values(prev_dict['pos'], prev_dict['pos'])
+            if not OK:
+                continue
+            value = values[0]
+        else:
+            value = mapped_value(old_vars, name)
+
+        value = typed_value(value, var_dict['py_type'])
+        set_mapped_value(globals(), name, value)
+        seqs[var_dict['mem_code'][:2]].write_values(var_dict['pos'], var_dict['pos'], [value])
+        carried += 1
+    return carried
+
+# the var_seq of each memory class
+def mem_class_seqs():
+    return {'IX': IX_seq, 'IW': IW_seq, 'QX': QX_seq, 'QW': QW_seq,
+            'MW': MW_seq, 'MD': MD_seq, 'ML': ML_seq}
+
+# the bytes in the process image of each of the memory classes named, None for
+# one whose image is a list of python objects and cannot be shared.  Called
+# after build_loc_map, to size the shared memory segments (shmem.py) for them
+def process_image_bytes(mem_classes):
+    seqs = mem_class_seqs()
+    return {mem_class: seqs[mem_class].image_bytes() for mem_class in mem_classes}
+
+# lay the process image of each memory class in segments over its shared memory
+# segment.  The process that created the segments calls this after build_loc_map,
+# which puts the initial values of the variables in them, and a process that
+# attaches to them calls it before build_loc_map, leaving the values as they are
+def share_process_images(segments):
+    seqs = mem_class_seqs()
+    for mem_class, segment in segments.items():
+        seqs[mem_class].share_segment(segment)
+        if len(seqs[mem_class].subseqs) > 0:
+            seqs[mem_class].bind(globals())
+
+# release the process images of the memory classes named from the shared memory
+# segments under them, which can then be closed
+def release_process_images(mem_classes):
+    seqs = mem_class_seqs()
+    for mem_class in mem_classes:
+        seqs[mem_class].release()
 
 # A call to top_of_cycle_import is embedded in the top of every PLC cycle
 # to get values from value tables in IX and IW and put into the variables 
 def top_of_cycle_import():
+    # the timers go by the time the cycle was released
+    st_timers.tick(plc_scan.cycle_ms())
+
     IX_seq.intrfc_to_vars()
     IW_seq.intrfc_to_vars()
 
+    # and read the Modbus table ranges the constant IMPORT_FROM_MB calls take values from
+    mb_batch.begin_cycle()
+
 # A call to bottom_of_cycle_import is embedded in the bottom of every PLC cycle
 # to export variables mapped to QX_seq and QW_seq
 def bottom_of_cycle_export():
@@ -103,27 +1061,428 @@ def bottom_of_cycle_export():
     QX_seq.vars_to_intrfc()
     QW_seq.vars_to_intrfc()
 
+    # and write what the constant EXPORT_TO_MB calls put in the Modbus table ranges
+    mb_batch.end_cycle()
+
+# scan_scheduler releases the PLC cycles at a fixed rate.  The n-th cycle is released
+# at start+n*period on the time.monotonic_ns clock, so the period does not stretch by
+# the time spent executing a cycle, and sleep jitter does not accumulate.
+# A cycle still running when the next one is due is an overrun, and the catch-up
+# policy says what happens to the releases it missed:
+#       - 'skip'  . drop them, start the next cycle at once and keep to the original grid after it
+#       - 'burst' . run the missed cycles back to back until the schedule is caught up
+# The time each cycle executes is kept in a histogram with power-of-two buckets in microseconds
+class scan_scheduler():
+    def __init__(self):
+        # set by stop, for next_cycle to end the scan loop
+        self.stopping = False
+        self.start(0)
+
+    def start(self, period_ms, catchup='skip'):
+        if catchup not in ('skip', 'burst'):
+            print(f"unrecognized catch-up policy {catchup}, using 'skip'")
+            catchup = 'skip'
+
+        self.period_ns = int(period_ms*1000000)
+        self.catchup = catchup
+        self.deadline = None
+        self.cycle_start = None
+
+        self.cycles   = 0
+        self.overruns = 0
+        self.skipped  = 0
+        self.max_exec_ns = 0
+
+        # histogram[k] counts cycles that executed in [2**(k-1), 2**k) microseconds
+        self.histogram = [0]*32
+
+    # have the scan loop end at the next cycle boundary, with next_cycle returning False
+    def stop(self):
+        self.stopping = True
+
+    # called at the top of every cycle: account for the cycle just finished, then
+    # wait for the release of the next one.  Returns False, without waiting, if the
+    # scan loop is to end instead
+    def next_cycle(self):
+        now = time.monotonic_ns()
+        period = self.period_ns
+
+        if self.deadline is None:
+            # the first cycle is released one period from now
+            self.deadline = now+period
+        else:
+            exec_ns = now-self.cycle_start
+            self.cycles += 1
+            if exec_ns > self.max_exec_ns:
+                self.max_exec_ns = exec_ns
+            self.histogram[min(31, (exec_ns//1000).bit_length())] += 1
+
+            if period > 0 and now > self.deadline:
+                self.overruns += 1
+                if self.catchup == 'skip':
+                    missed = (now-self.deadline)//period
+                    self.skipped += missed
+                    self.deadline += missed*period
+
+        if self.stopping:
+            self.stopping = False
+            return False
+
+        if now < self.deadline:
+            time.sleep((self.deadline-now)/1e9)
+            now = time.monotonic_ns()
+
+        self.cycle_start = now
+        self.deadline += period
+        return True
+
+    # the time the current cycle was released, in milliseconds on the time.monotonic_ns
+    # clock.  The time now for a caller that does not go by the scheduler
+    def cycle_ms(self):
+        if self.cycle_start is None:
+            return time.monotonic_ns()//1000000
+        return self.cycle_start//1000000
+
+    # the histogram as (upper bound in microseconds, count) pairs, empty buckets left out
+    def exec_histogram(self):
+        return [(1 << k, count) for k, count in enumerate(self.histogram) if count > 0]
+
+    def report(self):
+        lines = [f"cycles {self.cycles} overruns {self.overruns} skipped {self.skipped} "
+                 f"max exec {self.max_exec_ns/1000:.1f} us"]
+        for bound, count in self.exec_histogram():
+            lines.append(f"  < {bound:>10} us  {count}")
+        return '\n'.join(lines)
+
+# the scheduler of plc_thread_function's cycles
+plc_scan = scan_scheduler()
+
+# conversion to the python type of a variable, applied to every value moving
+# between a variable and the interface
+py_convert = {'bool': bool, 'int': int, 'float': float, 'str': str}
+
+def same_value(value):
+    return value
+
 # take a string and an identifier of its python type to return
 # data object in that type, with the named value
 def typed_value(value, py_type):
+    return py_convert.get(py_type, same_value)(value)
+
+# split a mapped name like 'pressure[3]' into the variable name and the tuple of its indices
+def split_mapped_name(name):
+    leftb = name.find('[')
+    if leftb < 0:
+        return name, ()
+    indices = tuple(int(idx) for idx in name[leftb+1:name.rfind(']')].split(']['))
+    return name[:leftb].strip(), indices
+
+# width in bytes of one position in each memory class
+mem_width = {'IX': 1, 'QX': 1, 'IW': 2, 'QW': 2, 'MW': 2, 'MD': 4, 'ML': 8}
+
+# memoryview formats of the integers and floats of each width
+signed_format   = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+unsigned_format = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+float_format    = {4: 'f', 8: 'd'}
+
+unsigned_types = ('USINT', 'UINT', 'UDINT', 'ULINT', 'BYTE', 'WORD', 'DWORD', 'LWORD')
+
+# the format through which a variable is seen in a process image of the given width,
+# or None if the variable does not fit in one position
+def image_format(width, var_type, py_type):
     match py_type:
-        case 'bool': 
-            return bool(value)
-        case 'int': 
-            return int(value)
-        case 'float': 
-            return float(value)
-        case 'str': 
-            return str(value)
+        case 'bool':
+            return '?' if width == 1 else None
+        case 'int' | 'byte':
+            if var_type in unsigned_types:
+                return unsigned_format[width]
+            return signed_format[width]
+        case 'float':
+            return float_format.get(width)
+    return None
+
+# A process_image holds the values of every position of a memory class in one
+# contiguous buffer, a byte per position for IX and QX, and 2, 4, or 8 bytes
+# per position for the word classes.  formats gives the format of the variable
+# at each position ('\0' where none is mapped), and the buffer is read and written
+# through memoryviews of those formats, so that a range of positions moves as a
+# single slice.  If some variable cannot be held that way (a STRING, say) the image
+# falls back to a list of python objects, cells, with the same interface.
+# buffer, if given, is the memory to lay the image over in place of a bytearray
+# of its own, for instance that of a Modbus table (mbd.mb_table)
+class process_image():
+    def __init__(self, width, formats, typed=True, buffer=None):
+        self.width = width
+        self.formats = formats
+        self.views = {}
+        if typed and buffer is not None and memoryview(buffer).nbytes < width*len(formats):
+            print(f"buffer of {memoryview(buffer).nbytes} bytes too small for process image of {len(formats)} positions")
+            buffer = None
+
+        if typed:
+            self.buffer = bytearray(width*len(formats)) if buffer is None else buffer
+            self.cells = None
+            for fmt in set(formats)-{'\0'}:
+                self.view(fmt)
+        else:
+            self.buffer = None
+            self.cells = [None]*len(formats)
+
+    def view(self, fmt):
+        if fmt not in self.views:
+            nbytes = self.width*len(self.formats)
+            self.views[fmt] = memoryview(self.buffer).cast('B')[:nbytes].cast(fmt)
+        return self.views[fmt]
+
+    # release the views of the buffer, so that the memory under it (a shared memory
+    # segment, say) can be closed.  The image is not used afterwards
+    def release(self):
+        for view in self.views.values():
+            view.release()
+        self.views.clear()
+
+    # values of positions [start, end), all of format fmt
+    def get_values(self, start, end, fmt):
+        if self.cells is not None:
+            return self.cells[start:end]
+        return self.views[fmt][start:end].tolist()
+
+    # write values into positions [start, end), all of format fmt
+    def put_values(self, start, end, fmt, values):
+        if self.cells is not None:
+            self.cells[start:end] = values
+            return
+
+        match fmt:
+            case '?':
+                self.view('B')[start:end] = bytes(map(operator.truth, values))
+            case 'f' | 'd':
+                try:
+                    self.views[fmt][start:end] = array.array(fmt, values)
+                except TypeError:
+                    self.views[fmt][start:end] = array.array(fmt, map(float, values))
+            case _:
+                try:
+                    self.views[fmt][start:end] = array.array(fmt, values)
+                except (TypeError, OverflowError):
+                    # not all ints, or out of range, so convert and keep the
+                    # low bits the way the PLC's memory would
+                    ufmt = unsigned_format[self.width]
+                    mask = (1 << 8*self.width)-1
+                    self.view(ufmt)[start:end] = array.array(ufmt, [int(value) & mask for value in values])
+
+    # values of positions first through last
+    def read(self, first, last):
+        end = last+1
+        fmt = self.formats[first]
+        if self.formats.count(fmt, first, end) == end-first:
+            return self.get_values(first, end, fmt)
+
+        values = []
+        for pos in range(first, end):
+            values.extend(self.get_values(pos, pos+1, self.formats[pos]))
+        return values
+
+    # write values into positions first through last
+    def write(self, first, last, values):
+        end = last+1
+        fmt = self.formats[first]
+        if self.formats.count(fmt, first, end) == end-first:
+            self.put_values(first, end, fmt, values)
+            return
+
+        for pos in range(first, end):
+            self.put_values(pos, pos+1, self.formats[pos], values[pos-first:pos-first+1])
+
+# An image_snapshot is a copy of a process image as the PLC left it at the end
+# of a cycle, together with the positions mapped when it was taken.  Nothing
+# writes to it once made, so any number of readers may hold one and read from it
+# while the PLC goes on to the next cycle, and values read from it all come from
+# the same cycle.  Taking one costs a copy of the buffer; the image readers go
+# through is laid over the copy on the first read
+class image_snapshot():
+    __slots__ = ('width', 'formats', 'data', 'image', 'firsts', 'lasts')
+
+    def __init__(self, image, firsts, lasts):
+        self.width = image.width
+        self.formats = image.formats
+        if image.cells is not None:
+            self.data = list(image.cells)
+        else:
+            self.data = bytes(image.view('B'))
+        self.image = None
+        self.firsts = firsts
+        self.lasts = lasts
+
+    # whether every position from first through last was mapped
+    def covers(self, first, last):
+        if last < first:
+            return False
+
+        idx = bisect.bisect_right(self.firsts, first)-1
+        if idx < 0 or self.lasts[idx] < first:
+            return False
+
+        while self.lasts[idx] < last:
+            idx += 1
+            if idx == len(self.firsts) or self.firsts[idx] != self.lasts[idx-1]+1:
+                return False
+        return True
+
+    def read(self, first, last):
+        image = self.image
+        if image is None:
+            if isinstance(self.data, list):
+                image = process_image(self.width, self.formats, False)
+                image.cells = self.data
+            else:
+                image = process_image(self.width, self.formats, True, self.data)
+            self.image = image
+        return image.read(first, last)
+
+# a transfer_run describes a stretch [start, end) of process image positions that
+# moves to and from the program variables in one step.   It is either a sequence of
+# scalar variables (names), or a sequence of consecutive elements [lo, hi) of one
+# array variable (base, reached through the leading indices in outer), all of one
+# python type and one image format
+class transfer_run():
+    def __init__(self, start, conv, fmt, names=None, base=None, outer=(), lo=0):
+        self.start = start
+        self.end   = start+1
+        self.conv  = conv
+        self.fmt   = fmt
+        self.names = names
+        self.base  = base
+        self.outer = outer
+        self.lo    = lo
+        self.hi    = lo+1
+
+    # try to extend the run by the variable at image position pos
+    def extend(self, pos, conv, fmt, base, indices):
+        if conv is not self.conv or fmt != self.fmt or pos != self.end:
+            return False
+
+        if self.names is not None:
+            if indices:
+                return False
+            self.names.append(base)
+        else:
+            if base != self.base or indices[:-1] != self.outer or indices[-1] != self.hi:
+                return False
+            self.hi += 1
+
+        self.end += 1
+        return True
+
+    # closures that copy the run's variables in namespace into the image, and back.
+    # The copy into the image is change-driven: the values are gathered and compared
+    # with those stored last time, as a whole, and stored only if some differ, in
+    # which case the closure returns True.  If changes is a list, the position and
+    # new value of each variable that changed is appended to it
+    def movers(self, namespace, image, changes=None):
+        start, end, conv, fmt = self.start, self.end, self.conv, self.fmt
+        put = functools.partial(image.put_values, start, end, fmt)
+        get = functools.partial(image.get_values, start, end, fmt)
+
+        # a typed image converts as it stores and loads, a list of objects does not
+        if image.cells is not None:
+            put_values = put
+            put = lambda values: put_values(list(map(conv, values)))
+            get_values = get
+            get = lambda: map(conv, get_values())
+
+        if self.names is not None:
+            names = tuple(self.names)
+            if len(names) > 1:
+                get_vars = operator.itemgetter(*names)
+            else:
+                get_vars = lambda ns, name=names[0]: (ns[name],)
+
+            def gather():
+                return get_vars(namespace)
+
+            def export_run():
+                namespace.update(zip(names, get()))
+
+            return change_driven(gather, put, start, changes), export_run
+
+        base, outer, lo, hi = self.base, self.outer, self.lo, self.hi
+
+        # the array is looked up each time since the program may assign it as a whole
+        def array_of():
+            arr = namespace[base]
+            for idx in outer:
+                arr = arr[idx]
+            return arr
+
+        def gather():
+            return array_of()[lo:hi]
+
+        def export_run():
+            array_of()[lo:hi] = get()
+
+        return change_driven(gather, put, start, changes), export_run
+
+# the closure storing the values gather returns with put only when they differ
+# from the values stored the time before, for transfer_run.movers
+def change_driven(gather, put, start, changes):
+    stored = None
+
+    if changes is None:
+        def import_run():
+            nonlocal stored
+            values = gather()
+            if values == stored:
+                return False
+            put(values)
+            stored = values
+            return True
+
+        return import_run
+
+    def import_run():
+        nonlocal stored
+        values = gather()
+        if values == stored:
+            return False
+        put(values)
+        if stored is None:
+            changes.extend(zip(range(start, start+len(values)), values))
+        else:
+            for idx, value in enumerate(values):
+                if value != stored[idx]:
+                    changes.append((start+idx, value))
+        stored = values
+        return True
+
+    return import_run
 
 # the var_seq class represents IX, QW, etc. It holds a lock to protect it from
 # concurrent access, a descriptin of the memory type of data it represents,
 # and a list of subseq instances each of which represents a contiguous sequence
-# of values
+# of variables.   Once the variables are all added their values are laid out
+# in a process_image
 class var_seq():
     def __init__(self, var_type):
         self.var_type = var_type
         self.subseqs = []
+
+        # the first position of each subseq, in order, for bisect to search
+        self.firsts = []
+        self.image = None
+        self.bound = False
+        self.shared_buffer = None
+        self.segment = None
+
+        # the image_snapshot vars_to_intrfc published last, and the first and last
+        # positions of the subseqs that go into each one
+        self.published = None
+        self.layout = ((), ())
+
+        # functions called with the var_type and the (position, value) pairs of the
+        # variables vars_to_intrfc found changed, and the list the transfers put those in
+        self.subscribers = []
+        self.changes = None
         self.thrd_lock = threading.Lock()
 
     # add_var takes a description of a variable and works in a representation for that
@@ -140,139 +1499,290 @@ class var_seq():
     #       - value    . A representation of the initial values assigned to the variable  
     def add_var(self, name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value):
         self.thrd_lock.acquire() 
+        self.release_image()
 
-        # use pos to look for the insertion point in the list of subseqs
-        for idx in range(0, len(self.subseqs)):
-            # pos specifies where in seq the variable sits
-            if pos < self.subseqs[idx].first:
-                # first subseq that dominates the location.
-                # tack it on to the previous subseq?
-                if idx>0 and self.subseqs[idx-1].last == pos-1:
-                    # pos fits at tail of previous subseq
-                    self.subseqs[idx-1].append_var(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
-
-                    # see if now the subseqs are adjacent 
-                    if self.subseqs[idx-1].last+1 == self.subseqs[idx].first:
-                        # they are adjacent, so combine them
-                        self.subseqs[idx-1].last = self.subseqs[idx].last
-                        self.subseqs[idx-1].names.extend(self.subseqs[idx].names)
-
-                        # either truncate self.subseqs[idx], or pull in the subseqs beyond it 
-                        if idx < len(self.subseqs)-1:
-                            # there are subseqs with index larger than idx
-                            tail = copy.copy(self.subseqs[idx+1:])
-                            self.subseqs[:idx].extend(tail)
-                        else:
-                            # nothing beyond idx
-                            self.subseqs = self.subseqs[:idx]
-
-                    # done with merging adjacent subseqs
-                    self.thrd_lock.release() 
-                    return True
-            
-                # did not attach to previous subseq, does it attach to the one at idx?
-                elif pos+1 == self.subseqs[idx].first:
-                    # yes it does, so call add_var to put it in
-                    self.subseqs[idx] = self.subseqs[idx].prepend_var(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
-                    self.thrd_lock.release() 
-                    return True
-                else:
-                    # variable at location idx appears before the one at location idx
-                    # make a new subseq containing only this variable
-                    new_subseq = var_subseq(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
-
-                    # remember the subseq that follows the new one
-                    if idx > 0:
-                        # a subsequence behind the inserted subseq
-                        tail = copy.copy(self.subseqs[idx:])
-                        self.subseqs = self.subseqs[:idx].append(new_subseq)
-                        self.subseqs.extend(tail)
-                    else:
-                        # inserted subseq goes to the front
-                        tail = copy.copy(self.subseqs)
-                        self.subseqs = [new_subseq]
-                        self.subseqs.extend(tail)
-
-                    self.thrd_lock.release() 
-                    return True
-
-            # pos is larger than the first element of the subseq indexed at idx.
-            # error if it falls within that subseq
-            elif pos <= self.subseqs[idx].last:
-                print(f"variable at location {pos} already defined")
-                self.thrd_lock.release() 
-                return False
+        # the index of the first subseq that starts beyond pos
+        idx = bisect.bisect_right(self.firsts, pos)
+
+        # the subseq before that one must end before pos
+        if idx > 0 and pos <= self.subseqs[idx-1].last:
+            print(f"variable at location {pos} already defined")
+            self.thrd_lock.release() 
+            return False
+
+        if idx > 0 and self.subseqs[idx-1].last+1 == pos:
+            # pos fits at tail of previous subseq
+            self.subseqs[idx-1].append_var(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)
+
+            # see if now the subseqs are adjacent, and if so combine them
+            if idx < len(self.subseqs) and pos+1 == self.subseqs[idx].first:
+                self.subseqs[idx-1].merge_var(self.subseqs[idx])
+                del self.subseqs[idx]
+                del self.firsts[idx]
+
+        elif idx < len(self.subseqs) and pos+1 == self.subseqs[idx].first:
+            # pos fits at the front of the following subseq
+            self.subseqs[idx] = self.subseqs[idx].prepend_var(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)
+            self.firsts[idx] = pos
+
+        else:
+            # make a new subseq containing only this variable
+            new_subseq = var_subseq(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)
+            self.subseqs.insert(idx, new_subseq)
+            self.firsts.insert(idx, pos)
 
-        # ran through the entire list of subseqs without finding a preceding subseq. 
-        # if there was a last subseq see if this joins it
-        if len(self.subseqs) > 0:
-            if self.subseqs[-1].last+1 == pos:
-                self.subseqs[-1].append_var(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
-                self.thrd_lock.release() 
-                return True
-
-        # no, so add a new one at the end
-        new_subseq = var_subseq(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
-        self.subseqs.append(new_subseq)
         self.thrd_lock.release() 
         return True 
 
-    # transfer the values of all variables represented to to the subseq data structure that represents them
+    # index of the subseq holding position pos, or -1 if none does
+    def find_subseq(self, pos):
+        idx = bisect.bisect_right(self.firsts, pos)-1
+        if idx >= 0 and pos <= self.subseqs[idx].last:
+            return idx
+        return -1
+
+    # whether every position from first through last is held by some subseq,
+    # the range possibly spanning subseqs that follow each other without a gap
+    def covers(self, first, last):
+        if last < first:
+            return False
+
+        idx = self.find_subseq(first)
+        if idx < 0:
+            return False
+
+        while self.subseqs[idx].last < last:
+            idx += 1
+            if idx == len(self.subseqs) or self.subseqs[idx].first != self.subseqs[idx-1].last+1:
+                return False
+        return True
+
+    # lay out the values of the subseqs in a process image of the memory class,
+    # the positions from 0 through the last mapped one
+    def build_image(self):
+        width = mem_width.get(self.var_type, 8)
+        size = self.subseqs[-1].last+1 if len(self.subseqs) > 0 else 0
+
+        formats = ['\0']*size
+        typed = True
+        for subseq in self.subseqs:
+            for idx in range(0, len(subseq.var_desc)):
+                vard = subseq.var_desc[idx]
+                fmt = image_format(width, vard.var_type, vard.py_type)
+                if fmt is None:
+                    typed = False
+                    fmt = 'O'
+                formats[subseq.first+idx] = fmt
+
+        self.image = process_image(width, ''.join(formats), typed, self.shared_buffer)
+        self.layout = (tuple(self.firsts), tuple(subseq.last for subseq in self.subseqs))
+        for subseq in self.subseqs:
+            # a segment another process created already holds the values
+            if self.segment is None or self.segment.created:
+                self.image.write(subseq.first, subseq.last, subseq.values)
+
+            # from here on the values live in the image
+            subseq.values = None
+
+    # take the values back out of the image into the subseqs, so that the
+    # subseqs can change and a new image be built afterwards
+    def release_image(self):
+        if self.image is None:
+            return
+        for subseq in self.subseqs:
+            subseq.values = self.image.read(subseq.first, subseq.last)
+        self.image = None
+        self.published = None
+        self.bound = False
+
+    # let go of the process image and the buffer under it, releasing the views the image
+    # has of the buffer, before the shared memory segment it is laid over is closed
+    def release(self):
+        self.thrd_lock.acquire()
+        if self.image is not None:
+            self.image.release()
+            self.image = None
+        self.published = None
+        self.bound = False
+        self.shared_buffer = None
+        self.segment = None
+        self.thrd_lock.release()
+
+    # have the process image laid over buffer, the buffer of a Modbus table say,
+    # so that the table and the variables of this memory class share values
+    # without a copy between them.  Takes effect when the image is next built
+    def share_buffer(self, buffer):
+        self.thrd_lock.acquire()
+        self.release_image()
+        self.shared_buffer = buffer
+        self.thrd_lock.release()
+
+    # have the process image laid over the data of a shared memory segment
+    # (shmem.shared_segment), reached by other processes.  Every transfer to or from
+    # the image then goes through the seqlock of the segment
+    def share_segment(self, segment):
+        self.share_buffer(segment.data)
+        self.segment = segment
+
+    # bytes in the process image, None if it is a list of python objects
+    def image_bytes(self):
+        self.thrd_lock.acquire()
+        if self.image is None:
+            self.build_image()
+        nbytes = None if self.image.cells is not None else self.image.width*len(self.image.formats)
+        self.thrd_lock.release()
+        return nbytes
+
+    # compile the transfers of every subseq against the variables in namespace
+    def compile_transfers(self, namespace):
+        if self.image is None:
+            self.build_image()
+        self.changes = [] if self.subscribers else None
+        for subseq in self.subseqs:
+            subseq.compile_transfer(namespace, self.image, self.changes)
+        self.bound = True
+
+    def bind(self, namespace):
+        self.thrd_lock.acquire()
+        self.compile_transfers(namespace)
+        self.thrd_lock.release()
+
+    # transfer the values of the variables represented that changed since the last transfer
+    # to the process image that represents them, then publish a snapshot of the image for
+    # readers to take without the lock, and tell the subscribers what changed
     def vars_to_intrfc(self):
         self.thrd_lock.acquire() 
+        if not self.bound:
+            self.compile_transfers(globals())
+        segment = self.segment
+        if segment is not None:
+            segment.begin_write()
+        changed = False
         for subseq in self.subseqs:
-            subseq.import_values()
+            if subseq.import_values():
+                changed = True
+        if segment is not None:
+            segment.end_write()
+        if changed or self.published is None:
+            self.published = image_snapshot(self.image, *self.layout)
+
+        changes = None
+        if self.changes:
+            changes = self.changes[:]
+            self.changes.clear()
         self.thrd_lock.release() 
 
+        # called without the lock, so that a subscriber may read the values
+        if changes:
+            for subscriber in self.subscribers:
+                subscriber(self.var_type, changes)
+
+    # have subscriber called with the var_type and a list of the (position, value) pairs
+    # of the variables found changed, each time vars_to_intrfc finds some
+    def subscribe(self, subscriber):
+        self.thrd_lock.acquire()
+        self.subscribers.append(subscriber)
+        self.bound = False
+        self.thrd_lock.release()
+
+    def unsubscribe(self, subscriber):
+        self.thrd_lock.acquire()
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+            self.bound = False
+        self.thrd_lock.release()
+
+    # push each variable that changes to its index (mb_idx) in a Modbus table
+    # (mbd.mb_table) as vars_to_intrfc finds it changed.  Returns the subscriber, for unsubscribe
+    def mirror_to_table(self, table):
+        self.thrd_lock.acquire()
+        mb_index = {}
+        for subseq in self.subseqs:
+            for idx in range(0, len(subseq.var_desc)):
+                mb_index[subseq.first+idx] = subseq.var_desc[idx].mb_idx
+        self.thrd_lock.release()
+
+        def mirror(var_type, changes):
+            for pos, value in changes:
+                if not mbd.setTableValues(table, mb_index[pos], [value]):
+                    print(f"problem mirroring {var_type} position {pos} to Modbus index {mb_index[pos]}")
+
+        self.subscribe(mirror)
+        return mirror
+
     # transfer the values of interface values mapped to this instance to their variable representation in the program
     def intrfc_to_vars(self):       
         self.thrd_lock.acquire() 
-        for subseq in self.subseqs:
-            subseq.export_vars()
+        if not self.bound:
+            self.compile_transfers(globals())
+        segment = self.segment
+        if segment is None:
+            for subseq in self.subseqs:
+                subseq.export_vars()
+        else:
+            # take the values again if the process writing the image changed it meanwhile
+            while True:
+                seq = segment.begin_read()
+                for subseq in self.subseqs:
+                    subseq.export_vars()
+                if not segment.read_retry(seq):
+                    break
         self.thrd_lock.release() 
 
-    # look for a subseq list containing memory values in the indicated range
+    # look for the subseqs containing memory values in the indicated range
     # return whether successful and the range, or not.  Called by the digital twin
-    # to acquire values from the interface list
+    # to acquire values from the interface list.  Once the PLC has published a
+    # snapshot of the image the values come from it, without waiting on the lock
     def read_values(self, first, last):
+        snapshot = self.published
+        if snapshot is not None:
+            if snapshot.covers(first, last):
+                return True, snapshot.read(first, last)
+            return False, []
+
         values = []
         success = False
         self.thrd_lock.acquire() 
 
-        # examine each subseq
-        for subseq in self.subseqs:
-            # does it contain the range of interest?
-            if subseq.first <= first and last <= subseq.last:
-                # yes, so copy the values in the interface list into the values list
-                first_idx = first-subseq.first
-                values = copy.copy(subseq.values[first_idx:last-first+1])
-                success = True
+        if self.covers(first, last):
+            # copy the values out of the process image
+            if self.image is None:
+                self.build_image()
+            if self.segment is None:
+                values = self.image.read(first, last)
+            else:
+                while True:
+                    seq = self.segment.begin_read()
+                    values = self.image.read(first, last)
+                    if not self.segment.read_retry(seq):
+                        break
+            success = True
 
         self.thrd_lock.release()
 
         # return the found values
         return success, values
 
-    # look for a list containing memory values in the indicated range
-    # and write.  Used by the digital twin to export its state to the interface
+    # look for the subseqs containing memory values in the indicated range
+    # and write.  Used by the digital twin to export its state to the interface,
+    # and by take_over.  The snapshot published last no longer holds what the image
+    # does, so it is dropped, and read_values reads the image until vars_to_intrfc
+    # publishes again
     def write_values(self, first, last, values):
         success = False
         self.thrd_lock.acquire() 
 
-        for subseq in self.subseqs:
-            # does this subseq contain the range of interest?
-            if subseq.first <= first and last <= subseq.last:
-                # yes, so write the range's values into the subseq values list
-                jdx = 0
-                for pos in range(first, last+1):
-                    # calculate the position in the values list
-                    idx = pos-subseq.first
-            
-                    # copy in the value
-                    subseq.values[idx] = values[jdx]
-                    jdx += 1
-
-                success = True
+        if self.covers(first, last):
+            # write the range's values into the process image
+            if self.image is None:
+                self.build_image()
+            if self.segment is not None:
+                self.segment.begin_write()
+            self.image.write(first, last, values)
+            if self.segment is not None:
+                self.segment.end_write()
+            self.published = None
+            success = True
 
         self.thrd_lock.release()
         return success
@@ -282,8 +1792,11 @@ class var_seq():
 # holds an ordered list of these
 # 
 class var_desc():
-    def __init__(self, name, py_type, mem_class, mem_adrs, pos, mb_idx):
+    __slots__ = ('name', 'var_type', 'py_type', 'mem_class', 'mem_adrs', 'pos', 'mb_idx')
+
+    def __init__(self, name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx):
         self.name = name
+        self.var_type = var_type
         self.py_type = py_type
         self.mem_class = mem_class
         self.mem_adrs = mem_adrs
@@ -291,9 +1804,10 @@ class var_desc():
         self.mb_idx = mb_idx
 
 # The var_subseq class represents a sequence of variables that are contiguous
-# in their ST memory class data structure
+# in their ST memory class data structure.  values holds their initial values
+# until the var_seq lays them out in its process image
 class var_subseq():
-    def __init__(self, name, py_type, mem_class, mem_adrs, pos, mb_idx, value):
+    def __init__(self, name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value):
 
         # a subseq can represent a sequence of variables, but since we are just creating
         # new subseq instance the first and last elements have the same position in the ST memory
@@ -306,7 +1820,7 @@ class var_subseq():
         self.mb_last  = mb_idx
 
         # initialize the list of variable descriptors with a list of a single element
-        self.var_desc = [var_desc(name, py_type, mem_class, mem_adrs, pos, mb_idx)]
+        self.var_desc = [var_desc(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx)]
 
         match py_type:
             case 'int':
@@ -329,6 +1843,10 @@ class var_subseq():
 
         self.values   = [value]
 
+        # closures moving values to and from the variables, built by compile_transfer
+        self.importers = None
+        self.exporters = None
+
     # given a subseq instance to be adjoined from the right, combine its description
     # into the self instance
     def merge_var(self, successor):
@@ -343,54 +1861,63 @@ class var_subseq():
         # extend the list of variable descriptors by those of the successor
         self.var_desc.extend(successor.var_desc)
 
+        # the transfers no longer cover the whole subseq
+        self.importers = None
+        self.exporters = None
+
     # given a subseq instance on the right to be adjoined to, create it and merge
     # the self instance into it
-    def append_var(self, name, py_type, mem_class, mem_adrs, pos, mb_idx, value):
-        new_subseq = var_subseq(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
+    def append_var(self, name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value):
+        new_subseq = var_subseq(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)
         self.merge_var(new_subseq)
     
     # given a subseq instance on the left to be adjoined to, create it and merge the
     # self instance into it   
-    def prepend_var(self, name, py_type, mem_class, mem_adrs, pos, mb_idx, value):
-        new_subseq = var_subseq(name, py_type, mem_class, mem_adrs, pos, mb_idx, value)
+    def prepend_var(self, name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value):
+        new_subseq = var_subseq(name, var_type, py_type, mem_class, mem_adrs, pos, mb_idx, value)
         new_subseq.merge_var(self)
         return new_subseq
 
-    # copy all the values in the variables into the values list
-    def import_values(self):
-        for idx in range(0, len(self.var_desc)):
-            vard = self.var_desc[idx] 
-            name = vard.name
-            py_type = vard.py_type
-            match py_type:
-                case 'bool':
-                    value = bool(eval(name))
-                case 'int':
-                    value = int(eval(name))
-                case 'float':
-                    value = float(eval(name))
-                case 'str':
-                    value = str(eval(name))
-            
-            self.values[idx] = value
-
-    # export the values into to the named variables
-    def export_vars(self):
+    # group the variables into runs that each move a slice of the process image in a
+    # single step, and keep the closures that do it, so that the transfer on every
+    # cycle neither parses names nor calls eval
+    def compile_transfer(self, namespace, image, changes=None):
+        runs = []
         for idx in range(0, len(self.var_desc)):
             vard = self.var_desc[idx]
-            name = vard.name
-            py_type = vard.py_type
-            value = self.values[idx]
-
-            # names with '[' are array references
-            if name.find('[') > 0:
-                leftb  = name.find('[')+1
-                rightb = name.find(']')
-                jdx = int(name[leftb:rightb].strip())
-                name = name[:leftb-1]
-                globals()[name][jdx] = typed_value(value, py_type)
+            pos = self.first+idx
+            base, indices = split_mapped_name(vard.name)
+            conv = py_convert.get(vard.py_type, same_value)
+            fmt = image.formats[pos]
+
+            if runs and runs[-1].extend(pos, conv, fmt, base, indices):
+                continue
+
+            if indices:
+                runs.append(transfer_run(pos, conv, fmt, base=base, outer=indices[:-1], lo=indices[-1]))
             else:
-                globals()[name] = typed_value(value, py_type)
+                runs.append(transfer_run(pos, conv, fmt, names=[base]))
+
+        self.importers = []
+        self.exporters = []
+        for run in runs:
+            import_run, export_run = run.movers(namespace, image, changes)
+            self.importers.append(import_run)
+            self.exporters.append(export_run)
+
+    # copy the values in the variables that changed into the process image,
+    # returning whether any did
+    def import_values(self):
+        changed = False
+        for import_run in self.importers:
+            if import_run():
+                changed = True
+        return changed
+
+    # export the values in the process image into to the named variables
+    def export_vars(self):
+        for export_run in self.exporters:
+            export_run()
 
 # create the global instances of the ST memory structures
 IX_seq = var_seq('IX')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# micro-benchmark of the per-cycle transfer between PLC variables and the
+# interface done by top_of_cycle_import and bottom_of_cycle_export in aux.py.
+# Maps a mix of scalar and array variables into IW and QW and reports the
+# nanoseconds spent per mapped point in each direction.  The export to QW only
+# stores what changed, so -changed sets the percentage of the scalar variables
+# given new values before each export (the time to assign them included).
+#
+import argparse
+import array
+import bisect
+import copy
+import functools
+import operator
+import sys
+import threading
+import time
+
+# load the interface file the way pyST.py would, as module level code of the
+# PLC program, here with a namespace standing in for that module
+def load_intrfc(intrfc_file):
+    with open(intrfc_file, 'r') as rf:
+        code = rf.read()
+    namespace = {'__name__': 'plc', 'array': array, 'bisect': bisect, 'copy': copy, 'functools': functools,
+        'operator': operator, 'threading': threading, 'time': time}
+    exec(compile(code, intrfc_file, 'exec'), namespace)
+    return namespace
+
+# create num_points program variables, half of them scalars and half of them
+# elements of arrays of 16, and the location map entries mapping them into mem_class
+def make_loc_map(namespace, num_points, mem_class):
+    var_dicts = []
+    pos = 0
+    while pos < num_points:
+        if (pos//16)%2 == 0:
+            names = []
+            for idx in range(0, 16):
+                name = f"v{pos+idx}"
+                namespace[name] = pos+idx
+                names.append(name)
+        else:
+            name = f"a{pos}"
+            namespace[name] = list(range(pos, pos+16))
+            names = [f"{name}[{idx}]" for idx in range(0, 16)]
+
+        for name in names[:num_points-pos]:
+            var_dicts.append({'name': name, 'var_type': 'INT', 'py_type': 'int',
+                'mem_code': f"{mem_class}{pos}", 'pos': pos, 'value': 0, 'mb_idx': pos})
+            pos += 1
+
+    return var_dicts
+
+def time_calls(func, repeat, number):
+    best = None
+    for rep in range(0, repeat):
+        start = time.perf_counter_ns()
+        for call in range(0, number):
+            func()
+        elapsed = (time.perf_counter_ns()-start)/number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'-intrfc', metavar = u'name of file with interface code',
+                        dest=u'intrfc_file', default='aux.py')
+    parser.add_argument(u'-points', metavar = u'comma separated numbers of mapped points',
+                        dest=u'points', default='10,100,1000,10000')
+    parser.add_argument(u'-changed', metavar = u'percentage of scalar variables changed each cycle',
+                        dest=u'changed', default='0')
+    parser.add_argument(u'-repeat', metavar = u'runs per size, best is reported',
+                        dest=u'repeat', default='5')
+    args = parser.parse_args(sys.argv[1:])
+
+    print(f"{'points':>8} {'import ns/pt':>14} {'export ns/pt':>14}")
+    for points in args.points.split(','):
+        num_points = int(points)
+        namespace = load_intrfc(args.intrfc_file)
+        loc_map = make_loc_map(namespace, num_points, 'QW')
+        loc_map.extend(make_loc_map(namespace, num_points, 'IW'))
+        namespace['build_loc_map'](loc_map)
+
+        # the scalars mapped to QW that change every cycle
+        scalars = [var_dict['name'] for var_dict in loc_map[:num_points] if '[' not in var_dict['name']]
+        changing = scalars[:len(scalars)*int(args.changed)//100]
+        bottom_of_cycle_export = namespace['bottom_of_cycle_export']
+
+        def export_cycle():
+            for name in changing:
+                namespace[name] += 1
+            bottom_of_cycle_export()
+
+        # repeat enough calls that a timed run covers about 100k point transfers
+        number = max(1, 100000//num_points)
+        repeat = int(args.repeat)
+        import_ns = time_calls(namespace['top_of_cycle_import'], repeat, number)
+        export_ns = time_calls(export_cycle, repeat, number)
+        print(f"{num_points:>8} {import_ns/num_points:>14.1f} {export_ns/num_points:>14.1f}")
+
+if __name__ == "__main__":
+    main()
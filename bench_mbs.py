@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# load benchmark of the Modbus server in mbs.py.  Runs the server in a process
+# of its own, opens many client connections to it, and has every client poll
+# holding registers back to back, possibly several requests in flight on each
+# connection, reporting the latency percentiles of the requests and the request
+# rate the server sustained.
+#
+import argparse
+import collections
+import multiprocessing
+import resource
+import selectors
+import socket
+import struct
+import sys
+import time
+
+import mbaux
+import mbs
+
+def run_server(host, port, mode, max_conns, tablesize):
+    mbs.setup_server(tablesize, host, port, mode, max_conns)
+    mbs.srvr_thread_function(mbs.srvr_sock, False)
+
+# let this process have descriptors enough for all of its sockets
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+def connect(host, port, wait):
+    deadline = time.monotonic()+wait
+    while True:
+        try:
+            return socket.create_connection((host, port))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+# every client keeps depth requests outstanding on its connection, sending the next
+# as soon as the response to the oldest one is complete.  Returns the latencies in seconds
+def drive_clients(socks, num_requests, num_regs, depth):
+    sel = selectors.DefaultSelector()
+    latencies = []
+    state = {}
+
+    # the response to reading num_regs registers has this many bytes
+    rsp_len = 9+2*num_regs
+
+    def send_requests(sock, count):
+        client = state[sock]
+        msgs = []
+        for idx in range(0, count):
+            msg = mbaux.read_HoldingRegistersMsg(0, num_regs, 1)
+            msgs.append(struct.pack('>H', client['sent'] & 0xFFFF) + msg[2:])
+            client['sent'] += 1
+        sock.sendall(b''.join(msgs))
+        now = time.perf_counter()
+        client['sent_at'].extend([now]*count)
+
+    for sock in socks:
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        state[sock] = {'sent': 0, 'done': 0, 'sent_at': collections.deque(), 'buf': bytearray()}
+        sel.register(sock, selectors.EVENT_READ)
+        send_requests(sock, min(depth, num_requests))
+
+    active = len(socks)
+    while active > 0:
+        for key, events in sel.select():
+            sock = key.fileobj
+            client = state[sock]
+            data = sock.recv(65536)
+            if not data:
+                raise RuntimeError("server closed a client connection")
+
+            buf = client['buf']
+            buf += data
+            now = time.perf_counter()
+            received = 0
+            while len(buf) >= rsp_len:
+                del buf[:rsp_len]
+                latencies.append(now-client['sent_at'].popleft())
+                received += 1
+            client['done'] += received
+
+            more = min(received, num_requests-client['sent'])
+            if more > 0:
+                send_requests(sock, more)
+            if client['done'] == num_requests:
+                sel.unregister(sock)
+                active -= 1
+
+    return latencies
+
+def percentile(ordered, pct):
+    idx = min(len(ordered)-1, int(pct*len(ordered)/100))
+    return ordered[idx]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'-mode', metavar = u'server mode, threads or events',
+                        dest=u'mode', default='events')
+    parser.add_argument(u'-clients', metavar = u'number of concurrent clients',
+                        dest=u'clients', default='1000')
+    parser.add_argument(u'-requests', metavar = u'requests made by each client',
+                        dest=u'requests', default='20')
+    parser.add_argument(u'-regs', metavar = u'holding registers read per request',
+                        dest=u'regs', default='10')
+    parser.add_argument(u'-depth', metavar = u'requests each client keeps in flight',
+                        dest=u'depth', default='1')
+    parser.add_argument(u'-port', metavar = u'server port',
+                        dest=u'port', default='5502')
+    args = parser.parse_args(sys.argv[1:])
+
+    host = '127.0.0.1'
+    port = int(args.port)
+    num_clients = int(args.clients)
+    raise_fd_limit(num_clients+64)
+
+    server = multiprocessing.Process(target=run_server,
+        args=(host, port, args.mode, num_clients, 100), daemon=True)
+    server.start()
+
+    try:
+        socks = [connect(host, port, 10.0)]
+        for idx in range(1, num_clients):
+            socks.append(connect(host, port, 10.0))
+
+        start = time.perf_counter()
+        latencies = drive_clients(socks, int(args.requests), int(args.regs), int(args.depth))
+        elapsed = time.perf_counter()-start
+    finally:
+        server.terminate()
+
+    latencies.sort()
+    print(f"mode {args.mode}  clients {num_clients}  depth {args.depth}  requests {len(latencies)}  "
+          f"{len(latencies)/elapsed:.0f} req/s")
+    for pct in (50, 90, 99, 99.9):
+        print(f"  p{pct:<5} {1000*percentile(latencies, pct):8.2f} ms")
+    print(f"  max    {1000*latencies[-1]:8.2f} ms")
+
+    for sock in socks:
+        sock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# benchmark of the Modbus payload codecs in mbstruct.py and mbaux.py against
+# the bit-at-a-time and register-at-a-time versions they replaced, kept below as
+# legacy_*.  For coil and discrete input payloads of 1 to 2000 bits it reports
+# microseconds per call to encode and decode, and for register payloads of 1 to
+# 125 registers the registers per second encoded and decoded, checking on the
+# way that old and new agree.
+#
+import argparse
+import random
+import struct
+import sys
+import time
+
+import mbaux
+import mbstruct
+
+# the encoder mbstruct.make_bitmask_list used to be
+def legacy_make_bitmask_list(codes):
+    lenCodes = len(codes)
+    numCodes = int(lenCodes/8)
+    if lenCodes%8 != 0:
+        numCodes += 1
+
+    codePos = 0
+    for code in range(0,numCodes):
+        bitByte = 0x0
+        for pos in range(codePos, min(codePos+8, lenCodes)):
+            if pos%8 == 0:
+                msk = 0x01
+            if codes[pos]:
+                bitByte |= msk
+            msk <<= 1
+
+        if code==0:
+            rtn = struct.pack('B', bitByte)
+        else:
+            rtn = rtn + struct.pack('B', bitByte)
+        codePos += 8
+
+    return rtn
+
+# the decoder mbstruct.unpack_bits_pdu used to be
+def legacy_unpack_bits_pdu(msg):
+    adrs, num_bits, num_bytes = struct.unpack('>HHB',msg[:5])
+    codes = []
+    bits = msg[5:]
+    cnt_bits = num_bits
+
+    for bitByte in bits:
+        msk = 0x01
+        for pos in range(0,8):
+            if cnt_bits == 0:
+                break
+            if msk & bitByte:
+                codes.append(True)
+            else:
+                codes.append(False)
+            msk = msk << 1
+            cnt_bits -= 1
+
+    return adrs, num_bits, codes
+
+# the encoder mbstruct.make_values_list used to be
+def legacy_make_values_list(values):
+    rtn = struct.pack('>H', values[0])
+    for pos in range(1,len(values)):
+        rtn = rtn + struct.pack('>H', values[pos])
+
+    return rtn
+
+# the decoder mbstruct.unpack_write_registers_pdu used to be
+def legacy_unpack_write_registers_pdu(msg):
+    adrs, numValues, numBytes = struct.unpack('>HHB', msg[:5])
+
+    values = []
+    for idx in range(5, 5+2*numValues, 2):
+        value = struct.unpack('>H', msg[idx:idx+2])
+        values.append(value[0])
+
+    return adrs, numValues, values
+
+# the decoder mbaux.readValueListRtn used to be
+def legacy_readValueListRtn(rtn):
+    numBytes = rtn[0]
+    rtn = rtn[1:]
+    values  = []
+    while numBytes > 0:
+        value = struct.unpack('>H', rtn[:2])
+        values.append(value[0])
+        rtn = rtn[2:]
+        numBytes -= 2
+
+    return values
+
+# best time per call, in microseconds
+def time_call(func, args, repeat, number):
+    best = None
+    for rep in range(0, repeat):
+        start = time.perf_counter()
+        for call in range(0, number):
+            func(*args)
+        elapsed = (time.perf_counter()-start)/number
+        if best is None or elapsed < best:
+            best = elapsed
+    return 1e6*best
+
+def bench_bits(sizes, repeat):
+    print(f"{'bits':>6} {'encode old':>11} {'encode new':>11} {'x':>6} "
+          f"{'decode old':>11} {'decode new':>11} {'x':>6}   (us per call)")
+    for num_bits in sizes:
+        codes = [random.random() < 0.5 for idx in range(0, num_bits)]
+        payload = mbstruct.make_bitmask_list(codes)
+        pdu = struct.pack('>HHB', 0, num_bits, len(payload)) + payload
+
+        if payload != legacy_make_bitmask_list(codes):
+            print(f"error: encodings of {num_bits} bits differ")
+        if mbstruct.unpack_bits_pdu(pdu) != legacy_unpack_bits_pdu(pdu):
+            print(f"error: decodings of {num_bits} bits differ")
+        if mbaux.readBitListRtn(bytes([len(payload)])+payload, num_bits) != codes:
+            print(f"error: readBitListRtn of {num_bits} bits is wrong")
+
+        number = max(10, 20000//num_bits)
+        enc_old = time_call(legacy_make_bitmask_list, (codes,), repeat, number)
+        enc_new = time_call(mbstruct.make_bitmask_list, (codes,), repeat, number)
+        dec_old = time_call(legacy_unpack_bits_pdu, (pdu,), repeat, number)
+        dec_new = time_call(mbstruct.unpack_bits_pdu, (pdu,), repeat, number)
+        print(f"{num_bits:>6} {enc_old:>11.2f} {enc_new:>11.2f} {enc_old/enc_new:>6.1f} "
+              f"{dec_old:>11.2f} {dec_new:>11.2f} {dec_old/dec_new:>6.1f}")
+
+def bench_registers(sizes, repeat):
+    print(f"{'regs':>6} {'encode old':>11} {'encode new':>11} {'into buf':>11} "
+          f"{'decode old':>11} {'decode new':>11} {'rtn old':>11} {'rtn new':>11}   (M registers/s)")
+    buffer = bytearray(2*mbstruct.max_registers)
+    for num_regs in sizes:
+        values = [random.randrange(0, 65536) for idx in range(0, num_regs)]
+        payload = mbstruct.make_values_list(values)
+        pdu = struct.pack('>HHB', 0, num_regs, len(payload)) + payload
+        rtn = bytes([len(payload)]) + payload
+
+        if payload != legacy_make_values_list(values):
+            print(f"error: encodings of {num_regs} registers differ")
+        if mbstruct.unpack_write_registers_pdu(pdu) != legacy_unpack_write_registers_pdu(pdu):
+            print(f"error: decodings of {num_regs} registers differ")
+        if mbaux.readValueListRtn(rtn) != legacy_readValueListRtn(rtn):
+            print(f"error: readValueListRtn of {num_regs} registers differs")
+
+        number = max(10, 20000//num_regs)
+        rates = []
+        for func, args in ((legacy_make_values_list, (values,)),
+                           (mbstruct.make_values_list, (values,)),
+                           (mbstruct.pack_values_into, (buffer, 0, values)),
+                           (legacy_unpack_write_registers_pdu, (pdu,)),
+                           (mbstruct.unpack_write_registers_pdu, (pdu,)),
+                           (legacy_readValueListRtn, (rtn,)),
+                           (mbaux.readValueListRtn, (rtn,))):
+            usec = time_call(func, args, repeat, number)
+            rates.append(num_regs/usec)
+        print(f"{num_regs:>6} " + ' '.join(f"{rate:>11.2f}" for rate in rates))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'-bits', metavar = u'comma separated numbers of bits',
+                        dest=u'bits', default='1,8,16,100,500,1000,2000')
+    parser.add_argument(u'-regs', metavar = u'comma separated numbers of registers',
+                        dest=u'regs', default='1,10,60,125')
+    parser.add_argument(u'-repeat', metavar = u'runs per size, best is reported',
+                        dest=u'repeat', default='5')
+    args = parser.parse_args(sys.argv[1:])
+
+    random.seed(1)
+    bench_bits([int(size) for size in args.bits.split(',')], int(args.repeat))
+    print()
+    bench_registers([int(size) for size in args.regs.split(',')], int(args.repeat))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# benchmark of the ST to python translation in pyST.py.  Generates ST programs
+# made of nested IF and CASE blocks, from about 1k to 100k lines, and reports
+# the translation time per line, which should stay flat as the programs grow.
+# Then spreads the same blocks over many FUNCTION_BLOCKs and reports the peak
+# memory of translating the file all at once and a unit at a time (-stream).
+#
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pyST
+
+# one block of generated ST, nesting IFs inside CASE branches inside IFs
+def st_block(k):
+    return f"""
+  IF state{k%4} > {k%7} THEN
+    CASE sel OF
+      0:  // branch 0 of block {k}
+        IF a < b THEN
+          IF b < c THEN
+            count := count + 1;
+          ELSIF c > {k} THEN
+            count := count - 1;
+          ELSE
+            a := a + b * 2;
+          END_IF;
+        END_IF;
+      1, 2:
+        FOR i := 0 TO 3 DO
+          IF flags[i] THEN
+            b := b + i;
+          END_IF;
+        END_FOR;
+      3..5:
+        WHILE c > 0 DO
+          c := c - 1;
+        END_WHILE;
+    ELSE
+      sel := 0;
+    END_CASE;
+  ELSE
+    state{k%4} := state{k%4} + 1;
+  END_IF;
+"""
+
+def make_program(num_lines):
+    head = """PROGRAM bench
+  VAR
+    state0, state1, state2, state3 : INT := 0;
+    sel AT %MW0 : INT := 0;
+    a, b, c, i, count : INT := 0;
+    flags AT %IX0.0 : ARRAY[0..3] OF BOOL;
+  END_VAR
+"""
+    blocks = [head]
+    lines = head.count('\n')
+    k = 0
+    while lines < num_lines:
+        blk = st_block(k)
+        blocks.append(blk)
+        lines += blk.count('\n')
+        k += 1
+    blocks.append('END_PROGRAM\n')
+    return ''.join(blocks)
+
+# the blocks of make_program spread over function blocks of about unit_lines lines
+# each, with a program calling an instance of each
+def make_units(num_lines, unit_lines):
+    head = """  VAR
+    state0, state1, state2, state3 : INT := 0;
+    sel, a, b, c, i, count : INT := 0;
+    flags : ARRAY[0..3] OF BOOL;
+  END_VAR
+"""
+    units = []
+    lines = 0
+    k = 0
+    while lines < num_lines:
+        blocks = [f"FUNCTION_BLOCK unit{len(units)}\n", head]
+        unit = 0
+        while unit < unit_lines:
+            blk = st_block(k)
+            blocks.append(blk)
+            unit += blk.count('\n')
+            k += 1
+        blocks.append('END_FUNCTION_BLOCK\n\n')
+        units.append(''.join(blocks))
+        lines += unit
+
+    program = ['PROGRAM bench\n  VAR\n']
+    program.extend(f"    u{idx} : unit{idx};\n" for idx in range(0, len(units)))
+    program.append('  END_VAR\n')
+    program.extend(f"  u{idx}();\n" for idx in range(0, len(units)))
+    program.append('END_PROGRAM\n')
+    return ''.join(units)+''.join(program), len(units)
+
+def time_translation(st_code, repeat):
+    best = None
+    for rep in range(0, repeat):
+        start = time.perf_counter()
+        pyST.ConvertorApp(pyST.TranslationJob('', '')).convert_st_to_python(st_code)
+        elapsed = time.perf_counter()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+# seconds and peak bytes allocated translating st_file all at once or a unit at a time
+def measure(st_file, stream):
+    tracemalloc.start()
+    start = time.perf_counter()
+    job = pyST.TranslationJob(st_file, '')
+    convertor = pyST.ConvertorApp(job)
+    if stream:
+        with open(os.devnull, 'w') as wf:
+            convertor.convert_stream(wf)
+    else:
+        convertor.convert()
+        job.add_pous()
+    elapsed = time.perf_counter()-start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'-sizes', metavar = u'comma separated program sizes in lines',
+                        dest=u'sizes', default='1000,10000,100000')
+    parser.add_argument(u'-repeat', metavar = u'runs per size, best is reported',
+                        dest=u'repeat', default='3')
+    parser.add_argument(u'-unit', metavar = u'lines per FUNCTION_BLOCK in the memory comparison',
+                        dest=u'unit', default='1000')
+    args = parser.parse_args(sys.argv[1:])
+
+    print(f"{'lines':>8} {'seconds':>10} {'us/line':>10}")
+    for size in args.sizes.split(','):
+        st_code = make_program(int(size))
+        num_lines = st_code.count('\n')
+        elapsed = time_translation(st_code, int(args.repeat))
+        print(f"{num_lines:>8} {elapsed:>10.3f} {1e6*elapsed/num_lines:>10.2f}")
+
+    print()
+    print(f"{'lines':>8} {'units':>6} {'full s':>8} {'full MB':>8} {'stream s':>9} {'stream MB':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        st_file = os.path.join(tmp_dir, 'bench.st')
+        for size in args.sizes.split(','):
+            st_code, num_units = make_units(int(size), int(args.unit))
+            with open(st_file, 'w') as wf:
+                wf.write(st_code)
+            num_lines = st_code.count('\n')
+            del st_code
+
+            full_s, full_peak = measure(st_file, False)
+            stream_s, stream_peak = measure(st_file, True)
+            print(f"{num_lines:>8} {num_units:>6} {full_s:>8.3f} {full_peak/2**20:>8.1f} "
+                  f"{stream_s:>9.3f} {stream_peak/2**20:>10.1f}")
+
+if __name__ == "__main__":
+    main()
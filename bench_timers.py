@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# benchmark of the timer_pool in aux.py, which keeps the running TON, TOF and TP
+# timers in a hierarchical timing wheel, against the pool it replaced, kept below
+# as legacy_timer_pool, which looked at every running timer whenever one expired.
+# Starts a number of timers with long presets that stay idle through the run,
+# then runs cycles in which a few short timers are started and expire, and
+# reports the microseconds per cycle spent starting timers and ticking the pool,
+# checking on the way that the two pools expire the same timers.
+#
+import argparse
+import array
+import bisect
+import copy
+import functools
+import operator
+import random
+import sys
+import threading
+import time
+
+# the states of a timer, as in aux.py
+timer_idle    = 0
+timer_running = 1
+timer_expired = 2
+
+# the timer_pool of aux.py before it had the timing wheel
+class legacy_timer_pool():
+    def __init__(self):
+        self.now = 0
+        self.begin = array.array('q')
+        self.deadline = array.array('q')
+        self.state = bytearray()
+
+        self.running = set()
+        self.earliest = None
+
+    def add(self):
+        self.begin.append(0)
+        self.deadline.append(0)
+        self.state.append(timer_idle)
+        return len(self.state)-1
+
+    def tick(self, now):
+        self.now = now
+        if self.earliest is None or now < self.earliest:
+            return
+
+        deadline = self.deadline
+        expired = [slot for slot in self.running if deadline[slot] <= now]
+        for slot in expired:
+            self.state[slot] = timer_expired
+            self.running.discard(slot)
+        self.earliest = min((deadline[slot] for slot in self.running), default=None)
+
+    def start(self, slot, preset):
+        self.begin[slot] = self.now
+        self.arm(slot, self.now+preset)
+
+    def arm(self, slot, deadline):
+        self.deadline[slot] = deadline
+        if deadline <= self.now:
+            self.state[slot] = timer_expired
+            self.running.discard(slot)
+            return
+
+        self.state[slot] = timer_running
+        self.running.add(slot)
+        if self.earliest is None or deadline < self.earliest:
+            self.earliest = deadline
+
+    def stop(self, slot):
+        self.state[slot] = timer_idle
+        self.running.discard(slot)
+
+# load the interface file the way pyST.py would, as module level code of the
+# PLC program, here with a namespace standing in for that module
+def load_intrfc(intrfc_file):
+    with open(intrfc_file, 'r') as rf:
+        code = rf.read()
+    namespace = {'__name__': 'plc', 'array': array, 'bisect': bisect, 'copy': copy, 'functools': functools,
+        'operator': operator, 'threading': threading, 'time': time}
+    exec(compile(code, intrfc_file, 'exec'), namespace)
+    return namespace
+
+# a run of cycles, each ms_per_cycle long, in which starts[n] lists the (slot, preset)
+# of the short timers started in cycle n.  Returns the microseconds per cycle and
+# the number of timers expired
+def run_cycles(pool, now, ms_per_cycle, starts):
+    expired = 0
+    state = pool.state
+    begin = time.perf_counter()
+    for cycle_starts in starts:
+        now += ms_per_cycle
+        pool.tick(now)
+        for slot, preset in cycle_starts:
+            if state[slot] == timer_expired:
+                expired += 1
+            pool.stop(slot)
+            pool.start(slot, preset)
+    elapsed = time.perf_counter()-begin
+    return 1e6*elapsed/len(starts), expired
+
+def bench(timer_pool, num_idle, num_short, cycles, ms_per_cycle, repeat):
+    best = {}
+    for name, pool_class in (('old', legacy_timer_pool), ('new', timer_pool)):
+        for rep in range(0, repeat):
+            random.seed(1)
+            pool = pool_class()
+            now = 10**9
+            pool.tick(now)
+            for idx in range(0, num_idle):
+                pool.start(pool.add(), 3600000+idx)
+            shorts = [pool.add() for idx in range(0, num_short)]
+
+            # each cycle restarts a tenth of the short timers, with presets of up to a second
+            starts = [[(random.choice(shorts), random.randrange(10, 1000)) for idx in range(0, max(1, num_short//10))]
+                      for cycle in range(0, cycles)]
+            usec, expired = run_cycles(pool, now, ms_per_cycle, starts)
+            if name not in best or usec < best[name][0]:
+                best[name] = (usec, expired)
+
+    if best['old'][1] != best['new'][1]:
+        print(f"error: {best['old'][1]} timers expired in the old pool, {best['new'][1]} in the new")
+    print(f"{num_idle:>10} {num_short:>8} {best['old'][0]:>12.2f} {best['new'][0]:>12.2f} "
+          f"{best['old'][0]/best['new'][0]:>8.1f} {best['new'][1]:>9}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'-intrfc', metavar = u'name of file with interface code',
+                        dest=u'intrfc_file', default='aux.py')
+    parser.add_argument(u'-idle', metavar = u'comma separated numbers of idle timers',
+                        dest=u'idle', default='100,1000,10000,100000')
+    parser.add_argument(u'-short', metavar = u'number of short timers started and expiring',
+                        dest=u'short', default='100')
+    parser.add_argument(u'-cycles', metavar = u'number of cycles run',
+                        dest=u'cycles', default='1000')
+    parser.add_argument(u'-mpc', metavar = u'milliseconds per cycle',
+                        dest=u'mpc', default='10')
+    parser.add_argument(u'-repeat', metavar = u'runs per size, best is reported',
+                        dest=u'repeat', default='3')
+    args = parser.parse_args(sys.argv[1:])
+
+    timer_pool = load_intrfc(args.intrfc_file)['timer_pool']
+    print(f"{'idle':>10} {'short':>8} {'old us/cyc':>12} {'new us/cyc':>12} {'x':>8} {'expired':>9}")
+    for idle in args.idle.split(','):
+        bench(timer_pool, int(idle), int(args.short), int(args.cycles), int(args.mpc), int(args.repeat))
+
+if __name__ == "__main__":
+    main()
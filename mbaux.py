@@ -28,6 +28,11 @@ readWriteRegisters = 0x17
 transID = 1
 client_socket = None
 
+# MBAP header and pdu header ahead of the values in a request writing registers,
+# and in one reading and writing registers
+write_regs_hdr      = struct.Struct('>HHHBBHHB')
+read_write_regs_hdr = struct.Struct('>HHHBBHHHHB')
+
 def open_modbus_socket(host, port, wait=0):
     print(f"open socket to {host}:{port}")
 
@@ -256,6 +261,29 @@ def valid_exception(fc, pdu):
         return False
     return True
                 
+# receive exactly nbytes from the socket, or None if the connection closes first
+def recv_exactly(sock, nbytes):
+    data = bytearray()
+    while len(data) < nbytes:
+        chunk = sock.recv(nbytes-len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+# receive one whole Modbus/TCP message, however TCP splits or joins it with others,
+# by reading the MBAP header and then as many bytes as its length field gives
+def recv_modbus_msg(sock):
+    hdr = recv_exactly(sock, 6)
+    if hdr is None:
+        return None
+
+    (transID, protID, msgLen) = struct.unpack('>HHH', hdr)
+    body = recv_exactly(sock, msgLen)
+    if body is None:
+        return None
+    return hdr + body
+
 # send a message already in bytes form
 def send_modbus_msg(mbs, msg, updateTransID=True, fullReturn=False, timeout=10.0):
     global transID
@@ -276,7 +304,7 @@ def send_modbus_msg(mbs, msg, updateTransID=True, fullReturn=False, timeout=10.0
         if timeout is not None:
             mbs.settimeout(timeout)
             try:
-                data = mbs.recv(512)
+                data = recv_modbus_msg(mbs)
             except socket.timeout:
                 print(f"socket receive timeout after {timeout} seconds")
                 return False, None
@@ -284,11 +312,15 @@ def send_modbus_msg(mbs, msg, updateTransID=True, fullReturn=False, timeout=10.0
                 print(f"socket receive error")
                 return False, None 
         else:
-            data = mbs.recv(512)
+            data = recv_modbus_msg(mbs)
     else:
         print("socket is absent")
         return False, None
 
+    if data is None:
+        print("connection closed by server")
+        return False, None
+
     # function code is first byte of pdu,
     # if error will not be the same as the request
     rtn_fc = data[7]
@@ -333,14 +365,12 @@ def write_CoilsMsg(adrs, coils, deviceID):
 def writeRegistersMsg(fc, adrs, values, deviceID):
     numValues = len(values)
 
-    # turn the list of integers in to bytes object, each entry in 2-byte big-endian form
-    valuesVec = mbstruct.make_values_list(values)
-
-    pdu = struct.pack('>BHHB', fc, adrs, numValues, 2*numValues)
-    pdu = pdu + valuesVec
-
-    hdr = struct.pack('>HHHB', transID, 0, len(pdu)+1, deviceID)
-    return hdr + pdu
+    # the whole message goes into one buffer: MBAP header, the pdu header, and then
+    # the list of integers, each entry in 2-byte big-endian form
+    msg = bytearray(write_regs_hdr.size+2*numValues)
+    write_regs_hdr.pack_into(msg, 0, transID, 0, 7+2*numValues, deviceID, fc, adrs, numValues, 2*numValues)
+    mbstruct.pack_values_into(msg, write_regs_hdr.size, values)
+    return bytes(msg)
 
 def write_HoldingRegistersMsg(adrs, values, deviceID):
     return writeRegistersMsg(writeHoldingRegisters, adrs, values, deviceID)
@@ -361,14 +391,14 @@ def write_MaskRegisterMsg(adrs, andMsk, orMask, deviceID):
     return hdr + pdu
 
 def read_WR_RegistersMsg(readAdrs, readNum, writeAdrs, writeNum, values, deviceID):
-    # turn the list of integers in to bytes object, each entry in 2-byte big-endian form
-    valuesVec = mbstruct.make_values_list(values)
-
-    pdu = struct.pack('>BHHHHB', readWriteRegisters, readAdrs, readNum, writeAdrs, writeNum, len(valuesVec))
-    pdu = pdu + valuesVec
+    numValues = len(values)
 
-    hdr = struct.pack('>HHHB', transID, 0, len(pdu)+1, deviceID)
-    return hdr + pdu
+    # MBAP header, pdu header, then the values in 2-byte big-endian form, in one buffer
+    msg = bytearray(read_write_regs_hdr.size+2*numValues)
+    read_write_regs_hdr.pack_into(msg, 0, transID, 0, 11+2*numValues, deviceID,
+        readWriteRegisters, readAdrs, readNum, writeAdrs, writeNum, 2*numValues)
+    mbstruct.pack_values_into(msg, read_write_regs_hdr.size, values)
+    return bytes(msg)
 
 # read a list of one bit entities, used to read coils and discrete inputs
 def readBitListMsg(fc, adrs, numBits, deviceID):
@@ -376,20 +406,11 @@ def readBitListMsg(fc, adrs, numBits, deviceID):
     hdr = struct.pack('>HHHB', transID, 0, len(pdu)+1, deviceID)
     return hdr + pdu
 
+# decode the bits in a response to reading bits, a byte count followed by the bytes.
+# A response carrying fewer bytes than the bits asked for gives fewer values
 def readBitListRtn(rtn, bits):
-    numBits = bits
     numBytes = rtn[0]
-    rtn = rtn[1:]
-    values = []
-    while numBits > 0:
-        for bits in rtn:
-            bitMsk = 0x01
-            for pos in range(0, min(8, numBits)):
-                values.append(True if bitMsk & bits else False)
-                numBits -= 1
-                bitMsk <<= 1
-
-    return values
+    return mbstruct.unpack_bit_list(rtn[1:1+numBytes], bits)
 
 # read a list of register values, used to read holding and input registers
 def readValueListMsg(fc, adrs, numValues, deviceID):
@@ -399,15 +420,7 @@ def readValueListMsg(fc, adrs, numValues, deviceID):
 
 def readValueListRtn(rtn):
     numBytes = rtn[0]
-    rtn = rtn[1:]
-    values  = []
-    while numBytes > 0:
-        value = struct.unpack('>H', rtn[:2])
-        values.append(value[0])
-        rtn = rtn[2:]
-        numBytes -= 2
-
-    return values
+    return mbstruct.unpack_values_from(rtn, numBytes//2, 1)
 
 def read_CoilsMsg(adrs, numCoils, deviceID):
     return readBitListMsg(readCoils, adrs, numCoils, deviceID)
@@ -1,54 +1,182 @@
-# data structures and code for the ST program to interact with the 
+# data structures and code for the ST program to interact with the
 # cojoined Modbus server
 #
+import array
+import operator
+import sys
+
+import mbstruct
+
 # Modbus data block table variables
-coilblock = None     
-datablock = None     
+coilblock = None
+datablock = None
 inputRegblock = None
 holdingRegblock = None
 
+# an mb_table is one Modbus data table held in a flat buffer: a byte per bit for
+# the coil and discrete input tables, an unsigned 16-bit integer in native byte
+# order per register for the input and holding register tables.  view is a
+# memoryview of the buffer in that format, so the Modbus server serializes a range
+# of the table straight out of the buffer and lands written values straight in it.
+# The buffer may be passed in, a process image's say, so that the table is shared
+# with the PLC program without copying.  A table in a shared memory segment
+# (shmem.shared_segment) is reached from other processes as well, every copy in
+# or out of it going through the seqlock of the segment
+#
+class mb_table():
+    def __init__(self, size, bits, buffer=None, segment=None):
+        self.size = size
+        self.bits = bits
+        self.segment = segment
+        if segment is not None:
+            buffer = segment.data
+        if buffer is None:
+            buffer = bytearray(size) if bits else array.array('H', bytes(2*size))
+
+        view = memoryview(buffer).cast('B')
+        itemsize = 1 if bits else 2
+        if view.nbytes < itemsize*size:
+            print(f"buffer of {view.nbytes} bytes too small for Modbus table of {size} entries")
+            exit(1)
+
+        self.buffer = buffer
+        self.view = view[:itemsize*size].cast('B' if bits else 'H')
+
+    # the values of entries adrs through adrs+size-1, bools for a table of bits
+    def get_values(self, adrs, size):
+        self.check_range(adrs, size)
+        return self.unpack(self.copy_out(adrs, size))
+
+    # write values into the entries from adrs on
+    def set_values(self, adrs, values):
+        self.check_range(adrs, len(values))
+        self.copy_in(adrs, self.pack(values))
+
+    # the values of the entries whose bytes copy_out returned
+    def unpack(self, data):
+        if self.bits:
+            return list(map(operator.truth, data))
+        return array.array('H', data).tolist()
+
+    # values as entries in the format of the view, which copy_in takes.  Register
+    # values out of the range of 16 bits keep their low 16 bits
+    def pack(self, values):
+        if self.bits:
+            return bytes(map(operator.truth, values))
+        try:
+            return array.array('H', values)
+        except (TypeError, OverflowError):
+            return array.array('H', [int(value) & 0xFFFF for value in values])
+
+    # entries adrs through adrs+size-1 as they are carried in a Modbus PDU, bits
+    # packed eight to a byte and registers as big-endian 16-bit integers
+    def get_wire_bytes(self, adrs, size):
+        self.check_range(adrs, size)
+        if self.bits:
+            return mbstruct.make_bitmask_list(self.copy_out(adrs, size))
+
+        regs = array.array('H', self.copy_out(adrs, size))
+        if sys.byteorder == 'little':
+            regs.byteswap()
+        return regs.tobytes()
+
+    # the reverse of get_wire_bytes, writing the size entries coded in data from adrs on
+    def set_wire_bytes(self, adrs, size, data):
+        self.check_range(adrs, size)
+        if self.bits:
+            entries = mbstruct.unpack_bit_bytes(data, size)
+        else:
+            entries = array.array('H', bytes(data[:2*size]))
+            if sys.byteorder == 'little':
+                entries.byteswap()
+
+        if len(entries) != size:
+            raise ValueError(f"{size} entries expected, data holds {len(entries)}")
+        self.copy_in(adrs, entries)
+
+    # a copy of the bytes of entries adrs through adrs+size-1, taken again if a
+    # writer in another process changed them meanwhile
+    def copy_out(self, adrs, size):
+        if self.segment is None:
+            return self.view[adrs:adrs+size].tobytes()
+
+        while True:
+            seq = self.segment.begin_read()
+            data = self.view[adrs:adrs+size].tobytes()
+            if not self.segment.read_retry(seq):
+                return data
+
+    # write entries, in the format of the view, from adrs on
+    def copy_in(self, adrs, entries):
+        if self.segment is None:
+            self.view[adrs:adrs+len(entries)] = entries
+            return
+
+        self.segment.begin_write()
+        try:
+            self.view[adrs:adrs+len(entries)] = entries
+        finally:
+            self.segment.end_write()
+
+    def check_range(self, adrs, size):
+        if adrs < 0 or size < 0 or self.size < adrs+size:
+            raise IndexError(f"entries {adrs} through {adrs+size-1} outside table of {self.size}")
+
+# create the four Modbus tables, each with size entries, and make them the ones
+# used here.  buffers, if given, holds the buffer for each of coils, discrete
+# inputs, input registers, and holding registers, None for one that gets its own,
+# and segments likewise the shared memory segments to put them in
+#
+def create_tables(size, buffers=None, segments=None):
+    global coilblock, datablock, inputRegblock, holdingRegblock
+
+    if buffers is None:
+        buffers = (None, None, None, None)
+    if segments is None:
+        segments = (None, None, None, None)
+
+    coilblock       = mb_table(size, True,  buffers[0], segments[0])
+    datablock       = mb_table(size, True,  buffers[1], segments[1])
+    inputRegblock   = mb_table(size, False, buffers[2], segments[2])
+    holdingRegblock = mb_table(size, False, buffers[3], segments[3])
+
+    return coilblock, datablock, inputRegblock, holdingRegblock
+
 # given the data table, an address in that table, and a number of elements,
-# acquire those values from the data table and return them, doing a conversion
-# for tables holding booleans
+# acquire those values from the data table and return them, as booleans
+# for tables holding bits
 #
 def getTableValues(table, adrs, size):
     try:
-        values = table.getValues(adrs, size)
-        trns_values = []
-        # is the table of interest representing boolean variables?
-        if table==coilblock or table==datablock:
-            # yes, so create explicit conversions
-            for v in values:
-                if isinstance(v,int):
-                    vt = True if v%2 > 0 else False
-                    trns_values.append(vt)
-        else:
-            trns_values = values
-        return True, trns_values
-
-    except:
+        return True, table.get_values(adrs, size)
+    except (IndexError, ValueError, TypeError):
         return False, []
 
 # given the data table, an address in that table, and a list of values,
-# write those values to the data table, doing a conversion
-# for tables holding booleans
+# write those values to the data table
 #
 def setTableValues(table, adrs, values):
     try:
-        trns_values = []
-        # does this table manage Booleans?
-        if table == coilblock or table==datablock:
-            # yes, so do a conversion to integers 
-            for v in values:
-                if isinstance(v,bool):
-                    vt = 1 if v else 0
-                    trns_values.append(vt) 
-        else:
-            trns_values = values
-
-        table.setValues(adrs, trns_values)
+        table.set_values(adrs, values)
         return True
-    except:
+    except (IndexError, ValueError, TypeError):
         return False
 
+# given the data table, an address in that table, and a number of elements,
+# return those elements encoded the way a Modbus response carries them
+#
+def getTableBytes(table, adrs, size):
+    try:
+        return True, table.get_wire_bytes(adrs, size)
+    except (IndexError, ValueError, TypeError):
+        return False, b''
 
+# given the data table, an address in that table, a number of elements and
+# their encoding in a Modbus request, write them to the data table
+#
+def setTableBytes(table, adrs, size, data):
+    try:
+        table.set_wire_bytes(adrs, size, data)
+        return True
+    except (IndexError, ValueError, TypeError):
+        return False
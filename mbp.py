@@ -2,18 +2,26 @@
 """Pymodbus asynchronous Server with interface to input-writing digital twin 
 """
 import logging
+import os
 import sys
 import pdb
+import signal
 import mbstruct
 import mbaux
 import struct
 import socket
 import threading
 import argparse
+import importlib.util
+import multiprocessing
+import multiprocessing.connection
 import plc
 import dt
+import mbd
 import mbs
+import shmem
 import time
+import traceback
 
 # default milliseconds per dt clock tick
 mpt = 5000
@@ -21,6 +29,22 @@ mpt = 5000
 # default milliseconds per plc cycle
 mpc = 100
 
+# what the PLC cycle scheduler does with cycles missed to an overrun, 'skip' or 'burst'
+catchup = 'skip'
+
+# Modbus server serving each client from a thread ('threads') or all from one event loop ('events')
+srvmode = 'threads'
+maxconns = None
+
+# the Modbus server, the PLC, and the digital twin run as threads of this process ('threads'),
+# or each in a process of its own sharing the process images and Modbus tables ('processes')
+roles = 'threads'
+
+# the PLC module file to watch for a new translation to swap in while running, and the
+# seconds between looks at it
+reload_file = None
+reload_poll = 1.0
+
 client_port = None
 server_host = '127.0.0.1'
 
@@ -30,7 +54,8 @@ transactionID = 1
 rseed = 123455
 
 def getArgs():
-    global client_port, dt_port, server_host, dt_host, tablesize, mpt, mpc, rseed
+    global client_port, dt_port, server_host, dt_host, tablesize, mpt, mpc, rseed, catchup
+    global srvmode, maxconns, roles, reload_file
 
     parser = argparse.ArgumentParser()
 
@@ -49,6 +74,21 @@ def getArgs():
     parser.add_argument(u'-seed', metavar = u'random seed', 
                         dest=u'rseed', required=False)
 
+    parser.add_argument(u'-catchup', metavar = u'skip or burst, for PLC cycles missed to an overrun', 
+                        dest=u'catchup', required=False)
+
+    parser.add_argument(u'-srvmode', metavar = u'Modbus server mode, threads or events', 
+                        dest=u'srvmode', required=False)
+
+    parser.add_argument(u'-maxconns', metavar = u'most Modbus clients served at once in events mode', 
+                        dest=u'maxconns', required=False)
+
+    parser.add_argument(u'-roles', metavar = u'threads or processes, how the server, PLC, and digital twin run', 
+                        dest=u'roles', required=False)
+
+    parser.add_argument(u'-reload', metavar = u'PLC module file to swap in when retranslated, in threads roles', 
+                        dest=u'reload_file', required=False)
+
     # check whether what we want to do is read from a configuration file
     cmdline = []
     if sys.argv[1] == '-is':
@@ -102,26 +142,264 @@ def getArgs():
     if args.rseed is not None:
         rseed = int(args.rseed)
 
+    if args.catchup is not None:
+        if args.catchup not in ('skip', 'burst'):
+            print(f"catch-up policy must be 'skip' or 'burst'")
+            exit(1)
+        catchup = args.catchup
+
+    if args.srvmode is not None:
+        if args.srvmode not in ('threads', 'events'):
+            print(f"server mode must be 'threads' or 'events'")
+            exit(1)
+        srvmode = args.srvmode
+
+    if args.maxconns is not None:
+        if not args.maxconns.isdigit() or int(args.maxconns) < 1:
+            print(f"maximum number of connections must be a positive integer")
+            exit(1)
+        maxconns = int(args.maxconns)
+
+    if args.roles is not None:
+        if args.roles not in ('threads', 'processes'):
+            print(f"roles must be 'threads' or 'processes'")
+            exit(1)
+        roles = args.roles
+
+    if args.reload_file is not None:
+        if roles != 'threads':
+            print(f"a PLC program can be reloaded only with roles 'threads'")
+            exit(1)
+        if not os.path.isfile(args.reload_file):
+            print(f"unable to open PLC module file {args.reload_file}")
+            exit(1)
+        reload_file = args.reload_file
+
 def main(cmdline):
     global tablesize, server_host, client_port
 
     """Combine setup and run."""
     args = getArgs()
 
-    # set up the asychronous pymodbus server
-    mbs.setup_server(tablesize, server_host, client_port)
+    if roles == 'processes':
+        run_processes()
+        return
+
+    # set up the Modbus server
+    mbs.setup_server(tablesize, server_host, client_port, srvmode, maxconns)
     
     srvr_thread = threading.Thread(target=mbs.srvr_thread_function, args=(mbs.srvr_sock, False))
     srvr_thread.start()
 
-    # spin up the PLC thread
-    plc_thread = threading.Thread(target=plc.plc_thread_function, args=(mpc,))
+    # spin up the PLC thread, and with -reload the thread watching for a new translation
+    if reload_file is None:
+        plc_thread = threading.Thread(target=run_plc, args=(plc.plc_thread_function, mpc, catchup))
+    else:
+        reloader = plc_reloader(reload_file, plc)
+        plc_thread = threading.Thread(target=run_plc, args=(reloader.run, mpc, catchup))
+        threading.Thread(target=reloader.watch, daemon=True).start()
     plc_thread.start()
 
     # spin up the digital twin thread
     dt_thread = threading.Thread(target=dt.dt_thread_function, args = (mpt,rseed))
     dt_thread.start()
 
+# run the scan loop of the PLC program, scan being plc_thread_function or what
+# stands in for it.  An error the program meets as it runs, such as an IMPORT_FROM_MB
+# of entries no Modbus table holds, is reported and ends mbp.py, every role with
+# it, rather than leave the Modbus server and the digital twin serving outputs the
+# PLC no longer drives
+def run_plc(scan, mpc, catchup):
+    try:
+        scan(mpc, catchup)
+        return
+    except (LookupError, ValueError) as err:
+        print(f"PLC program stopped: {err}")
+    except Exception:
+        traceback.print_exc()
+        print("PLC program stopped")
+    os._exit(1)
+
+# A plc_reloader swaps a new translation of the PLC program in for the one running,
+# without stopping the Modbus server or the digital twin.  Its watch thread looks at
+# the module file every reload_poll seconds, and once a new version has stayed the
+# same for one look, loads it as a module of its own and lays out its variables while
+# the old program goes on running.  It then asks the scan loop of the old program to
+# stop at the end of its cycle, and the PLC thread, in run, has the new program take
+# over the state of the old (take_over of aux.py), points the digital twin at it, and
+# starts its scan loop, so that the swap costs one cycle.  A version that fails to
+# load is reported and the old program kept
+#
+class plc_reloader():
+    def __init__(self, path, module):
+        self.path = path
+        self.module = module
+        self.stamp = self.file_stamp()
+        self.loads = 0
+
+        # the module loaded, until run swaps it in
+        self.staged = None
+        self.swapped = threading.Condition()
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def watch(self):
+        seen = self.stamp
+        while True:
+            time.sleep(reload_poll)
+            stamp = self.file_stamp()
+            if stamp is None or stamp == self.stamp or stamp != seen:
+                # not there, not changed, or perhaps still being written
+                seen = stamp
+                continue
+
+            self.stamp = stamp
+            module = self.load()
+            if module is None:
+                continue
+
+            self.swapped.acquire()
+            self.staged = module
+            self.module.plc_scan.stop()
+            while self.staged is not None:
+                self.swapped.wait()
+            self.swapped.release()
+
+    def load(self):
+        self.loads += 1
+        try:
+            spec = importlib.util.spec_from_file_location(f"plc_reload{self.loads}", self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            if not hasattr(module, 'take_over'):
+                print(f"{self.path} was translated with an interface that cannot take over a running program")
+                return None
+            module.build_loc_map(module.loc_map)
+        except Exception as err:
+            print(f"unable to load {self.path}, the running PLC program is kept: {err}")
+            return None
+        return module
+
+    # run the scan loop of the PLC program, and each time it stops for a new one, the
+    # scan loop of that
+    def run(self, mpc, catchup):
+        global plc
+        while True:
+            self.module.plc_thread_function(mpc, catchup)
+
+            self.swapped.acquire()
+            module = self.staged
+            if module is not None:
+                carried = module.take_over(self.module)
+                self.module = module
+                plc = module
+                dt.plc = module
+                self.staged = None
+                self.swapped.notify_all()
+            self.swapped.release()
+
+            if module is None:
+                return
+            print(f"PLC program reloaded from {self.path}, {carried} variables carried over")
+
+# In processes mode this process lays out the process images of the PLC program,
+# puts them and the Modbus tables in shared memory segments, and starts a process
+# for each role, which attaches to the segments by name.  The processes are
+# started with 'spawn', so that none inherits the PLC state laid out here
+#
+def run_processes():
+    ctx = multiprocessing.get_context('spawn')
+
+    plc.build_loc_map(plc.loc_map)
+    sizes = plc.process_image_bytes(shmem.image_classes)
+    for mem_class, nbytes in sizes.items():
+        if nbytes is None:
+            print(f"process image of {mem_class} holds values that cannot be put in shared memory")
+            exit(1)
+    sizes.update(shmem.table_bytes(tablesize))
+
+    # the Modbus server and the PLC both write the Modbus tables
+    locks = {name: ctx.Lock() for name in shmem.table_names}
+    segments, specs = shmem.create_segments(sizes, locks)
+
+    # the initial values of the variables go into the segments
+    plc.share_process_images({mem_class: segments[mem_class] for mem_class in shmem.image_classes})
+
+    procs = [ctx.Process(target=srvr_process, args=(specs, tablesize, server_host, client_port, srvmode, maxconns)),
+             ctx.Process(target=plc_process, args=(specs, tablesize, mpc, catchup)),
+             ctx.Process(target=dt_process, args=(specs, mpt, rseed))]
+    for proc in procs:
+        proc.start()
+
+    # a terminate (kill, timeout, a service manager stopping mbp.py) ends the roles and
+    # removes the segments just as an interrupt does
+    def terminated(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminated)
+
+    # the roles run until one of them ends, as the PLC does on an error, which ends the rest
+    try:
+        multiprocessing.connection.wait([proc.sentinel for proc in procs])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # a second interrupt or terminate would leave roles running and the segments in place
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+        plc.release_process_images(shmem.image_classes)
+        for segment in segments.values():
+            segment.close()
+            segment.unlink()
+
+    # a role that stopped on an error, rather than being ended here, fails mbp.py too
+    if any(proc.exitcode is not None and proc.exitcode > 0 for proc in procs):
+        exit(1)
+
+# end this role if mbp.py, the process that started it, goes away without ending it,
+# as when it is killed outright, so that no role is left holding the Modbus port
+def exit_with_parent():
+    parent = multiprocessing.parent_process()
+
+    def watch():
+        multiprocessing.connection.wait([parent.sentinel])
+        os._exit(1)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+# an interrupt from the terminal reaches every role, and is left to this process,
+# which ends the roles and removes the segments
+def srvr_process(specs, tablesize, server_host, client_port, srvmode, maxconns):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    exit_with_parent()
+    segments = shmem.attach_segments(specs)
+    mbs.setup_server(tablesize, server_host, client_port, srvmode, maxconns,
+        [segments[name] for name in shmem.table_names])
+    mbs.srvr_thread_function(mbs.srvr_sock, False)
+
+def plc_process(specs, tablesize, mpc, catchup):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    exit_with_parent()
+    segments = shmem.attach_segments(specs)
+    mbd.create_tables(tablesize, segments=[segments[name] for name in shmem.table_names])
+    plc.share_process_images({mem_class: segments[mem_class] for mem_class in shmem.image_classes})
+    run_plc(plc.plc_thread_function, mpc, catchup)
+
+def dt_process(specs, mpt, rseed):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    exit_with_parent()
+    segments = shmem.attach_segments(specs)
+    plc.share_process_images({mem_class: segments[mem_class] for mem_class in shmem.image_classes})
+    plc.build_loc_map(plc.loc_map)
+    dt.dt_thread_function(mpt, rseed)
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("run-time arguments needed")
@@ -1,21 +1,19 @@
 #!/usr/bin/env python3
-"""Pymodbus asynchronous Server with interface to input-writing digital twin 
+"""Modbus/TCP Server with interface to input-writing digital twin 
 """
 import logging
 import sys
 import pdb
 import mbstruct
 import mbaux
+import mbd
+import selectors
 import struct
 import socket
 import threading
 import time
 
-from pymodbus.datastore import (
-    ModbusSequentialDataBlock,
-)
-
-# Modbus data block table variables
+# Modbus data block table variables, mbd.mb_table instances shared with mbd
 
 coilblock = None     
 datablock = None     
@@ -48,57 +46,28 @@ srvr_sock = None
 tablesize = 100
 transactionID = 1
 
-# given the data table, an address in that table, and a number of elements,
-# acquire those values from the data table and return them, doing a conversion
-# for tables holding booleans
-#
-def getTableValues(table, adrs, size):
-    try:
-        values = table.getValues(adrs, size)
-        trns_values = []
-        # is the table of interest representing boolean variables?
-        if table==coilblock or table==datablock:
-            # yes, so create explicit conversions
-            for v in values:
-                if isinstance(v,int):
-                    vt = True if v%2 > 0 else False
-                    trns_values.append(vt)
-        else:
-            trns_values = values
-        return True, trns_values
-
-    except:
-        return False, []
-
-# given the data table, an address in that table, and a list of values,
-# write those values to the data table, doing a conversion
-# for tables holding booleans
-#
-def setTableValues(table, adrs, values):
-    try:
-        trns_values = []
-        # does this table manage Booleans?
-        if table == coilblock or table==datablock:
-            # yes, so do a conversion to integers 
-            for v in values:
-                if isinstance(v,bool):
-                    vt = 1 if v else 0
-                    trns_values.append(vt) 
-        else:
-            trns_values = values
-
-        table.setValues(adrs, trns_values)
-        return True
-    except:
-        return False
-
+# server_mode 'threads' serves each client connection from a thread of its own,
+# 'events' serves all of them from one thread running a selectors event loop,
+# which takes at most max_connections clients at a time
+server_mode = 'threads'
+max_connections = 1024
 
+# a Modbus/TCP message is at most the 6 bytes ahead of the MBAP length field
+# plus a length of 254 (unit identifier and a PDU of at most 253 bytes)
+max_mbap_len = 254
 
+# an event loop session stops reading from a client that lets this many bytes
+# of responses pile up unread
+max_pending_output = 65536
 
 unsupportedFuncs = (0x7, 0x8, 0xB, 0xC, 0x11, 0x14, 0x15, 0x18, 0x2B)
 
 
 def srvr_thread_function(sock, extended=False):
+    if server_mode == 'events':
+        srvr_event_loop(sock, extended)
+        return
+
     # look for a connection and when found spin off a thread to deal with it 
     sock.listen()
     while True:
@@ -110,200 +79,321 @@ def srvr_thread_function(sock, extended=False):
  
 # handle requests is called to establish a session with a client.
 # within the session individual modbus messages are received, each one responded to.
-# the reader and writer arguments are the read and writeback connections to the client
+# the conn argument is the connection to the client
 #
 def handle_request(conn, extended):
+    session = mb_session(conn, None)
     with conn:
         while True:
-            # loop where a message from the client is waited for.  The underlaying asyncio system
-            # will flip attention to the pymodbus server loop, so this is not blocking in the sense
-            # that waiting for the client message shuts out ability of other clients to interact
-            # with the pymodbus server
+            # wait for bytes from the client.  Each connection has a thread of its own,
+            # so waiting here does not keep other clients from being served.  TCP does not
+            # keep message boundaries, so what arrives may hold several messages sent back
+            # to back, or only part of one
             #
-            data = conn.recv(512)   # modbus messages are always smaller than 512 bytes
+            data = conn.recv(4096)
             if not data:
                 print(f"Client disconnected.")
                 break
-            # check the validity of the message
-            #print(f"received {data}")
-            valid, excpCode = mbaux.valid_modbus_msg(data, True, True, extended)
 
-            # ignore an invalid message with a null exception code
-            if not valid and excpCode==0:
-                print("warning: received ill-formed modbus message [{data}]")
-                continue
-            elif not valid:
-                # report an errorenous message, including the exception code
-                pdu = struct.pack('>BB', 0x80+fc, excpCode)
+            # respond to every message now complete, in the order they came
+            session.inbuf += data
+            if not session.take_messages(extended):
+                break
+
+            # and send all the responses back to the client at once
+            if len(session.outbuf) > 0:
+                conn.sendall(session.outbuf)
+                session.outbuf.clear()
+            # end of the loop, so go back and wait for more requests
 
+# respond takes one Modbus/TCP request message and returns the message to send back,
+# or None if no response should be sent
+#
+def respond(data, extended):
+    # check the validity of the message
+    #print(f"received {data}")
+    valid, excpCode = mbaux.valid_modbus_msg(data, True, True, extended)
+
+    # ignore an invalid message with a null exception code
+    if not valid and excpCode==0:
+        print(f"warning: received ill-formed modbus message [{data}]")
+        return None
+    elif not valid:
+        # report an errorenous message, including the exception code
+        (transID, protID, msgLen, unitID) = struct.unpack('>HHHB', data[:7])
+        fc = data[7]
+        pdu = struct.pack('>BB', 0x80+fc, excpCode)
+
+    else:
+        # Valid message. Determine the function code
+        (transID, protID, msgLen, unitID) = struct.unpack('>HHHB', data[:7])
+        fc = data[7]
+
+        # peel off the PDU part of the message
+        pdu_in = data[8:]
+
+        # response depends on the function code
+        if fc in (readCoils, readDiscreteInputs):
+            (adrs, numBits) = mbstruct.address_count_struct.unpack_from(pdu_in)
+
+            if tablesize < adrs+numBits+1:
+                # err = True 
+                pdu = struct.pack('>BB', 0x80+fc, 2)
+            else:
+                # get the bits, packed into bit masks straight from the table
+                if fc==readCoils:
+                    OK, bitBytes = mbd.getTableBytes(coilblock, adrs, numBits)
+                else:
+                    OK, bitBytes = mbd.getTableBytes(datablock, adrs, numBits)
+                if not OK:
+                    pdu = struct.pack('>BB', 0x80+fc, 2)
+                else:
+                    # build up response pdu : number of bytes in sequence of bitmasks, 
+                    # then sequence of bitmasks 
+                    pdu = struct.pack('>BB', fc, len(bitBytes)) + bitBytes
+
+        elif fc in (writeCoils, writeDiscreteInputs):
+            (adrs, numBits, numBytes) = mbstruct.write_header_struct.unpack_from(pdu_in)
+            if tablesize < adrs+numBits+1:
+                # err = True 
+                pdu = struct.pack('>BB', 0x80+fc, 2)
             else:
-                # Valid message. Determine the function code
-                (transID, protID, msgLen, unitID) = struct.unpack('>HHHB', data[:7])
-                fc = data[7]
+                # unpack the bit masks straight into the table
+                if fc==writeCoils:
+                    OK = mbd.setTableBytes(coilblock, adrs, numBits, pdu_in[5:5+numBytes])
+                else:
+                    OK = mbd.setTableBytes(datablock, adrs, numBits, pdu_in[5:5+numBytes])
 
-                # peel off the PDU part of the message
-                pdu_in = data[8:]
+                if not OK:
+                    pdu = struct.pack('>BB', 0x80+fc, 4)
+                else:
+                    pdu = struct.pack('>BHH', fc, adrs, numBits)
 
-                # response depends on the function code
-                if fc in (readCoils, readDiscreteInputs):
-                    (adrs, numBits) = struct.unpack('>HH', pdu_in[:4])
+        elif fc in (writeCoil, writeDiscreteInput):
+            (adrs, value) = struct.unpack('>HH', pdu_in[:4])
+            if tablesize <= adrs:
+                # err = True
+                pdu = struct.pack('>BB', 0x80+fc, 2)
+            else:
+                bit = True if value != 0 else False
+                if fc==writeCoil:
+                    mbd.setTableValues(coilblock, adrs, [bit])
+                else:
+                    mbd.setTableValues(datablock, adrs, [bit])
 
-                    if tablesize < adrs+numBits+1:
-                        # err = True 
-                        pdu = struct.pack('>BB', 0x80+fc, 2)
-                    else:
-                        # get the bit values
-                        if fc==readCoils:
-                            OK, bits = getTableValues(coilblock, adrs, numBits)
-                        else:
-                            OK, bits = getTableValues(datablock, adrs, numBits)
-                        if not OK:
-                            pdu = struct.pack('>BB', 0x80+fc, 2)
-                        else:
-                            # if the number of bits returned is empty signal an error
-
-                            # turn list of bools into a list of bit masks
-                            bitBytes = mbstruct.make_bitmask_list(bits)
-
-                            # build up response pdu : number of bytes in sequence of bitmasks, 
-                            # then sequence of bitmasks 
-                            pdu = struct.pack('>BB', fc, len(bitBytes))
-                            for bbyte in bitBytes:
-                                pdu = pdu + struct.pack('>B', bbyte)
-
-                elif fc in (writeCoils, writeDiscreteInputs):
-                    (adrs, numBits, bitVec) = mbstruct.unpack_bits_pdu(pdu_in)  
-                    if tablesize < adrs+numBits+1:
-                        # err = True 
-                        pdu = struct.pack('>BB', 0x80+fc, 2)
-                    else:
-                        if fc==writeCoils:
-                            OK = setTableValues(coilblock, adrs, bitVec)
-                        else:
-                            OK = setTableValues(datablock, adrs, bitVec)
-
-                        if not OK:
-                            pdu = struct.pack('>BB', 0x80+fc, 4)
-                        else:
-                            pdu = struct.pack('>BHH', fc, adrs, numBits)
-
-                elif fc in (writeCoil, writeDiscreteInput):
-                    (adrs, value) = struct.unpack('>HH', pdu_in[:4])
-                    if tablesize <= adrs:
-                        # err = True
-                        pdu = struct.pack('>BB', 0x80+fc, 2)
-                    else:
-                        bit = True if value != 0 else False
-                        if fc==writeCoil:
-                            setTableValues(coilblock, adrs, [bit])
-                        else:
-                            setTableValues(datablock, adrs, [bit])
-
-                        pdu = struct.pack('>BHH', fc, adrs, value)
-
-                elif fc in (readInputRegisters, readHoldingRegisters):
-                    (adrs, numValues) = mbstruct.unpack_read_registers_pdu(pdu_in[:4])
-                    if tablesize < adrs+numValues+1:
-                        # err = True
-                        pdu = struct.pack('>BB', 0x80+fc, 2)
-                    else:
-                        # get the vectors of register values from the data blocks
-                        if fc==readInputRegisters:
-                            OK, values = getTableValues(inputRegblock, adrs, numValues)
-                        else:
-                            OK, values = getTableValues(holdingRegblock, adrs, numValues)
-                        if not OK:
-                            pdu = struct.pack('>BB', 0x80+fc, 2)
-                        else:
-                            valuesBytes = mbstruct.make_values_list(values)
-
-                            # craft pdu response
-                            pdu = struct.pack('>BB', fc, 2*numValues) + valuesBytes
-                    
-                elif fc in (writeInputRegisters, writeHoldingRegisters):
-                    (adrs, numInputs, valueVec) = mbstruct.unpack_write_registers_pdu(pdu_in)
-                    if tablesize < adrs+numInputs+1:
-                        # err = True
-                        pdu = struct.pack('>BB', 0x80+fc, 2)
-                    else:
-                        if fc==writeInputRegisters:
-                            setTableValues(inputRegblock, adrs, valueVec) 
-                        else:
-                            setTableValues(holdingRegblock, adrs, valueVec) 
+                pdu = struct.pack('>BHH', fc, adrs, value)
 
-                        pdu = struct.pack('>BHH', fc, adrs, numInputs)
+        elif fc in (readInputRegisters, readHoldingRegisters):
+            (adrs, numValues) = mbstruct.unpack_read_registers_pdu(pdu_in)
+            if tablesize < adrs+numValues+1:
+                # err = True
+                pdu = struct.pack('>BB', 0x80+fc, 2)
+            else:
+                # get the register values from the data blocks, already big-endian
+                if fc==readInputRegisters:
+                    OK, regBytes = mbd.getTableBytes(inputRegblock, adrs, numValues)
+                else:
+                    OK, regBytes = mbd.getTableBytes(holdingRegblock, adrs, numValues)
+                if not OK:
+                    pdu = struct.pack('>BB', 0x80+fc, 2)
+                else:
+                    # craft pdu response
+                    pdu = struct.pack('>BB', fc, len(regBytes)) + regBytes
+            
+        elif fc in (writeInputRegisters, writeHoldingRegisters):
+            (adrs, numInputs, numBytes) = mbstruct.write_header_struct.unpack_from(pdu_in)
+            if tablesize < adrs+numInputs+1:
+                # err = True
+                pdu = struct.pack('>BB', 0x80+fc, 2)
+            else:
+                if fc==writeInputRegisters:
+                    OK = mbd.setTableBytes(inputRegblock, adrs, numInputs, pdu_in[5:5+numBytes])
+                else:
+                    OK = mbd.setTableBytes(holdingRegblock, adrs, numInputs, pdu_in[5:5+numBytes])
 
-                elif fc in (writeInputRegister, writeHoldingRegister):
-                    (adrs, value) = struct.unpack('>HH', pdu_in[:4])
-                    if tablesize <= adrs:
-                        pdu = struct.pack('>BB', 0x80+fc, 2)
-                    else:
-                        if fc==writeInputRegister:
-                            setTableValues(inputRegblock, adrs, [value])
-                        else:
-                            setTableValues(holdingRegblock, adrs, [value])
-
-                        pdu = struct.pack('>BHH', fc, adrs, value)
-                
-                elif fc == maskWriteRegister:
-                    (adrs, andMsk, orMsk) = struct.unpack('>HHH', pdu_in[:6])
-                    if tablesize <= adrs:
+                if not OK:
+                    pdu = struct.pack('>BB', 0x80+fc, 4)
+                else:
+                    pdu = struct.pack('>BHH', fc, adrs, numInputs)
+
+        elif fc in (writeInputRegister, writeHoldingRegister):
+            (adrs, value) = struct.unpack('>HH', pdu_in[:4])
+            if tablesize <= adrs:
+                pdu = struct.pack('>BB', 0x80+fc, 2)
+            else:
+                if fc==writeInputRegister:
+                    mbd.setTableValues(inputRegblock, adrs, [value])
+                else:
+                    mbd.setTableValues(holdingRegblock, adrs, [value])
+
+                pdu = struct.pack('>BHH', fc, adrs, value)
+        
+        elif fc == maskWriteRegister:
+            (adrs, andMsk, orMsk) = struct.unpack('>HHH', pdu_in[:6])
+            if tablesize <= adrs:
+                pdu = struct.pack('>BB', 0x80+fc, 2)
+            else:
+                OK, regValue = mbd.getTableValues(holdingRegblock, adrs, 1)
+                if not OK:
+                    pdu = struct.pack('>BB', 0x80+fc, 2)
+                else:
+                    regValue[0] &= andMsk
+                    regValue[0] |= orMsk
+                    OK = mbd.setTableValues(holdingRegblock, adrs, regValue)
+                    if not OK:
                         pdu = struct.pack('>BB', 0x80+fc, 2)
                     else:
-                        OK, regValue = getTableValues(holdingRegblock, adrs, 1)
-                        if not OK:
-                            pdu = struct.pack('>BB', 0x80+fc, 2)
-                        else:
-                            regValue[0] &= andMsk
-                            regValue[0] |= orMsk
-                            OK = setTableValues(holdingRegblock, adrs, regValue)
-                            if not OK:
-                                pdu = struct.pack('>BB', 0x80+fc, 2)
-                            else:
-                                pdu = struct.pack('>BHHH', fc, adrs, andMsk, orMsk)
-
-                elif fc == readWriteRegisters:
-                    (readAdrs, readNum, writeAdrs, writeNum, writeBytes) = struct.unpack('>HHHHB', pdu_in[:9])
-                    writeValues = mbstruct.unpack_values_list(pdu_in[9:])
-                    OK = setTableValues(holdingRegblock, writeAdrs, writeValues)
-                    if not OK:
-                        pdu = struct.pack('>BB', 0x80+fc, 4)
-                    else: 
-                        OK, values = getTableValues(holdingRegblock, readAdrs, readNum)
-                        if not OK:
-                            pdu = struct.pack('>BB', 0x80+fc, 4)
-                        else:
-                            valuesBytes = mbstruct.make_values_list(values)
-
-                            # craft pdu response
-                            pdu = struct.pack('>BB', fc, 2*readNum) + valuesBytes
-
-                elif fc in unsupportedFuncs:
-                    print("Function code ({fc}) presently unsupported by this server")
+                        pdu = struct.pack('>BHHH', fc, adrs, andMsk, orMsk)
+
+        elif fc == readWriteRegisters:
+            (readAdrs, readNum, writeAdrs, writeNum, writeBytes) = struct.unpack('>HHHHB', pdu_in[:9])
+            OK = mbd.setTableBytes(holdingRegblock, writeAdrs, writeNum, pdu_in[9:9+writeBytes])
+            if not OK:
+                pdu = struct.pack('>BB', 0x80+fc, 4)
+            else: 
+                OK, regBytes = mbd.getTableBytes(holdingRegblock, readAdrs, readNum)
+                if not OK:
+                    pdu = struct.pack('>BB', 0x80+fc, 4)
+                else:
+                    # craft pdu response
+                    pdu = struct.pack('>BB', fc, len(regBytes)) + regBytes
+
+        elif fc in unsupportedFuncs:
+            print(f"Function code ({fc}) presently unsupported by this server")
+            return None
+
+        else:
+            # create an error response flagging illegal function
+            pdu = struct.pack('BB', fc+0x80, 0x1)
+
+    # the response has generated a pdu, which is now packaged with information needed 
+    # for a modbus message header to create a complete message
+    #
+    modbus_packet = create_modbus_tcp_packet(transID, unitID, pdu)
+
+    # validate the message.  Should be fine because this code constructed it, but perhaps
+    # a malicious insider tinkered with it
+    valid, excpCode = mbaux.valid_modbus_msg(modbus_packet, False, True, extended)
+    if not valid and excpCode ==0:
+        return None
+    elif not valid:
+        print(f"error: invalid response message ({modbus_packet}) created")
+        pdu = struct.pack('BB', fc+0x80, excpCode)
+        modbus_packet = create_modbus_tcp_packet(transID, unitID, pdu)
+    
+    return modbus_packet
+
+
+# an mb_session holds the state of one client connection: bytes received that do
+# not yet make up a whole message, and responses not yet sent.  Messages are framed
+# by the length field of their MBAP header, so a client may have many requests in
+# flight on one connection
+#
+class mb_session():
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.inbuf  = bytearray()
+        self.outbuf = bytearray()
+
+    # take every complete message out of inbuf, found through the MBAP length
+    # field, and queue the response to each.  Returns False if the stream holds
+    # something that cannot be a Modbus/TCP message
+    def take_messages(self, extended):
+        inbuf = self.inbuf
+        start = 0
+        while len(inbuf)-start >= 7:
+            msgLen = int.from_bytes(inbuf[start+4:start+6], 'big')
+            if not 2 <= msgLen <= max_mbap_len:
+                print(f"error: modbus message length {msgLen} from {self.addr} out of range")
+                return False
+
+            end = start+6+msgLen
+            if len(inbuf) < end:
+                break
+
+            modbus_packet = respond(bytes(inbuf[start:end]), extended)
+            if modbus_packet is not None:
+                self.outbuf += modbus_packet
+            start = end
+
+        del inbuf[:start]
+        return True
+
+    # send what the socket will take of the queued responses
+    def send_pending(self):
+        sent = self.conn.send(self.outbuf)
+        del self.outbuf[:sent]
+
+# serve every client connection from this one thread.  A selector watches the
+# listening socket for new connections and each connection for requests, and for
+# room to send when a response could not go out at once
+#
+def srvr_event_loop(sock, extended=False):
+    sel = selectors.DefaultSelector()
+    sock.listen(max_connections)
+    sock.setblocking(False)
+    sel.register(sock, selectors.EVENT_READ)
+    num_conns = 0
+
+    def close_session(session):
+        sel.unregister(session.conn)
+        session.conn.close()
+
+    while True:
+        for key, events in sel.select():
+            if key.fileobj is sock:
+                try:
+                    conn, addr = sock.accept()
+                except (BlockingIOError, InterruptedError):
                     continue
 
-                else:
-                    # create an error response flagging illegal function
-                    pdu = struct.pack('BB', fc+0x80, 0x1)
+                if num_conns >= max_connections:
+                    print(f"connection limit {max_connections} reached, refusing {addr}")
+                    conn.close()
+                    continue
 
-            # the response has generated a pdu, which is now packaged with information needed 
-            # for a modbus message header to create a complete message
-            #
-            modbus_packet = create_modbus_tcp_packet(transID, unitID, pdu)
+                conn.setblocking(False)
+                sel.register(conn, selectors.EVENT_READ, mb_session(conn, addr))
+                num_conns += 1
+                continue
 
-            # validate the message.  Should be fine because this code constructed it, but perhaps
-            # a malicious insider tinkered with it
-            valid, excpCode = mbaux.valid_modbus_msg(modbus_packet, False, True, extended)
-            if not valid and excpCode ==0:
+            session = key.data
+            try:
+                if events & selectors.EVENT_READ:
+                    data = session.conn.recv(4096)
+                    if not data:
+                        print(f"Client disconnected.")
+                        close_session(session)
+                        num_conns -= 1
+                        continue
+
+                    session.inbuf += data
+                    if not session.take_messages(extended):
+                        close_session(session)
+                        num_conns -= 1
+                        continue
+
+                if len(session.outbuf) > 0:
+                    session.send_pending()
+
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                print(f"Client {session.addr} dropped: {e}")
+                close_session(session)
+                num_conns -= 1
                 continue
-            elif not valid:
-                print("error: invalid response message ({modbus_packet}) created")
-                pdu = struct.pack('BB', fc+0x80, excpCode)
-                modbus_packet = create_modbus_tcp_packet(transID, unitID, pdu)
-            
-            # send the response back to the client 
-            conn.sendall(modbus_packet)  
-            # end of the loop, so go back and wait for another request
+
+            # read while the client keeps up with its responses, and wait for room
+            # to send while some are queued
+            want = 0
+            if len(session.outbuf) < max_pending_output:
+                want |= selectors.EVENT_READ
+            if len(session.outbuf) > 0:
+                want |= selectors.EVENT_WRITE
+            if want != key.events:
+                sel.modify(session.conn, want, session)
 
 
 def create_modbus_tcp_packet(transaction_id, unit_id, pdu):
@@ -323,17 +413,27 @@ def create_modbus_tcp_packet(transaction_id, unit_id, pdu):
     return mbap_header + pdu
 
 
-def setup_server(tablesize, server_host, client_port):
+def setup_server(table_size, server_host, client_port, mode='threads', max_conns=None, segments=None):
     global srvr_sock, coilblock, datablock, inputRegblock, holdingRegblock
+    global tablesize, server_mode, max_connections
     """Run server setup."""
 
-    coilblock       = ModbusSequentialDataBlock(0x00, [0]*tablesize)
-    datablock       = ModbusSequentialDataBlock(0x00, [0]*tablesize)
-    inputRegblock   = ModbusSequentialDataBlock(0x00, [0]*tablesize)
-    holdingRegblock = ModbusSequentialDataBlock(0x00, [0]*tablesize)
+    if mode not in ('threads', 'events'):
+        print(f"unrecognized server mode {mode}")
+        exit(1)
+
+    tablesize = table_size
+    server_mode = mode
+    if max_conns is not None:
+        max_connections = max_conns
+
+    # the translated PLC program reaches the same tables through mbd.  segments,
+    # if given, are the shared memory segments holding them
+    coilblock, datablock, inputRegblock, holdingRegblock = mbd.create_tables(tablesize, segments=segments)
 
     # spin up the srvr socket
     srvr_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srvr_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     srvr_sock.bind((server_host, client_port))
     print(f"listening for client on ({server_host}, {client_port})") 
 
@@ -1,110 +1,116 @@
+import itertools
 import struct
 import pdb
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# bit_table[byte] is the tuple of the 8 booleans coded in byte, least significant bit first
+bit_table = tuple(tuple(bool(byte >> pos & 1) for pos in range(0, 8)) for byte in range(0, 256))
+
+# translation of bytes into the characters '0' (for 0) and '1' (for anything else)
+bit_chars = b'0' + b'1'*255
+
+# decode the first num_bits booleans coded in the bytes of data, least significant bit
+# of the first byte first.  Each byte is looked up in bit_table, so no bit is
+# handled on its own.  If data is too short there are fewer than num_bits booleans
+def unpack_bit_list(data, num_bits):
+    codes = list(itertools.chain.from_iterable(map(bit_table.__getitem__, data)))
+    del codes[num_bits:]
+    return codes
+
+# bit_bytes[byte] is the 8 bits coded in byte as 8 bytes of 0 or 1, least significant bit first
+bit_bytes = tuple(bytes(bits) for bits in bit_table)
+
+# decode the first num_bits bits coded in the bytes of data into a bytes object
+# holding one 0 or 1 per bit, the layout of a coil table in mbd
+def unpack_bit_bytes(data, num_bits):
+    return b''.join(map(bit_bytes.__getitem__, data))[:num_bits]
+
 # the first five bytes in the passed argument identify the starting address,
 # the number of bits being represented, and the number of bytes being used
 # to implement the representation.   Returned is the starting address,
 # the number of bits represented, and a list of booleans representing the encoded bits
 def unpack_bits_pdu(msg):
     adrs, num_bits, num_bytes = struct.unpack('>HHB',msg[:5])
-    # turn the bits into a list of bools
 
-    codes = []
-    bits = msg[5:]
-    cnt_bits = num_bits
-
-    for bitByte in bits:
-        msk = 0x01
-        for pos in range(0,8):
-            if cnt_bits == 0:
-                break
-            if msk & bitByte:
-                codes.append(True)
-            else:
-                codes.append(False)
-            msk = msk << 1
-            cnt_bits -= 1
+    # turn the bits into a list of bools
+    codes = unpack_bit_list(msg[5:5+num_bytes], num_bits)
 
     return adrs, num_bits, codes
 
 
-# PDU header when a list of values is passed to be written into registers. Extract and return
-# the starting address, the number of registers, and a list of values
-# associated with those registers 
-#
-def unpack_write_registers_pdu(msg):
-    adrs, num_regs, byte_cnt = struct.unpack('>HHB', msg[:5])
-    values = []
-    regs = msg[5:]
-    for pos in range(0, num_regs):
-        vt = struct.unpack('>H', regs[:2])
-        values.append(vt[0])
-        regs = regs[2:]
+# the largest number of registers a Modbus request reads at once
+max_registers = 125
 
-    return adrs, num_regs, values
+# register_structs[n] packs and unpacks n big-endian 16-bit registers in one call.
+# They are compiled once, here for every count a Modbus PDU can carry, and on
+# first use for any larger count
+register_structs = [struct.Struct(f'>{num_regs}H') for num_regs in range(0, max_registers+1)]
+
+# the same for a read registers response PDU, function code and byte count ahead of the registers
+response_structs = [struct.Struct(f'>BB{num_regs}H') for num_regs in range(0, max_registers+1)]
+
+address_count_struct = struct.Struct('>HH')
+write_header_struct  = struct.Struct('>HHB')
+
+def register_struct(num_regs):
+    if num_regs <= max_registers:
+        return register_structs[num_regs]
+    return struct.Struct(f'>{num_regs}H')
 
 # PDU header when a list of registers is passed to be read from.  Extract and return
 # the starting address, the number of registers
 def unpack_read_registers_pdu(msg):
-    return struct.unpack('>HH', msg[:5])
+    return address_count_struct.unpack_from(msg)
 
 # PDU header when a list of registers is passed to be written to.  Extract and return
 # the starting address, the number of registers, and return a list of 16-bit values to write
 def unpack_write_registers_pdu(msg):
-    adrs, numValues, numBytes = struct.unpack('>HHB', msg[:5])
-
-    values = []
-    for idx in range(5, 5+2*numValues, 2):
-        value = struct.unpack('>H', msg[idx:idx+2])
-        values.append(value[0])
+    adrs, numValues, numBytes = write_header_struct.unpack_from(msg)
+    values = list(register_struct(numValues).unpack_from(msg, 5))
 
     return adrs, numValues, values
 
 # codes is list of bools.  Return bytes object with
-# list of encoded bits
+# list of encoded bits, the first code in the least significant bit of the first byte.
+# The codes become a string of '0' and '1' characters, last code first, that int()
+# reads as one binary number, whose little-endian bytes are the encoding
 def make_bitmask_list(codes):
-    lenCodes = len(codes)
-    numCodes = int(lenCodes/8)
-    if lenCodes%8 != 0:
-        numCodes += 1
-
-    codePos = 0
-    for code in range(0,numCodes):
-        bitByte = 0x0
-        for pos in range(codePos, min(codePos+8, lenCodes)):
-            if pos%8 == 0:
-                msk = 0x01
-            if codes[pos]:
-                bitByte |= msk
-            msk <<= 1
-
-        if code==0:
-            rtn = struct.pack('B', bitByte)
-        else:
-            rtn = rtn + struct.pack('B', bitByte)
-        codePos += 8
-
-    return rtn
+    numCodes = (len(codes)+7)//8
+    if numCodes == 0:
+        return b''
+
+    try:
+        # bools, and ints that fit a byte, go to bytes() as they are
+        bits = bytes(codes)
+    except (TypeError, ValueError):
+        bits = bytes(map(bool, codes))
+
+    return int(bits.translate(bit_chars)[::-1], 2).to_bytes(numCodes, 'little')
 
 # list of integers is passed as argument.   Return bytes object
 # encoding that list as a sequence of 16-bit integer values
 def make_values_list(values):
-    rtn = struct.pack('>H', values[0])
-    for pos in range(1,len(values)):
-        rtn = rtn + struct.pack('>H', values[pos])
-
-    return rtn
-
+    return register_struct(len(values)).pack(*values)
+
+# encode values as 16-bit registers into buffer, a bytearray allocated once by
+# the caller, starting at offset.  Returns the offset just past them
+def pack_values_into(buffer, offset, values):
+    register_struct(len(values)).pack_into(buffer, offset, *values)
+    return offset+2*len(values)
+
+# the PDU of a response to reading registers, function code fc, carrying values
+def make_registers_pdu(fc, values):
+    num_regs = len(values)
+    if num_regs <= max_registers:
+        return response_structs[num_regs].pack(fc, 2*num_regs, *values)
+    return struct.pack('>BB', fc, 2*num_regs) + make_values_list(values)
+
+# decode a bytes object holding a sequence of 16-bit integer values into a list
 def unpack_values_list(values):
-    vList = []
-    bytesToParse = len(values)
-    while bytesToParse > 0:
-        value = struct.unpack('>H', values[:2])
-        vList.append(value[0])
-        values = values[2:]
-        bytesToParse -= 2
-    return vList
+    return list(register_struct(len(values)//2).unpack_from(values))
 
+# decode num_regs 16-bit values from data, starting at offset, without slicing data first
+def unpack_values_from(data, num_regs, offset=0):
+    return list(register_struct(num_regs).unpack_from(data, offset))
@@ -1,21 +1,25 @@
 import argparse
+import os
 import re
 import pdb
 import sys
 import json
 import math
 import copy
+import hashlib
+import keyword
+import operator
+
+import stcache
+import stparse
 
 from pathlib import Path
 
-st_file = ''
-python_file = ''
-location_file = ''
-intrfc_file = ''
+# version of the translator, part of the build cache key
+pyST_version = '2.0'
 
-global_lines = []
-global_vars  = []
-global_stmnt = ''
+# the memory classes of the PLC variables, in the order their Modbus indices are laid out
+mem_classes = ('IX', 'IW', 'QX', 'QW', 'MW', 'MD', 'ML')
 
 functions = """
 def MAX(a,b):
@@ -138,19 +142,14 @@ class var_seq():
         self.subseq = []
         
     def add_var(self, name, var_type, py_type, mem_code, value, var_array=False, array_len=0):
-        # no memory class position if the length of the mem_code is just 2 for the memory class
+        # no memory class position if the length of the mem_code is just 2 for the memory class,
+        # so the variable goes just past the last one already in the sequence
         if len(mem_code) == 2:
-            # add this to the end of the last existing subseq, if any
-            if len(self.subseq) > 0: 
-                self.add_var(name, var_type, py_type, mem_code, self.subseq[-1].last+1, value, \
-                    var_array=var_array, array_len=array_len)
-            else: 
-                # nothing already in the sequence, so this goes first
-                new_subseq = var_subseq(name, var_type, py_type, mem_code, 0, value, \
-                    var_array=var_array, array_len=array_len)
-
-            return True
-   
+            pos = self.subseq[-1].last+1 if len(self.subseq) > 0 else 0
+            if mem_code[1] == 'X':
+                mem_code = f"{mem_code}{int(pos/8)}.{pos%8}"
+            else:
+                mem_code = f"{mem_code}{pos}"
         else:
             # memory address is specified
             pos = mem_code[2:] 
@@ -162,79 +161,39 @@ class var_seq():
                 bit  = int(pieces[1]) 
                 pos = 8*word+bit
 
-        # if the memory address is specified the user has to get it right, no error checking here
-        for idx in range(0, len(self.subseq)):
-            # find where to insert it
-            if pos+array_len < self.subseq[idx].first: 
-                # first subseq that dominates the location.
-                # tack it on to the previous subseq?
-                if idx>0 and self.subseq[idx-1].last == pos-1+array_len:
-                    # loc fits at tail of previous subseq
-                    self.subseq[idx-1].append_var(name, var_type, py_type, mem_code, pos, value, \
-                        var_array=var_array, array_len=array_len)
-
-                    # see if now the subseqs are adjacent 
-                    if self.subseq[idx-1].last+1 == self.subseq[idx].first:
-                        # they are adjacent, so combine them
-                        self.subseq[idx-1].merge_var(self.subseq[idx])
-
-                        # either truncate self.subseq[idx], or pull in the subseqs beyond it 
-                        if idx < len(self.subseq)-1:
-                            # there are subseqs with index larger than idx
-                            tail = copy.copy(self.subseq[idx+1:])
-                            self.subseq[:idx].extend(tail)
-                        else:
-                            # nothing beyond idx
-                            self.subseq = self.subseq[:idx]
-
-                    # done with merging adjacent subseqs
-                    return True
-            
-                # did not attach to previous subseq, does it attach to the one at idx?
-                elif pos+array_len+1 == self.subseq[idx].first:
-                    # yes it does, so call add_var to put it in
-                    self.subseq[idx] = self.subseq[idx].prepend_var(name, var_type, py_type, mem_code, pos, value,\
-                        var_array=var_array, array_len=array_len)
-
-                    return True
-                else:
-                    # variable at location idx appears before the one at location idx
-                    # make a new subseq containing only this variable
-                    new_subseq = var_subseq(name, var_type, py_type, mem_code, pos, value, \
-                        var_array=var_array, array_len=array_len)
-
-                    # remember the subseq that follows the new one
-                    if idx > 0:
-                        # a subsequence behind the inserted subseq
-                        tail = copy.copy(self.subseq[idx:])
-                        self.subseq = self.subseq[:idx].append(new_subseq)
-                        self.subseq.extend(tail)
-                    else:
-                        # inserted subseq goes to the front
-                        tail = copy.copy(self.subseq)
-                        self.subseq = [new_subseq]
-                        self.subseq.extend(tail)
+        last = pos+array_len-1 if array_len > 0 else pos
 
-                    return True
+        # find the first subseq that starts beyond the variable
+        idx = 0
+        while idx < len(self.subseq) and self.subseq[idx].first <= last:
+            idx += 1
 
-            # loc is larger than the first element of the subseq indexed at idx.
-            # error if it falls within that subseq
-            elif pos+array_len <= self.subseq[idx].last:
-                print(f"variable of type {self.var_type} at location {pos} already defined")
-                return False
+        # the subseq before that one must end before the variable starts
+        if idx > 0 and pos <= self.subseq[idx-1].last:
+            print(f"variable of type {self.var_type} at location {pos} already defined")
+            return False
 
-        # ran through the entire list of subseqs without finding a preceding subseq. 
-        # if there was a last subseq see if this joins it
-        if len(self.subseq) > 0:
-            if self.subseq[-1].last+1 == pos:
-                self.subseq[-1].append_var(name, var_type, py_type, mem_code, pos, value, \
-                    var_array=var_array, array_len=array_len)
-                return True
-
-        # no, so add a new one at the end
         new_subseq = var_subseq(name, var_type, py_type, mem_code, pos, value, \
             var_array=var_array, array_len=array_len)
-        self.subseq.append(new_subseq)
+
+        if idx > 0 and self.subseq[idx-1].last+1 == pos:
+            # tack it on to the tail of the previous subseq
+            self.subseq[idx-1].merge_var(new_subseq)
+
+            # see if now the subseqs are adjacent, and if so combine them
+            if idx < len(self.subseq) and self.subseq[idx-1].last+1 == self.subseq[idx].first:
+                self.subseq[idx-1].merge_var(self.subseq[idx])
+                del self.subseq[idx]
+
+        elif idx < len(self.subseq) and last+1 == self.subseq[idx].first:
+            # put it at the front of the following subseq
+            new_subseq.merge_var(self.subseq[idx])
+            self.subseq[idx] = new_subseq
+
+        else:
+            # a new subseq holding only this variable
+            self.subseq.insert(idx, new_subseq)
+
         return True 
 
     def import_values(self):
@@ -252,6 +211,7 @@ class var_desc():
         self.var_type = var_type
         self.py_type  = py_type
         self.mem_code = mem_code
+        self.mb_idx   = None
 
 class var_subseq():
     def __init__(self, name, var_type, py_type, mem_code, pos, value, var_array=False, array_len=0):
@@ -341,15 +301,6 @@ def check_values(vlist):
   
  
 
-IX_seq = var_seq('IX')
-IW_seq = var_seq('IW')
-QX_seq = var_seq('QX')
-QW_seq = var_seq('QW')
-MW_seq = var_seq('MW')
-MD_seq = var_seq('MD')
-ML_seq = var_seq('ML')
-
-
 var_types = ('BOOL', \
     'SINT', 'INT', 'DINT', 'LINT', \
     'USINT', 'UINT', 'UDINT', 'ULINT', \
@@ -372,11 +323,11 @@ python_type = {
     'WORD':'int',
     'DWORD':'int',
     'LWORD':'int',
-    'REAL':'int',
-    'LREAL':'int',
-    'STRING':'int',
+    'REAL':'float',
+    'LREAL':'float',
+    'STRING':'str',
     'WSTRING':'str', 
-    'TIME':'str',
+    'TIME':'int',
     'TOD':'str',
     'DATE':'str',
     'DTL':'str'}
@@ -392,106 +343,86 @@ type_to_size = {'SINT':'MW', 'INT':'MW', 'DINT':'MD', 'LINT':'ML',\
 fb_types = ('TON', 'TOF', 'TP', 'CTU', 'CTD', 'PULSE_GEN', \
     'CTUD', 'RS', 'SR', 'F_TRIG', 'R_TRIG', 'IMPORT_FROM_MB', 'EXPORT_TO_MB')
 
+# function blocks whose instances can be called as a batch, and the least number
+# of them a FOR loop calls for the loop to become one call of them all.  The
+# array of instances is then declared an fb_array of aux.py
+batch_fb_types = ('R_TRIG', 'F_TRIG', 'RS', 'SR')
+batch_min = 16
 
+# names of the standard functions carried into the translation
+function_names = frozenset(re.findall(r"^def (\w+)\(", functions, re.MULTILINE))
+
+
+# A Variable describes one declared ST variable.  The value is already in its
+# python representation (a list of them for an array).  place() registers the
+# variable with the var_seq of its memory class, if it has one
 class Variable:
     def __init__(self, name, var_type, mem_code, value, var_array=False, array_len=0): 
 
-        self.name = name.upper()
+        self.name = name
 
         self.var_type = var_type.upper()
-        self.var_type = self.var_type.replace(';','')
         self.var_array   = var_array
         self.array_len   = array_len
+        self.value = value
 
         if self.var_type in python_type:
-            py_type = python_type[self.var_type]
-        else:
-            py_type = 'class'
-
-        if value is not None:
-            value = value.replace(';','')
-
-        if var_type in var_types: 
-            if var_array and value is not None and len(value) > 0:
-                var_value = value.replace(';','')
-                var_value = value.replace('[','')
-                var_value = var_value.replace(']','')
-
-                values = var_value.split(',')
-                value_list = []
-                for idx in range(0, array_len):
-                    match py_type:
-                        case 'bool':
-                            value_list.append(bool(values[idx]))
-                        case 'int' | 'byte':
-                            value_list.append(int(values[idx]))
-                        case 'float':
-                            value_list.append(float(values[idx]))
-                        case 'str':
-                            value_list.append(str(values[idx]))
-
-                if py_type == 'byte':
-                    self.value = bytes(value_list)
-                else:
-                    self.value = value_list 
-
-            elif value is not None:
-                match py_type:
-                    case 'int':
-                        self.value = int(value)
-                    case 'float':
-                        self.value = float(value)
-                    case 'str':
-                        self.value = value
-                    case 'bool':
-                        if value in ('TRUE','True','true'):
-                            self.value = 'True' 
-                        elif value in ('FALSE', 'False', 'false'):
-                            self.value = 'False'
-                        else:
-                            pdb.set_trace()
-                            x= -1
-                    case 'byte':
-                        values = bytes([value])
-                        self.value = values[0]
-            else:
-                self.value = None
-        elif var_type in fb_types:
-            self.value = value
+            self.py_type = python_type[self.var_type]
         else:
-            self.value = None
+            self.py_type = 'class'
 
-        # put this variable in the right mapping class
-        if not mem_code is None:
+        # find the memory class this variable is mapped to, if any
+        if mem_code is not None:
             mem_code = mem_code.replace('%','')
-            mem_class = mem_code[:2]
+            self.mem_class = mem_code[:2]
+        elif self.var_type in type_to_size: 
+            self.mem_class = type_to_size[self.var_type]
+            mem_code  = self.mem_class
         else:
-            if self.var_type in type_to_size: 
-                mem_class = type_to_size[self.var_type]
-                mem_code  = mem_class
-            else:
-                return
-
-        match mem_class:
-            case 'QX':
-                QX_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len)
-            case 'IX':
-                IX_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len )
-            case 'IW':
-                IW_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len)
-            case 'QW':
-                QW_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len)
-            case 'MW':
-                MW_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len)
-            case 'MD':
-                MD_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len)
-            case 'ML':
-                ML_seq.add_var(name, var_type, py_type, mem_code, self.value, var_array=var_array, array_len=array_len)
-            case _:
-                print(f"unrecognized PLC address {adrs}")
-                return  
-
-global_stmnt = ''
+            self.mem_class = None
+
+        self.mem_code = mem_code
+
+    # put this variable in the var_seq of its memory class, seqs holding those by class,
+    # at mem_code if given rather than its own
+    def place(self, seqs, mem_code=None):
+        if self.mem_class is None:
+            return
+        if self.mem_class not in seqs:
+            print(f"unrecognized PLC address {self.mem_code}")
+            return
+
+        if mem_code is None:
+            mem_code = self.mem_code
+        seqs[self.mem_class].add_var(self.name, self.var_type, self.py_type, mem_code, self.value, \
+            var_array=self.var_array, array_len=self.array_len)
+
+    # the fields of the Variable as a list of json values, for the record of an
+    # incremental translation
+    def record(self):
+        return [self.name, self.var_type, self.mem_code, self.value, self.var_array, self.array_len]
+
+# the Variable a record() describes
+def recorded_variable(record):
+    name, var_type, mem_code, value, var_array, array_len = record
+    var = Variable(name, var_type, mem_code, value, var_array=var_array, array_len=array_len)
+    var.mem_code = mem_code
+    return var
+
+# the location that an earlier translation, whose location map entries prev_locs holds
+# by name, gave a variable without an explicit address: its mem_code there if it had the
+# same type, memory class and number of elements, otherwise None
+def previous_location(var, prev_locs):
+    if var.var_array:
+        if f"{var.name}[{var.array_len-1}]" not in prev_locs or f"{var.name}[{var.array_len}]" in prev_locs:
+            return None
+        prev = prev_locs.get(f"{var.name}[0]")
+    else:
+        prev = prev_locs.get(var.name)
+
+    if prev is None or prev['var_type'] != var.var_type or (prev['mem_code'] or '')[:2] != var.mem_class:
+        return None
+    return prev['mem_code']
 
 def clean_value(value):
 
@@ -507,685 +438,1167 @@ def clean_value(value):
         return 'True'
     return value
 
+# python spelling of an ST identifier; names that are python keywords get a trailing '_'
+def python_name(name):
+    if keyword.iskeyword(name):
+        return name+'_'
+    return name
+
+# python source text for a constant value
+def py_literal(value):
+    if isinstance(value, bool):
+        return 'True' if value else 'False'
+    if isinstance(value, (int, float, str)):
+        return repr(value)
+    if isinstance(value, list):
+        return '['+', '.join(py_literal(v) for v in value)+']'
+    return 'None'
+
+# the initial value given to a variable of the python type when the ST declaration has none
+def default_value(py_type):
+    match py_type:
+        case 'bool':
+            return False
+        case 'int' | 'byte':
+            return 0
+        case 'float':
+            return 0.0
+        case 'str':
+            return ''
+    return None
+
+def typed_constant(value, py_type):
+    match py_type:
+        case 'bool':
+            return bool(value)
+        case 'int' | 'byte':
+            return int(value)
+        case 'float':
+            return float(value)
+        case 'str':
+            return str(value)
+    return value
+
+# return (True, value) if the expression is a constant, (False, None) otherwise
+def literal_value(expr):
+    match expr:
+        case stparse.Literal():
+            return True, expr.value
+        case stparse.UnaryOp(op='-'):
+            ok, value = literal_value(expr.operand)
+            if ok and isinstance(value, (int, float)) and not isinstance(value, bool):
+                return True, -value
+        case stparse.UnaryOp(op='NOT'):
+            ok, value = literal_value(expr.operand)
+            if ok and isinstance(value, bool):
+                return True, not value
+    return False, None
+
+# does the expression refer to the variable named
+def mentions(node, name):
+    if isinstance(node, stparse.Name):
+        return node.name.upper() == name
+    if isinstance(node, (list, tuple)):
+        return any(mentions(item, name) for item in node)
+    if hasattr(node, '__dict__'):
+        return any(mentions(value, name) for value in vars(node).values())
+    return False
+
+# A Pou describes a user-defined FUNCTION_BLOCK or FUNCTION of the ST source: the
+# python class or function it becomes, and the python names of its fields (the
+# inputs, for a FUNCTION) by upper-cased ST name, so that references to them in
+# any spelling find them
+class Pou:
+    def __init__(self, kind, name, fields):
+        self.kind = kind
+        self.name = name
+        self.fields = fields
+
+# python for the value of input py_name as a POU takes it.  ST passes inputs by value,
+# so an array is copied, deeply if its elements are lists or function block instances
+def input_copy(py_name, var_type, sizes):
+    if len(sizes) == 0:
+        return py_name
+    if len(sizes) == 1 and var_type in var_types:
+        return f"list({py_name})"
+    return f"copy.deepcopy({py_name})"
+
+# fold a flat list of values into nested lists with the given dimension sizes
+def nest_values(values, sizes):
+    if len(sizes) == 1:
+        return values
+    step = len(values)//sizes[0]
+    return [nest_values(values[idx*step:(idx+1)*step], sizes[1:]) for idx in range(0, sizes[0])]
+
+
+# the python value of each ST binary operator on constants, as PyEmitter writes it
+fold_binops = {
+    'OR': lambda a, b: a or b, 'AND': lambda a, b: a and b, 'XOR': operator.xor,
+    '=': operator.eq, '<>': operator.ne, '<': operator.lt, '>': operator.gt, '<=': operator.le, '>=': operator.ge,
+    '+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv, 'MOD': operator.mod,
+    '**': operator.pow}
+
+# does the expression call a function
+def has_call(node):
+    if isinstance(node, stparse.Call):
+        return True
+    if isinstance(node, (list, tuple)):
+        return any(has_call(item) for item in node)
+    if hasattr(node, '__dict__'):
+        return any(has_call(value) for value in vars(node).values())
+    return False
+
+# ConstFolder simplifies the statements of a program organization unit before the
+# PyEmitter writes them, so the python does at translation what it would otherwise do
+# on every scan:
+#   - an expression on constants becomes the constant python computes for it
+#   - a name declared in a VAR CONSTANT block with a constant value becomes the value
+#   - IF and CASE branches a constant condition or selector rules out are dropped,
+#     and so are WHILE loops that never run
+#   - calls of MOVE, INT_TO_DINT, and SEL with a constant selector give way to the
+#     argument the function returns
+# constants holds the values of the VAR CONSTANT names by upper-cased name, and pous
+# the user-defined function blocks and functions, which hide standard functions
+# of the same name
+class ConstFolder:
+    def __init__(self, constants, pous):
+        self.constants = constants
+        self.pous = pous
+
+    def stmts(self, stmts):
+        folded = []
+        for stmt in stmts:
+            folded.extend(self.stmt(stmt))
+        return folded
+
+    # the statements that take the place of one
+    def stmt(self, node):
+        match node:
+            case stparse.Assign():
+                node.target = self.target(node.target)
+                node.value = self.expr(node.value)
+
+            case stparse.CallStmt():
+                node.callee = self.target(node.callee)
+                self.args(node.args)
+
+            case stparse.If():
+                branches = []
+                else_body = None
+                for cond, body in node.branches:
+                    cond = self.expr(cond)
+                    ok, value = literal_value(cond)
+                    if not ok:
+                        branches.append((cond, self.stmts(body)))
+                    elif value:
+                        # the branches after this one never run
+                        else_body = self.stmts(body)
+                        break
+                else:
+                    if node.else_body is not None:
+                        else_body = self.stmts(node.else_body)
+
+                if len(branches) == 0:
+                    return else_body if else_body is not None else []
+                node.branches = branches
+                node.else_body = else_body
+
+            case stparse.Case():
+                node.selector = self.expr(node.selector)
+                node.branches = [([self.label(label) for label in labels], self.stmts(body)) \
+                    for labels, body in node.branches]
+                if node.else_body is not None:
+                    node.else_body = self.stmts(node.else_body)
+
+                ok, value = literal_value(node.selector)
+                if ok:
+                    body = self.case_choice(value, node)
+                    if body is not None:
+                        return body
+
+            case stparse.For():
+                node.start = self.expr(node.start)
+                node.stop = self.expr(node.stop)
+                if node.step is not None:
+                    node.step = self.expr(node.step)
+                node.body = self.stmts(node.body)
+
+            case stparse.While():
+                node.cond = self.expr(node.cond)
+                ok, value = literal_value(node.cond)
+                if ok and not value:
+                    return []
+                node.body = self.stmts(node.body)
+
+            case stparse.Repeat():
+                node.body = self.stmts(node.body)
+                node.cond = self.expr(node.cond)
+
+        return [node]
+
+    # the body of the branch a CASE with a constant selector value runs, [] if none,
+    # or None if a label that is not constant comes ahead of the branch
+    def case_choice(self, value, node):
+        try:
+            for labels, body in node.branches:
+                for label in labels:
+                    if isinstance(label, stparse.Range):
+                        ok_low, low = literal_value(label.low)
+                        ok_high, high = literal_value(label.high)
+                        if not (ok_low and ok_high):
+                            return None
+                        if low <= value <= high:
+                            return body
+                    else:
+                        ok, label_value = literal_value(label)
+                        if not ok:
+                            return None
+                        if value == label_value:
+                            return body
+        except TypeError:
+            return None
+        return node.else_body if node.else_body is not None else []
+
+    def label(self, label):
+        if isinstance(label, stparse.Range):
+            return stparse.Range(self.expr(label.low), self.expr(label.high))
+        return self.expr(label)
+
+    def args(self, args):
+        for arg in args:
+            arg.value = self.target(arg.value) if arg.output else self.expr(arg.value)
+
+    # a variable assigned to or called, whose indices alone may fold
+    def target(self, node):
+        match node:
+            case stparse.Index():
+                node.base = self.target(node.base)
+                node.indices = [self.expr(idx) for idx in node.indices]
+            case stparse.Member():
+                node.base = self.target(node.base)
+        return node
+
+    def expr(self, node):
+        match node:
+            case stparse.Name():
+                if node.name.upper() in self.constants:
+                    return stparse.Literal(self.constants[node.name.upper()])
+
+            case stparse.Index() | stparse.Member():
+                return self.target(node)
+
+            case stparse.Call():
+                self.args(node.args)
+                return self.inline(node)
+
+            case stparse.UnaryOp():
+                node.operand = self.expr(node.operand)
+                ok, value = literal_value(node)
+                if ok:
+                    return stparse.Literal(value)
+
+            case stparse.BinOp():
+                node.left = self.expr(node.left)
+                node.right = self.expr(node.right)
+                return self.binop(node)
+
+        return node
+
+    def binop(self, node):
+        ok_left, left = literal_value(node.left)
+        ok_right, right = literal_value(node.right)
+        fold = fold_binops.get(node.op)
+        if not (ok_left and ok_right) or fold is None:
+            return node
+        if not all(isinstance(value, (bool, int, float)) for value in (left, right)):
+            return node
+        if node.op == '**' and isinstance(right, int) and abs(right) > 64:
+            # left as python would compute it, rather than writing out a huge number
+            return node
+
+        try:
+            value = fold(left, right)
+        except (ArithmeticError, TypeError, ValueError):
+            return node
+        if not isinstance(value, (bool, int, float)) or isinstance(value, float) and not math.isfinite(value):
+            return node
+        return stparse.Literal(value)
+
+    # the argument a call of MOVE, INT_TO_DINT, or SEL with a constant selector
+    # returns, in place of the call.  The call itself for any other
+    def inline(self, node):
+        name = node.func.upper()
+        args = node.args
+        if name in self.pous or any(arg.name is not None or arg.output for arg in args):
+            return node
+
+        match name, len(args):
+            case ('MOVE' | 'INT_TO_DINT'), 1:
+                return args[0].value
+            case 'SEL', 3:
+                ok, value = literal_value(args[0].value)
+                if ok:
+                    keep, drop = (args[2], args[1]) if value else (args[1], args[2])
+                    # the argument dropped is not evaluated, which matters only for a call
+                    if not has_call(drop.value):
+                        return keep.value
+        return node
+
+# simplify the declarations and the body of a program organization unit with a
+# ConstFolder, pous being the user-defined function blocks and functions
+def fold_pou(pou, pous):
+    constants = {}
+    folder = ConstFolder(constants, pous)
+    for var_blk in pou.var_blocks:
+        for decl in var_blk.decls:
+            if not isinstance(decl, stparse.VarDecl) or decl.init is None:
+                continue
+            if isinstance(decl.init, stparse.ArrayInit):
+                decl.init.items = [folder.expr(item) for item in decl.init.items]
+                continue
+
+            decl.init = folder.expr(decl.init)
+            var_type = decl.type_name.upper()
+            if var_blk.kind == 'VAR' and 'CONSTANT' in var_blk.qualifiers and len(decl.dims) == 0 \
+                    and decl.mem_code is None and var_type in python_type:
+                ok, value = literal_value(decl.init)
+                if ok:
+                    for name in decl.names:
+                        constants[name.upper()] = typed_constant(value, python_type[var_type])
+
+    pou.body = folder.stmts(pou.body)
+
+
 class ConvertorApp:
-    def __init__(self, st_file):
-        self.st_file = st_file
+    def __init__(self, job):
+        self.job = job
+        self.st_file = job.st_file
+
+        # declared variables indexed by upper-cased ST name, since ST names are case-insensitive
+        self.symbols = {}
+
+        # where in the job's global_lines each variable is declared, by python name
+        self.decl_lines = {}
+
+        # the user-defined function blocks and functions by upper-cased ST name
+        self.pous = {}
+
+        # the emitter writes the body of the scan loop, two levels in from the left
+        self.emitter = PyEmitter(self.symbols, indent=2, pous=self.pous)
+
+        # the PROGRAM translated, the first in the source, and its variables
+        self.program = None
+        self.variables = []
 
     def convert(self):
         with open(self.st_file,'r') as rf:
             st_code = rf.read()
 
         converted_code = self.convert_st_to_python(st_code)
-        #converted_code = self.clean_up_python_code(converted_code)
         return converted_code
 
+    # translate ST source text.  The variable declarations go to the global_lines and
+    # var_seqs of the job, the user-defined function blocks and functions to its
+    # pou_lines, and the returned python is the body of the PLC scan loop
     def convert_st_to_python(self, st_code):
-        global global_stmnt, global_vars
+        pous = stparse.parse(st_code)
+
+        # every function block and function is known before any is translated, so
+        # that each may use those declared after it
+        for pou in pous:
+            self.register_pou(pou)
+        for pou in pous:
+            self.convert_unit(pou)
+        return self.finish()
+
+    # translate the ST file a program organization unit at a time, writing the python
+    # of each FUNCTION_BLOCK and FUNCTION to wf as soon as it is translated, so that
+    # no more of the source or its translation is held than the largest unit and
+    # the PROGRAM.  The file is read twice, the first time to learn every unit's
+    # name and fields.  Returns what convert_st_to_python does
+    def convert_stream(self, wf):
+        with open(self.st_file, 'r') as rf:
+            for pous in stparse.parse_stream(rf):
+                for pou in pous:
+                    self.register_pou(pou)
+
+        with open(self.st_file, 'r') as rf:
+            for pous in stparse.parse_stream(rf):
+                for pou in pous:
+                    self.convert_unit(pou)
+                wf.write(self.job.add_pous())
+                self.job.pou_lines.clear()
+        return self.finish()
+
+    def register_pou(self, pou):
+        if pou.kind != 'PROGRAM':
+            self.pous[pou.name.upper()] = Pou(pou.kind, python_name(pou.name), self.pou_fields(pou))
+
+    def convert_unit(self, pou):
+        fold_pou(pou, self.pous)
+        if pou.kind != 'PROGRAM':
+            self.convert_pou(pou, self.emitter)
+        elif self.program is None:
+            self.program = pou
+            self.convert_program(pou)
+        else:
+            print(f"warning: only the first PROGRAM is translated, skipping {pou.name}")
+
+    # translate the ST file reusing the python that record, of the previous incremental
+    # translation, holds for each piece of the source (of stparse.source_units)
+    # whose text is unchanged.  A recorded piece is used again only if every function
+    # block and function has the name and fields it had then, and the Modbus calls the
+    # python of the piece refers to by index (mb_sites) start at the same index, since
+    # its python depends on both.  Everything else is parsed and translated.  Sets
+    # self.units to the record of this translation, and returns what
+    # convert_st_to_python does
+    def convert_incremental(self, record):
+        prev = {}
+        if record is not None:
+            prev = {unit['hash']: unit for unit in record['units']}
+
+        # each piece of the source with its record and tokens, or if there is no record its
+        # parse, the units of which are registered once those of the records are
+        pieces = []
+        with open(self.st_file, 'r') as rf:
+            for source, first, tokens in stparse.source_units(rf):
+                digest = hashlib.sha256(source.encode()).hexdigest()
+                unit = prev.get(digest)
+                if unit is None:
+                    pieces.append((digest, None, stparse.Parser(tokens).parse_file()))
+                    continue
 
-        variables = {}
+                pieces.append((digest, unit, tokens))
+                for kind, name, py_name, fields in unit['pous']:
+                    self.pous[name.upper()] = Pou(kind, py_name, fields)
 
-        # get rid of configuration block if present
-        config_pattern = r"CONFIGURATION(.*?)END_CONFIGURATION"
-        config_match = re.search(config_pattern, st_code, re.DOTALL)
-        if config_match:
-            st_code = re.sub(config_pattern, '', st_code, flags=re.DOTALL)
+        for digest, unit, content in pieces:
+            if unit is None:
+                for pou in content:
+                    self.register_pou(pou)
 
-        # scrap off PROGRAM and END_PROGRAM
-        st_code = st_code.replace('END_PROGRAM','')
+        signature = self.pou_signature()
+        reuse = record is not None and record['signature'] == signature
 
-        first = st_code.find('PROGRAM')
-        last  = st_code[first:].find('\n')
-        if first>0:
-            front = st_code[:first-1]
-        else:
-            front = ''
-        back  = st_code[last+1:]
-        st_code = front+back
-
-        # replace line by line comment
-        lines = st_code.split('\n')
-        trans = []
-        for line in lines: 
-            if line.find('(*') > -1:
-                first = line.find('(*')
-                last  = line.find('*)')
-                line = line[:first]+'//'+line[first+2:last] 
-            trans.append(line)
-
-        st_code = '\n'.join(trans)
- 
-        var_blk_desc = (\
-            ('all', r"VAR\s+(.*?)END_VAR"),\
-            ('input', r"VAR_INPUT (.*?)END_VAR"), \
-            ('output', r"VAR_OUTPUT (.*?)END_VAR"), \
-            ('in_out', r"VAR_IN_OUT (.*?)END_VAR"), \
-            ('global', r"VAR_GLOBAL (.*?)END_VAR"), \
-            ('external', r"VAR_EXTERNAL (.*?)END_VAR"), \
-            ('temp', r"VAR_TEMP (.*?)END_VAR"))
-
-        ret_code = ""
-        python_code = ""
-    
-        for var_class, var_declaration_pattern in var_blk_desc:
+        self.units = []
+        for digest, unit, content in pieces:
+            if unit is not None:
+                if reuse and unit['site_base'] == len(self.emitter.mb_sites):
+                    self.restore_unit(unit)
+                    self.units.append(unit)
+                    continue
+                content = stparse.Parser(content).parse_file()
+            self.units.append(self.translate_unit(digest, content))
+
+        python_body = self.finish()
+        self.units = {'signature': signature, 'units': self.units}
+        return python_body
+
+    # digest of the name and fields of every function block and function
+    def pou_signature(self):
+        pous = [[key, pou.kind, pou.name, pou.fields] for key, pou in sorted(self.pous.items())]
+        return hashlib.sha256(json.dumps(pous, sort_keys=True).encode()).hexdigest()
+
+    # translate the program organization units parsed from one piece of the source, and
+    # return the record of their python for convert_incremental
+    def translate_unit(self, digest, pous):
+        job = self.job
+        site_base = len(self.emitter.mb_sites)
+        first_line = len(job.pou_lines)
+        program = self.program
+
+        for pou in pous:
+            self.convert_unit(pou)
+
+        unit = {'hash': digest, 'site_base': site_base, 'sites': self.emitter.mb_sites[site_base:], \
+            'pous': [], 'pou_lines': job.pou_lines[first_line:], 'program': None}
+        for pou in pous:
+            if pou.kind != 'PROGRAM':
+                info = self.pous[pou.name.upper()]
+                unit['pous'].append([info.kind, pou.name, info.name, info.fields])
+
+        # the PROGRAM translated is the only one to write declarations and the scan loop body
+        if self.program is not program:
+            unit['program'] = {'name': self.program.name, \
+                'variables': [var.record() for var in self.variables], \
+                'global_lines': list(job.global_lines), 'global_vars': list(job.global_vars), \
+                'global_stmnt': job.global_stmnt, 'body': list(self.emitter.lines)}
+        return unit
+
+    # take the python of one piece of the source from its record
+    def restore_unit(self, unit):
+        job = self.job
+        self.emitter.mb_sites.extend(tuple(site) for site in unit['sites'])
+        job.pou_lines.extend(unit['pou_lines'])
+
+        program = unit['program']
+        if program is None:
+            return
+        if self.program is not None:
+            print(f"warning: only the first PROGRAM is translated, skipping {program['name']}")
+            return
 
-            # for each variable block type find all instances
-            var_blks = re.finditer(var_declaration_pattern, st_code, re.IGNORECASE | re.DOTALL)
-            holding = []
-            for var_blk in var_blks:
-                holding.append(var_blk)     
-        
-            var_blks = reversed(holding)
-            for var_declaration in var_blks:    
-                (start, end) = var_declaration.span()
-                remainder = st_code[end+1:]
-
-                var_blk = var_declaration.group(1)
-
-                #trans_lines = ['!@!START_BLK']
-                var_lines = var_blk.split('\n')
-                for line in var_lines:
-                    if len(line)>0:
-                        line = line.strip()
-                        if line.startswith('//'):
-                            global_lines.append(line.replace(';',''))
-                            continue
-
-                        # look for an ARRAY declaration
-                        if line.find('ARRAY[') == -1:
-                            # look for initial assignments 
-                            split_line = line.split(":=", maxsplit=1)
-                            if len(split_line) > 1:
-
-                                # var_value is the initialization value
-                                var_first, var_value = split_line
-                                var_value = var_value.strip()
-                                if var_value.find('//') > -1:
-                                    var_value = var_value[:var_value.find('//')]
-                               
-                                var_value = clean_value(var_value) 
-
-                                var_name, var_type = var_first.split(":", maxsplit=1)
-
-                                var_type = var_type.replace(';','')
-                                var_type = var_type.strip()
-                                if var_type.find('//') > -1:
-                                    var_type = var_type[:var_type.find('//')]
-                                var_type = var_type.strip()
-
-                                var_name = var_name.strip()
-
-                                mem_code = None
-                                if var_name.find(' AT %') > -1:
-                                    idx      = var_name.find(' %') 
-                                    mem_code = var_name[idx+2:].strip() 
-                                    var_name = var_name[:var_name.find(' AT %')].strip()
-                                 
-                                vname_list = var_name.split(',')
-                                
-                                for vname in vname_list:   
-                                    # variables indexed by name gives the variable type, which might be a function block
-                                    variables[vname] = Variable(vname, var_type, mem_code, \
-                                        var_value, var_array=False, array_len=0)
-
-                                var_name = var_name.replace(',','=')
-
-                                new_line = f"{var_name} = {var_value}"
-                                global_vars.append(var_name)
-
-                                if line.find('//') > -1:
-                                    new_line = new_line + line[line.find('//'):]
-
-                                global_lines.append(new_line.replace(';',''))
-
-                            else:
-                                var_value = None
-                                var_declaration = split_line[0]
-
-                                if var_declaration.find(':') > -1:
-                                    var_name, var_type = var_declaration.split(":", maxsplit=1)
-
-                                    var_type = var_type.replace(';','')
-                                    if var_type.find('//') > -1:
-                                        var_type = var_type[:var_type.find('//')]
-                                    var_type = var_type.strip()
-
-                                    var_name = var_name.strip()
-                                    mem_code = None
-                                    if var_name.find(' AT %') > -1:
-                                        idx = var_name.find(' %') 
-                                        mem_code = var_name[idx+3:].strip() 
-
-                                    var_value = clean_value(var_value)
-     
-                                    if var_type not in var_types and var_type not in fb_types:
-                                        print(f"Variable {var_name} with unrecognized type {var_type}")
-                                        var_value = None
-
-                                    value = None
-                                    if var_type in fb_types:
-                                        var_value = f"{var_type}()"
-
-                                    variables[var_name] = Variable(var_name, var_type, mem_code, \
-                                        var_value, var_array=False, array_len=0)
-
-                                    var_name = var_name.replace(',','=')
-                                    global_vars.append(var_name)
-                                    new_line = f"{var_name} = {var_value}"
-                                    global_lines.append(new_line)
-
-                        elif line.find('ARRAY[') > -1:
-                            # look for initial assignments 
-                            split_line = line.split(":=", maxsplit=1)
-                            if len(split_line) > 1:
-
-                                # var_value is the initialization value
-                                var_first, var_value = split_line
-                                var_value = var_value.strip()
-                                if var_value.find('//') > -1:
-                                    var_value = var_value[:var_value.find('//')]
-                                var_value = var_value.replace(';','') 
-                                var_name, var_array = var_first.split(":", maxsplit=1)
-                                leftb  = var_array.find('[')
-                                rightb = var_array.find(']') 
-                                idx_rng = var_array[leftb+1:rightb]
-                                lefti, righti = idx_rng.split('..')
-                                left_idx  = int(lefti)
-                                right_idx = int(righti)
-
-                                if left_idx != 0:
-                                    print(f"arrays start at index 0: {line.strip()}")
-                                    exit(1)
-
-                                type_idx  = var_array.find(' OF ')
-                                var_type  = var_array[type_idx+4:].strip()
-                                var_type = var_type.replace(';','')
-
-                                var_type = var_type.strip()
-                                var_name = var_name.strip()
-
-                                mem_code = None
-                                if var_name.find(' AT %') > -1:
-                                    idx      = var_name.find(' %') 
-                                    mem_code = var_name[idx+2:].strip() 
-                                    var_name = var_name[:var_name.find(' AT %')].strip()
-                                 
-                                vname_list = var_name.split(',')
-                                
-                                for vname in vname_list:   
-                                    # variables indexed by name gives the variable type, which might be a function block
-                                    variables[vname] = Variable(vname, var_type, mem_code, \
-                                        var_value, var_array=True, array_len=right_idx+1)
-
-                                var_name = var_name.replace(',','=')
-
-                                new_line = f"{var_name} = {var_value}"
-                                global_vars.append(var_name)
-
-                                if line.find('//') > -1:
-                                    new_line = new_line + line[line.find('//'):]
-
-                                global_lines.append(new_line.replace(';',''))
-
-                            else:
-                                var_value = None
-                                var_declaration = split_line[0]
-
-                                if var_declaration.find(':') > -1:
-                                    var_name, var_array = var_first.split(":", maxsplit=1)
-                                    leftb  = var_array.find('[')
-                                    rightb = var_array.find(']') 
-                                    idx_rng = var_array[leftb+1:rightb]
-                                    lefti, righti = idx_rng.split('..')
-                                    left_idx  = int(lefti)
-                                    right_idx = int(righti)
-
-                                    if left_idx != 0:
-                                        print(f"arrays start at index 0: {line.strip()}")
-                                        exit(1)
-
-                                    type_idx  = var_array.find(' OF ')
-                                    var_type  = var_array[type_idx+4:].strip()
-                                    var_type = var_type.replace(';','')
-
-                                    var_type = var_type.strip()
-
-                                    var_name = var_name.strip()
-
-                                    mem_code = None
-     
-                                    if var_type not in var_types:
-                                        print(f"Variable {var_name} with unrecognized type {var_type}")
-                                        var_value = None
-
-                                    variables[var_name] = Variable(var_name, var_type, \
-                                        mem_code, None, var_array=True, array_len=right_idx+1) 
-
-                                    var_name = var_name.replace(',','=')
-                                    global_vars.append(var_name)
-                                    new_line = f"{var_name} = []"
-                                    global_lines.append(new_line)
-                        else:
-                            new_line = split_line[0]
-                            global_lines.append(new_line.replace(';',''))
-
-                #trans_lines.append('!@!END_BLK\n')
-                #trans_blk = '\n'.join(trans_lines)+'\n!@!START_BLK\n!@!START_MAIN\n!@!START_BLK\n'
-                trans_blk = '\n'+'\n!@!START_BLK\n!@!START_MAIN\n!@!START_BLK\n'
-
-                st_code = st_code[:start]+trans_blk+st_code[end+1:]
-
-        end_var = st_code.find('!@!START_BLK\n!@!START_MAIN')
-        var_blks = st_code[:end_var]+'!@!START_BLK\n!@!START_MAIN\n'
+        self.program = program['name']
+        job.global_lines.extend(program['global_lines'])
+        job.global_vars.extend(program['global_vars'])
+        job.global_stmnt = program['global_stmnt']
+        self.emitter.lines.extend(program['body'])
+        self.place_variables([recorded_variable(var) for var in program['variables']])
+
+    # the body of the scan loop, once every unit is translated
+    def finish(self):
+        if self.program is None:
+            raise stparse.STSyntaxError("no PROGRAM found", 1)
+
+        # the Modbus calls with constant arguments, for mb_batch to turn into bulk transfers
+        if len(self.emitter.mb_sites) > 0:
+            self.job.global_lines.append(f"mb_sites = mb_batch.plan({self.emitter.mb_sites!r})")
+
+        return '\n'.join(self.emitter.lines)
+
+    def convert_program(self, program):
+        job = self.job
+        emitter = self.emitter
+        variables = []
+        for var_blk in program.var_blocks:
+            for decl in var_blk.decls:
+                if isinstance(decl, stparse.Comment):
+                    for text in decl.text.split('\n'):
+                        job.global_lines.append(f"# {text.strip()}".rstrip())
+                    continue
+                variables.extend(self.declare(decl, emitter))
+
+        self.variables = variables
+        self.place_variables(variables)
 
         global_decl = []
+        global_vars = job.global_vars
         for idx in range(0, len(global_vars), 5):
             stmnt = 'global '
             stmnt += ','.join(global_vars[idx:min(idx+5,len(global_vars))])
             global_decl.append(stmnt)
 
-        global_stmnt = '\n'.join(global_decl)
+        job.global_stmnt = '\n'.join(global_decl)
 
-        main_prg = remainder
+        emitter.stmts(program.body)
 
-        # convert the rest of it
-        main_prg = self.convert_segment(variables, main_prg)
-        main_prg = var_blks+main_prg
- 
-        return main_prg
+        # arrays of function blocks some FOR loop calls as a batch are kept packed
+        for py_name, var_type, size in emitter.batched:
+            job.global_lines[self.decl_lines[py_name]] = f"{py_name} = fb_array({var_type}, {size})"
 
-    def convert_segment(self, var_dict, code):
-        # find outside construct, if any
-        first_if = code.find('IF')
-        first_case = code.find('CASE')
+    # put the program variables in the job's var_seqs.  Variables without an explicit
+    # memory address are placed after those with one, so that they do not claim locations
+    # the program assigns later on, unless the job's previous location map gives them the
+    # location they had there
+    def place_variables(self, variables):
+        prev_locs = self.job.prev_locs
+        fixed = []
+        placed = []
+        for var in variables:
+            if var.mem_code is None:
+                continue
+            mem_code = var.mem_code
+            if len(mem_code) <= 2 and prev_locs is not None:
+                mem_code = previous_location(var, prev_locs) or mem_code
+            if len(mem_code) > 2:
+                fixed.append((var, mem_code))
+            else:
+                placed.append((var, mem_code))
 
-        first_for = code.find('FOR')
-        first_while = code.find('WHILE')
-        first_repeat = code.find('REPEAT')
+        for var, mem_code in fixed+placed:
+            var.place(self.job.seqs, mem_code)
 
-        code_type = None
-        first_idx = -1
+    # translate the declaration of one or more variables sharing a type
+    def declare(self, decl, emitter):
+        var_type, sizes, init_text, value = self.declared_value(decl, emitter)
 
-        if first_if > -1:
-            code_type = 'IF'
-            first_idx = first_if
+        variables = []
+        for name in decl.names:
+            py_name = python_name(name)
+            var = Variable(py_name, var_type, decl.mem_code, value, \
+                var_array=len(sizes) == 1, array_len=sizes[0] if len(sizes) == 1 else 0)
 
-        if first_case > -1 and (code_type is None or first_case < first_idx):
-            code_type = 'CASE'
-            first_idx = first_case
+            # only scalars and one dimensional arrays of elementary types have a memory location
+            if len(sizes) > 1 or var_type not in var_types:
+                var.mem_code = None
 
-        if first_for > -1 and (code_type is None or first_for < first_idx):
-            code_type = 'FOR'
-            first_idx = first_for
+            self.symbols[name.upper()] = var
+            self.job.global_vars.append(py_name)
+            self.decl_lines[py_name] = len(self.job.global_lines)
+            self.job.global_lines.append(f"{py_name} = {init_text}")
+            variables.append(var)
 
-        if first_while > -1 and (code_type is None or first_while < first_idx):
-            code_type = 'WHILE'
-            first_idx = first_while
+        return variables
 
-        if first_repeat > -1 and (code_type is None or first_repeat < first_idx):
-            code_type = 'REPEAT'
-            first_idx = first_repeat
+    # the type, array sizes, and python text and value for the initial value of the
+    # variables of a declaration
+    def declared_value(self, decl, emitter):
+        var_type = decl.type_name.upper()
+        py_type = python_type.get(var_type, 'class')
 
-        # convert the lines prior to the first control structure
-        if code_type is not None:
-            trans_code = self.convert_statements(var_dict, code[:first_idx])
-        else:
-            # convert the whole thing
-            trans_code = self.convert_statements(var_dict, code)
-            return trans_code
-    
-        match code_type:
-            # the first control structure is an IF
-            case 'IF':
-                outside_if     = first_idx
-                outside_then   = code.find(' THEN')
-
-                # find all END_IFs between outside_if and the end of the code
-                endifs = find_instances('END_IF;', code, outside_if+1)
-
-                outside_endif = None
-                # find first one for which the number of intervening IF/END_IF's are equal
-                for endif_instance in endifs: 
-                    ifs    = find_instances('IF ', code, outside_if+1, endif_instance)
-                    inner_endifs = find_instances('END_IF;', code, outside_if+1, endif_instance)
-
-                    if len(ifs) == len(inner_endifs):
-                        outside_endif = endif_instance
-                        break
+        for low, high in decl.dims:
+            if low != 0:
+                print(f"arrays start at index 0: line {decl.line}")
+                exit(1)
 
-                if outside_endif is None:
-                    print("ouch 1")
-                    pdb.set_trace()
-                    print("ouch 1")
-
-                if_cond        = get_condition(code[outside_if+2:outside_then])
-                trans_code     += 'if '+if_cond+' :\n!@!START_BLK'
-            
-                # see if there is an ELSE between outside_then and outside_endif
-                outside_else = None
-                #first_else = code[outside_then+4:outside_endif].find('ELSE')
-                first_else = code.find('ELSE', outside_then+4, outside_endif)
-
-                if first_else > -1:
-                    # count the 'IF ' and 'END_IF;' between what follows THEN
-                    # and the outside_if
-                    ifs = find_instances('IF ', code, outside_then+4, outside_endif)
-                    endifs = find_instances('END_IF;', code, outside_then+4, outside_endif)
-
-                    # the ifs and endifs are non-zero and match we want to transform the body
-                    if len(ifs) > 0 and len(ifs) == len(endifs):
-                        trans_code += self.convert_segment(var_dict, code[outside_then+4:outside_endif])+'\n!@!END_BLK\n'
-                    else:
-                        # nothing in between so transfrom from after THEN to ELSE
-                        # convert the segment between outside_then+4 and outside_else
-                        trans_code += self.convert_segment(var_dict, code[outside_then+4:first_else])+'\n!@!END_BLK\n'
-                        trans_code += 'else:\n!@!START_BLK'
+        sizes = [high+1 for low, high in decl.dims]
+        count = math.prod(sizes)
 
-                        # convert the segment between outside_else+4 and outside_endif
-                        trans_code += self.convert_segment(var_dict, code[first_else+4:outside_endif])+'\n!@!END_BLK\n'
+        value = None
+        if var_type in fb_types or var_type in self.pous and self.pous[var_type].kind == 'FUNCTION_BLOCK':
+            # function blocks are instances of the python class of the same name
+            init_text = f"{self.pous[var_type].name if var_type in self.pous else var_type}()"
+            for size in reversed(sizes):
+                init_text = f"[{init_text} for _ in range({size})]"
 
-                else:
-                    # no elses
-                    trans_code += self.convert_segment(var_dict, code[outside_then+4:outside_endif])+'\n!@!END_BLK\n'
-    
-                # convert the rest of the code
-                trans_code += self.convert_segment(var_dict, code[outside_endif+6:])
-                return trans_code
-
-            case 'CASE':
-                outside_case   = first_idx
-                case_end       = code.rfind('END_CASE;')
-
-                of_key         = code.find(' OF')
-                case_check     = code[first_idx+4:of_key]
-                trans_match    = case_check.strip()
-
-                case_block     = code[of_key+2:case_end]
-
-                trans_code     += f"match {case_check}:\n!@!START_BLK\n"
-
-                # strip the lines of the case_block of any comments
-                case_block = strip_comments(case_block)
-
-                # find the case markers
-                cmp = r"[a-zA-Z0-9_]+:[^=]"
-                cases = re.finditer(cmp, case_block, re.IGNORECASE | re.DOTALL)
-                   
-                markers = [] 
-                for choice in cases:
-                    (bm, end) = choice.span()
-                    for idx in range(bm+1,end):
-                        if case_block[idx] == ':':
-                            markers.append((bm,idx)) 
-
-                # create the case descriptions
-                case_rep = [] 
-                for idx in range (0, len(markers)):
-                    (start_cond, end_cond) = markers[idx]
-                    cond = case_block[start_cond:end_cond]
- 
-                    if idx < len(markers)-1:
-                        block = case_block[end_cond+1:markers[idx+1][0]]
-                    else:
-                        block = case_block[end_cond+1:]
-
-                    block += '!@!END_BLK\n'
-                    case_rep.append((cond, block)) 
-
-                for (cond, block) in case_rep: 
-                    trans_code += f"case {cond}:\n!@!START_BLK"
-                    trans_code += self.convert_segment(var_dict, block)
-
-                trans_code = trans_code+'\n!@!END_BLK\n'+self.convert_segment(var_dict, code[case_end+8:])
-                return trans_code
-
-            case 'FOR':
-                #for_loop_pattern = r"FOR\s+(.*?)\s*:=\s*(.*?)\s+TO\s+(.*?)\s+DO\s+(.*?)\s+END_FOR"
-                for_loop_pattern = r"FOR\s+(.*?)\s*:=\s*(.*?)\s+TO\s+(.*?)\s+DO"
-                for_loop = re.search(for_loop_pattern, code)
-                loop_var = for_loop.group(1)
-                loop_lower = for_loop.group(2)
-                loop_upper = for_loop.group(3)
-                loop_inc = None 
-                
-                # if loop_upper has BY in it we need to peel off the
-                # limit and and put in the increment
-                by_idx = loop_upper.find(' BY')
-                if by_idx > -1:
-                    limit = loop_upper[:by_idx].strip()
-                    loop_inc = loop_upper[by_idx+3:].strip()
-                    neg_inc = loop_inc.find('-') > -1
-                    loop_inc = loop_inc.replace('-','') 
-                    loop_upper = limit
- 
-                outside_for = code.find('FOR ') 
-                outside_do  = code.find(' DO', outside_for+4)
-                
-                # find all the END_FOR;  from outside_for to the end of the code 
-                endfors = find_instances('END_FOR;', code, outside_for+4)
-
-                # find the first where the number of FOR and END_FOR between it and the 
-                # outside FOR balance each other
-                 
-                outside_endfor = None
-                # find first one for which the number of intervening FOR/END_FORs are equal
-                for endfor_instance in endfors: 
-                    fors    = find_instances('FOR ',     code, outside_for+4, endfor_instance)
-                    endfors = find_instances('END_FOR;', code, outside_for+4, endfor_instance)
-                    if len(fors) == len(endfors):
-                        outside_endfor = endfor_instance
-                        break
+        elif var_type in var_types:
+            init_text, value = self.initial_value(decl, py_type, sizes, count, emitter)
 
-                # the body of the for loop is between outside_do + 3 and outside_endfor
-                for_body = code[outside_do+3:outside_endfor]
-           
-                if loop_inc is None:
-                    trans_code += f"for {loop_var} in range({loop_lower}, ({loop_upper})+1):\n!@!START_BLK"
-                else:
-                    trans_code += f"for {loop_var} in reversed(range({loop_upper}, ({loop_lower})+1,{loop_inc})):\n!@!START_BLK"
-
-                trans_code += self.convert_segment(var_dict, for_body)+'\n!@!END_BLK\n' 
-                trans_code += self.convert_segment(var_dict, code[outside_endfor+7:])
-                return trans_code
-
-            case 'WHILE':
-                while_loop_pattern = r"WHILE\s+(.*?)\s+DO"
-                while_loop = re.search(while_loop_pattern, code)
-                loop_var = while_loop.group(1)
-
-                outside_while = code.find('WHILE ') 
-                outside_do    = code.find(' DO',outside_while+6)
-                 
-                # find all the END_WHILE;  from outside_do to the end of the code 
-                endwhiles = find_instances('END_WHILE;', code, outside_while+6)
-
-                # find the first where the number of WHILE and END_WHILE between it and the 
-                # outside WHILE balance each other
-                 
-                outside_endwhile = None
-                # find first one while which the number of intervening FOR/END_FORs are equal
-                for endwhile_instance in endwhiles: 
-                    whiles    = find_instances('WHILE ', code, outside_while+6, endwhile_instance)
-                    endwhiles = find_instances('END_WHILE ', code, outside_while+6, endwhile_instance)
-
-                    if len(whiles) == len(endwhiles):
-                        outside_endwhile = endwhile_instance
-                        break
-
-                # the body of the while loop is between outside_do + 3 and outside_endwhile
-                while_body = code[outside_do+3:outside_endwhile]
+        else:
+            print(f"Variable {','.join(decl.names)} with unrecognized type {decl.type_name}")
+            init_text = 'None'
 
-                trans_code += f"while {loop_var}:\n!@!START_BLK"
-                trans_code += self.convert_segment(var_dict, while_body)+'\n!@!END_BLK\n' 
-                trans_code += self.convert_segment(var_dict, code[outside_endwhile+9:])
-                return trans_code
+        return var_type, sizes, init_text, value
 
-            case 'REPEAT':
-                repeat_loop_pattern = r"REPEAT\s+(.*?)UNTIL\s+"
-                outside_repeat = code.find("REPEAT")
+    # the python names of the fields of a FUNCTION_BLOCK, or the inputs of a FUNCTION,
+    # by upper-cased ST name
+    def pou_fields(self, pou):
+        fields = {}
+        for var_blk in pou.var_blocks:
+            if pou.kind == 'FUNCTION' and var_blk.kind != 'VAR_INPUT':
+                continue
+            for decl in var_blk.decls:
+                if isinstance(decl, stparse.VarDecl):
+                    for name in decl.names:
+                        fields[name.upper()] = python_name(name)
+        return fields
+
+    # translate a FUNCTION_BLOCK into a class with a slot for each of its VAR_INPUT,
+    # VAR_OUTPUT and VAR variables and a call method that takes the inputs and runs
+    # the body, or a FUNCTION into a function of its inputs.  VAR_TEMP variables, and
+    # the VAR variables of a FUNCTION, are locals that start over with every call
+    def convert_pou(self, pou, program_emitter):
+        fb = pou.kind == 'FUNCTION_BLOCK'
+        info = self.pous[pou.name.upper()]
+        symbols = {}
+        body_indent = 2 if fb else 1
+
+        # the Modbus call sites of all the bodies are numbered together
+        emitter = PyEmitter(symbols, indent=body_indent, pous=self.pous)
+        emitter.mb_sites = program_emitter.mb_sites
+
+        inputs = []
+        fields = []
+        local_lines = []
+        for var_blk in pou.var_blocks:
+            if var_blk.kind not in ('VAR_INPUT', 'VAR_OUTPUT', 'VAR', 'VAR_TEMP') \
+                    or not fb and var_blk.kind == 'VAR_OUTPUT':
+                raise stparse.STSyntaxError(f"{var_blk.kind} is not supported in {pou.kind} {pou.name}", pou.line)
+
+            for decl in var_blk.decls:
+                if isinstance(decl, stparse.Comment):
+                    continue
+                var_type, sizes, init_text, value = self.declared_value(decl, emitter)
+                for name in decl.names:
+                    py_name = python_name(name)
+                    field = fb and var_blk.kind != 'VAR_TEMP'
+                    var = Variable(f"self.{py_name}" if field else py_name, var_type, None, value, \
+                        var_array=len(sizes) == 1, array_len=sizes[0] if len(sizes) == 1 else 0)
+                    symbols[name.upper()] = var
+                    if var_blk.kind == 'VAR_INPUT':
+                        inputs.append((py_name, init_text, input_copy(py_name, var_type, sizes)))
+                    if field:
+                        fields.append((py_name, init_text))
+                    elif var_blk.kind != 'VAR_INPUT':
+                        local_lines.append((py_name, init_text))
+
+        if not fb:
+            # the value returned is the variable named for the function
+            py_type = python_type.get(pou.return_type.upper(), 'class')
+            symbols[pou.name.upper()] = Variable(info.name, pou.return_type, None, None)
+            local_lines.insert(0, (info.name, py_literal(default_value(py_type))))
+            emitter.result = info.name
+
+        emitter.stmts(pou.body)
+        body = emitter.lines
+
+        # arrays of function blocks the body calls as a batch are kept packed
+        batched = {py_name: f"fb_array({var_type}, {size})" for py_name, var_type, size in emitter.batched}
+
+        emitter.lines = []
+        for py_name, init_text in local_lines:
+            emitter.line(f"{py_name} = {batched.get(py_name, init_text)}")
+        for py_name, init_text, copy_text in inputs:
+            if fb:
+                emitter.line(f"if {py_name} is not None:")
+                emitter.line(f"    self.{py_name} = {copy_text}")
+            elif copy_text != py_name:
+                # an array input left out of the call is not shared between calls, and
+                # one passed in is a copy, so the body does not change the caller's array
+                emitter.line(f"if {py_name} is None:")
+                emitter.line(f"    {py_name} = {init_text}")
+                emitter.line('else:')
+                emitter.line(f"    {py_name} = {copy_text}")
+        emitter.lines.extend(body)
+        if not fb:
+            emitter.line(f"return {info.name}")
+        elif all(line.lstrip().startswith('#') for line in emitter.lines):
+            emitter.line('pass')
+
+        pou_lines = self.job.pou_lines
+        pou_lines.append('')
+        pou_lines.append(f"# {pou.kind} {pou.name}")
+        if fb:
+            pou_lines.append(f"class {info.name}():")
+            pou_lines.append(f"    __slots__ = {tuple(py_name for py_name, init_text in fields)!r}")
+            pou_lines.append('')
+            if len(fields) > 0:
+                pou_lines.append('    def __init__(self):')
+                for py_name, init_text in fields:
+                    pou_lines.append(f"        self.{py_name} = {batched.get('self.'+py_name, init_text)}")
+                pou_lines.append('')
+            params = ''.join(f", {py_name}=None" for py_name, init_text, copy_text in inputs)
+            pou_lines.append(f"    def call(self{params}):")
+        else:
+            params = ', '.join(f"{py_name}={'None' if copy_text != py_name else init_text}" \
+                for py_name, init_text, copy_text in inputs)
+            pou_lines.append(f"def {info.name}({params}):")
+        pou_lines.extend(emitter.lines)
+
+    # python text and value for the initial value of an elementary variable
+    def initial_value(self, decl, py_type, sizes, count, emitter):
+        init = decl.init
+        if len(sizes) == 0:
+            if init is None:
+                value = default_value(py_type)
+                return py_literal(value), value
+
+            if isinstance(init, stparse.ArrayInit):
+                raise stparse.STSyntaxError(f"array initializer for scalar {decl.names[0]}", decl.line)
+
+            ok, value = literal_value(init)
+            if not ok:
+                # initialized from an expression, which python evaluates
+                return emitter.expr(init), default_value(py_type)
+
+            value = typed_constant(value, py_type)
+            return py_literal(value), value
+
+        values = []
+        if init is not None:
+            items = init.items if isinstance(init, stparse.ArrayInit) else [init]
+            for item in items[:count]:
+                ok, item_value = literal_value(item)
+                if not ok:
+                    raise stparse.STSyntaxError(f"initial values of array {decl.names[0]} must be constants", decl.line)
+                values.append(typed_constant(item_value, py_type))
+
+        values.extend([default_value(py_type)]*(count-len(values)))
+        return py_literal(nest_values(values, sizes)), values
+
+
+# python operator text and binding strength for each ST binary operator.  The strengths
+# follow the python grammar, so the emitter can tell where the ST grouping needs parentheses
+py_binops = {
+    'OR': ('or', 1),
+    'AND': ('and', 2),
+    '=': ('==', 4), '<>': ('!=', 4), '<': ('<', 4), '>': ('>', 4), '<=': ('<=', 4), '>=': ('>=', 4),
+    'XOR': ('^', 6),
+    '+': ('+', 9), '-': ('-', 9),
+    '*': ('*', 10), '/': ('/', 10), 'MOD': ('%', 10),
+    '**': ('**', 12)}
+
+not_prec   = 3
+cmp_prec   = 4
+add_prec   = 9
+neg_prec   = 11
+atom_prec  = 13
+
+# PyEmitter walks the statements of the parsed ST program and writes the equivalent
+# python, one line at a time, at the current indentation
+class PyEmitter:
+    def __init__(self, symbols, indent=0, pous=None):
+        self.symbols = symbols
+        self.lines = []
+        self.indent = indent
+
+        # the user-defined function blocks and functions, as ConvertorApp keeps them
+        self.pous = pous if pous is not None else {}
+
+        # the variable a FUNCTION body returns, None in other bodies
+        self.result = None
+
+        # (kind, TABLE, IDX, LEN, START) of each IMPORT_FROM_MB and EXPORT_TO_MB call
+        # whose arguments are all constant, numbered in the order they appear
+        self.mb_sites = []
+
+        # the arrays of function blocks called as a batch, as (name, type, size)
+        self.batched = set()
+
+    def line(self, text):
+        self.lines.append('    '*self.indent + text)
+
+    def stmts(self, stmts):
+        for stmt in stmts:
+            self.stmt(stmt)
+
+    # an indented block, which python will not accept empty
+    def block(self, stmts):
+        self.indent += 1
+        first = len(self.lines)
+        self.stmts(stmts)
+        if all(line.lstrip().startswith('#') for line in self.lines[first:]):
+            self.line('pass')
+        self.indent -= 1
+
+    def stmt(self, node):
+        match node:
+            case stparse.Comment():
+                for text in node.text.split('\n'):
+                    self.line(f"# {text.strip()}".rstrip())
+
+            case stparse.Assign():
+                self.line(f"{self.expr(node.target)} = {self.expr(node.value)}")
+
+            case stparse.CallStmt():
+                self.call_stmt(node)
+
+            case stparse.If():
+                keyword = 'if'
+                for cond, body in node.branches:
+                    self.line(f"{keyword} {self.expr(cond)}:")
+                    self.block(body)
+                    keyword = 'elif'
+                if node.else_body is not None:
+                    self.line('else:')
+                    self.block(node.else_body)
+
+            case stparse.Case():
+                self.case_stmt(node)
+
+            case stparse.For():
+                self.for_stmt(node)
+
+            case stparse.While():
+                self.line(f"while {self.expr(node.cond)}:")
+                self.block(node.body)
+
+            case stparse.Repeat():
+                self.line('while True:')
+                self.indent += 1
+                self.stmts(node.body)
+                self.line(f"if {self.expr(node.cond)}:")
+                self.block([stparse.Exit()])
+                self.indent -= 1
+
+            case stparse.Exit():
+                self.line('break')
+
+            case stparse.Continue():
+                self.line('continue')
+
+            case stparse.Return():
+                self.line('return' if self.result is None else f"return {self.result}")
+
+    # a call to a function block instance runs its 'call' method, and each 'name => variable'
+    # argument becomes an assignment from the instance field after the call
+    def call_stmt(self, node):
+        callee = node.callee
+        if isinstance(callee, stparse.Name) and callee.name.upper() not in self.symbols:
+            # not a declared variable, so a function called for its side effects
+            self.line(f"{self.func_name(callee.name)}({self.call_args(node.args, self.param_of(callee.name))})")
+            return
 
-                # find all the UNTILs;  from outside_repeat to the end of the code 
-                untils = find_instances('UNTIL', code, outside_repeat+6)
+        inst = self.expr(callee)
+        inputs = [arg for arg in node.args if not arg.output]
 
-                # find the first where the number of REPEAT and END_REPEAT between it and the 
-                # outside REPEAT balance each other
-                 
-                outside_until = None
-                # find first repeat which the number of intervening REPEAT/END_REPEAT are equal
-                for until_instance in untils: 
-                    repeats    = find_instances('REPEAT ', code, outside_repeat+6, until_instance)
-                    endrepeats = find_instances('END_REPEAT;', code, outside_repeat+6, until_instance)
+        site = self.mb_site(callee, inputs)
+        if site is None:
+            self.line(f"{inst}.call({self.call_args(inputs, lambda name: self.field_name(callee, name))})")
+        elif site[0] == 'IMPORT':
+            # the site was bound to its table range once, so the call is just a copy
+            self.line(f"{inst}.VALUE = mb_sites[{len(self.mb_sites)}].run()")
+            self.mb_sites.append(site)
+        else:
+            value = [arg.value for arg in inputs if arg.name.upper() == 'VALUE']
+            value_text = self.expr(value[0]) if value else 'None'
+            self.line(f"mb_sites[{len(self.mb_sites)}].run({value_text})")
+            self.mb_sites.append(site)
+
+        for arg in node.args:
+            if arg.output:
+                self.line(f"{self.expr(arg.value)} = {inst}.{self.field_name(callee, arg.name)}")
+
+    # the (kind, TABLE, IDX, LEN, START) of a call to an IMPORT_FROM_MB or EXPORT_TO_MB
+    # instance whose arguments, other than the VALUE exported, are all constant.
+    # None for any other call.  Arguments left out take the defaults of the call methods
+    def mb_site(self, callee, inputs):
+        kind = {'IMPORT_FROM_MB': 'IMPORT', 'EXPORT_TO_MB': 'EXPORT'}.get(self.fb_type(callee))
+        if kind is None:
+            return None
+
+        consts = {'TABLE': 'COIL', 'IDX': 4, 'LEN': 1, 'START': 0}
+        for arg in inputs:
+            if arg.name is None:
+                return None
+            name = arg.name.upper()
+            if name == 'VALUE' and kind == 'EXPORT':
+                continue
+            if name not in consts or (name == 'START' and kind == 'IMPORT'):
+                return None
 
-                    if len(repeats) == len(endrepeats):
-                        outside_until = until_instance
-                        break
+            ok, value = literal_value(arg.value)
+            if not ok or type(value) is not type(consts[name]):
+                return None
+            consts[name] = value
 
-                # the body of the repeat loop is between outside_repeat + 6 and outside_until
-                outside_endrepeat = code.find('END_REPEAT;',outside_until+5)
-                condition = code[outside_until+5:outside_endrepeat].strip()
+        if consts['IDX'] < 0 or consts['LEN'] < 1 or consts['START'] < 0:
+            return None
+        return (kind, consts['TABLE'], consts['IDX'], consts['LEN'], consts['START'])
 
-                repeat_body = code[outside_repeat+6:outside_until]
+    def case_stmt(self, node):
+        if len(node.branches) == 0 and node.else_body is None:
+            return
 
-                trans_code += f"while True:\n!@!START_BLK\n"
-                trans_code += self.convert_segment(var_dict, repeat_body)+'\n' 
-                trans_code += f"if {condition}:\n!@!START_BLK\nbreak\n!@!END_BLK\n!@!END_BLK"
-                trans_code += self.convert_segment(var_dict, code[outside_endrepeat+11:])
-                return trans_code
+        self.line(f"match {self.expr(node.selector)}:")
+        self.indent += 1
+        for labels, body in node.branches:
+            self.line(f"case {self.case_pattern(labels, node.selector)}:")
+            self.block(body)
+
+        if node.else_body is not None:
+            self.line('case _:')
+            self.block(node.else_body)
+        self.indent -= 1
+
+    # literal labels become a python match pattern, anything else a guard on the selector
+    def case_pattern(self, labels, selector):
+        literals = []
+        for label in labels:
+            ok, value = literal_value(label)
+            if not ok or isinstance(value, (bool, float)):
+                break
+            literals.append(py_literal(value))
+        else:
+            return ' | '.join(literals)
+
+        sel = self.operand(selector, cmp_prec+1)
+        conds = []
+        for label in labels:
+            if isinstance(label, stparse.Range):
+                low = self.operand(label.low, cmp_prec+1)
+                high = self.operand(label.high, cmp_prec+1)
+                conds.append(f"{low} <= {sel} <= {high}")
+            else:
+                conds.append(f"{sel} == {self.operand(label, cmp_prec+1)}")
 
-    
-    def convert_statements(self, var_dict, code):
-        lines = code.split('\n')
+        return '_ if '+' or '.join(conds)
 
-        rtn = []
- 
-        statements = code.split(';')
-        for statement in statements:
-            # if an assignment, change the assignment operator
-            if statement.find(':=') > -1:
-                statement = statement.replace(':=', '=')
-                statement = statement.replace('<>', '!=')
-
-            # if a call to a function block, alter
-            words = statement.split()
-
-            # look for instances where a FB variable looks like it is being called
-            for word in words: 
-                for var_name, var_inst in var_dict.items():
-                    tst_var_name = var_name+'('
-                    #if word.find(tst_var_name) > -1 and var_inst.vclass is not None:
-                    if word.find(tst_var_name) > -1: 
-                        statement = statement.replace(var_name, var_name+'.call')
-                        break 
-
-            rtn.append(statement)
-        
-            
-        return ' '.join(rtn)
-
-    def convert_fb(self, var_dict, st_code):
-        lines = st_code.split('\n')
-        rtn = []
-        for line in lines:
-            trimmed = line
-            if line.find('//') > -1:
-                trimmed = line[: line.find('//')]
-
-            words = trimmed.split()
-            # look for instances where a FB variable looks like it is being called
-            for word in words: 
-                for var_name, var_inst in var_dict.items():
-                    tst_var_name = var_name+'('
-                    if word.find(tst_var_name) > -1:
-                        line = line.replace(var_name, var_name+'.call')
-                        break 
-
-            rtn.append(line)
-            
-        return '\n'.join(rtn)     
-
-    def clean_up_python_code(self, python_code):
-
-        # Replace ST keywords with Python keywords...
-        python_code = re.sub(r"\bRETURN\b", "return", python_code, flags=re.IGNORECASE)
-        python_code = re.sub(r"\bEXIT\b", "break", python_code, flags=re.IGNORECASE)
-        python_code = re.sub(r"\bfalse\b", "False", python_code, flags=re.IGNORECASE)
-        python_code = re.sub(r"\btrue\b", "True", python_code, flags=re.IGNORECASE)
-        python_code = re.sub(r"\b AND \b", " and ", python_code)
-        python_code = re.sub(r"\b OR \b", " or ", python_code)
-        python_code = re.sub(r"\b NOT \b", " not ", python_code)
-
-        python_code = python_code.replace(":=", "=")
-        python_code = python_code.replace("<>", "!=")
-        python_code = python_code.replace(";", "")
-        python_code = python_code.replace("?", ":")
-        python_code = python_code.strip()
-
-        # Add newline at the end if not present
-        if not python_code.endswith("\n"):
-            python_code += "\n"
-
-        # convert in-line comments
-        python_code = python_code.replace('//','#')
-
-        org_lines = python_code.split('\n')
-        rtn = []
-        empty_cnt = 0
-        for line in org_lines:
-            stripped = re.sub(r'\s+', '', line)
-            if len(stripped) > 0:
-                rtn.append(line)
-                continue
-            if empty_cnt < 2:
-                rtn.append('')
-            empty_cnt += 1
+    # ST FOR loops include their upper bound
+    def for_stmt(self, node):
+        if self.batch_for(node):
+            return
 
-        return '\n'.join(rtn)
+        var = self.expr(stparse.Name(node.var))
+        start = self.expr(node.start)
 
-def fb_calls(code):
-    # see whether there is a '.call(' in the line
-    org_lines = code.split('\n')
-    rtn = []
-    empty_cnt = 0
-
-    for line in org_lines:
-        if line.find('.call(') > -1:
-            # isolate arguments
-            call_idx = line.find('.call(')
-            fb_var_piece = line[:call_idx]
-            words = fb_var_piece.split(' ')
-            fb_var = words[-1]
-            end_idx = line.find(')', call_idx+6)
-            args = line[call_idx+6:end_idx]
-            argList = args.split(',')
-            extra_lines = []
-            num_args = len(argList)
-            for idx in reversed(range(0, num_args)):
-                arg = argList[idx]
-                arg_pieces = arg.split('=>')
-                if len(arg_pieces) == 1:
-                    continue
+        if node.step is None:
+            self.line(f"for {var} in range({start}, {self.bound(node.stop, 1)}):")
+        else:
+            ok, step = literal_value(node.step)
+            step_text = self.expr(node.step)
+            if ok and step > 0:
+                self.line(f"for {var} in range({start}, {self.bound(node.stop, 1)}, {step_text}):")
+            elif ok and step < 0:
+                self.line(f"for {var} in range({start}, {self.bound(node.stop, -1)}, {step_text}):")
+            else:
+                stop = self.operand(node.stop, add_prec)
+                self.line(f"for {var} in range({start}, {stop} + (1 if {step_text} > 0 else -1), {step_text}):")
+
+        self.block(node.body)
+
+    # a FOR loop over constant bounds whose body just calls instance i of an fb_array,
+    # each input element i of an array or the same for every instance and each output
+    # going to element i of an array, is written as one call_range of the instances
+    # and a slice assignment per output.  Returns whether the loop was written that way
+    def batch_for(self, node):
+        ok_lo, lo = literal_value(node.start)
+        ok_hi, hi = literal_value(node.stop)
+        ok_step, step = literal_value(node.step) if node.step is not None else (True, 1)
+        if not (ok_lo and ok_hi and ok_step) or type(lo) is not int or type(hi) is not int \
+                or step != 1 or lo < 0 or hi-lo+1 < batch_min:
+            return False
+
+        body = [stmt for stmt in node.body if not isinstance(stmt, stparse.Comment)]
+        if len(body) != 1 or not isinstance(body[0], stparse.CallStmt):
+            return False
+
+        loop_var = node.var.upper()
+        fb_var = self.element_of(body[0].callee, loop_var, hi)
+        if fb_var is None or fb_var.var_type not in batch_fb_types:
+            return False
+
+        inputs = []
+        outputs = []
+        for arg in body[0].args:
+            if arg.name is None:
+                return False
+            src = self.element_of(arg.value, loop_var, hi)
+            if arg.output:
+                if src is None or src.var_type not in var_types:
+                    return False
+                outputs.append((arg.name.upper(), src.name))
+            elif src is not None and src.var_type in var_types:
+                inputs.append(f"{arg.name.upper()}={src.name}[{lo}:{hi+1}]")
+            elif not mentions(arg.value, loop_var):
+                inputs.append(f"{arg.name.upper()}={self.expr(arg.value)}")
+            else:
+                return False
 
-                fb_field = arg_pieces[0].strip()
-                var_name = arg_pieces[1].strip()
+        for stmt in node.body:
+            if isinstance(stmt, stparse.Comment):
+                self.stmt(stmt)
+        self.batched.add((fb_var.name, fb_var.var_type, fb_var.array_len))
+        self.line(f"{fb_var.name}.call_range({', '.join([str(lo), str(hi+1)]+inputs)})")
+        for field, dst in outputs:
+            self.line(f"{dst}[{lo}:{hi+1}] = {fb_var.name}.values('{field}', {lo}, {hi+1})")
+
+        # the loop variable is left as the loop would have left it
+        self.line(f"{self.var_name(node.var)} = {hi}")
+        return True
+
+    # the one dimensional array variable that node indexes with loop_var alone, if
+    # it has an element hi, else None
+    def element_of(self, node, loop_var, hi):
+        if not isinstance(node, stparse.Index) or not isinstance(node.base, stparse.Name) \
+                or len(node.indices) != 1:
+            return None
+        idx = node.indices[0]
+        if not isinstance(idx, stparse.Name) or idx.name.upper() != loop_var:
+            return None
+
+        var = self.symbols.get(node.base.name.upper())
+        if var is None or not var.var_array or var.array_len <= hi:
+            return None
+        return var
+
+    def bound(self, stop, delta):
+        ok, value = literal_value(stop)
+        if ok and isinstance(value, int):
+            return str(value+delta)
+        if delta > 0:
+            return f"{self.operand(stop, add_prec)} + {delta}"
+        return f"{self.operand(stop, add_prec)} - {-delta}"
+
+    # the arguments of a call, field giving the python name of the input an argument
+    # names, if not the name as written
+    def call_args(self, args, field=None):
+        rtn = []
+        for arg in args:
+            if arg.name is None:
+                rtn.append(self.expr(arg.value))
+            else:
+                name = field(arg.name) if field is not None else arg.name
+                rtn.append(f"{name}={self.expr(arg.value)}")
+        return ', '.join(rtn)
+
+    # the declared type of a (possibly indexed) function block instance, None if not one
+    def fb_type(self, node):
+        while isinstance(node, stparse.Index):
+            node = node.base
+        if isinstance(node, stparse.Name):
+            var = self.symbols.get(node.name.upper())
+            if var is not None and (var.var_type in fb_types or var.var_type in self.pous):
+                return var.var_type
+        return None
+
+    # python name of a field of the function block instance node: upper case for the
+    # standard blocks, as declared for a user-defined one
+    def field_name(self, node, field):
+        var_type = self.fb_type(node)
+        if var_type in fb_types:
+            return field.upper()
+        if var_type in self.pous:
+            return self.pous[var_type].fields.get(field.upper(), field)
+        return field
+
+    # for a call of a user-defined function, the python name of the input an argument
+    # names.  None for any other call
+    def param_of(self, func):
+        pou = self.pous.get(func.upper())
+        if pou is None or pou.kind != 'FUNCTION':
+            return None
+        return lambda name: pou.fields.get(name.upper(), name)
+
+    def var_name(self, name):
+        var = self.symbols.get(name.upper())
+        if var is not None:
+            return var.name
+        return python_name(name)
+
+    def func_name(self, name):
+        if name.upper() in self.pous:
+            return self.pous[name.upper()].name
+        if name.upper() in function_names:
+            return name.upper()
+        return self.var_name(name)
+
+    def expr(self, node):
+        return self.prec_expr(node)[0]
+
+    # text for the expression, parenthesized if it binds less tightly than min_prec
+    def operand(self, node, min_prec):
+        text, prec = self.prec_expr(node)
+        if prec < min_prec:
+            return f"({text})"
+        return text
+
+    # return the python text for an expression along with its binding strength
+    def prec_expr(self, node):
+        match node:
+            case stparse.Literal():
+                value = node.value
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and value < 0:
+                    return py_literal(value), neg_prec
+                return py_literal(value), atom_prec
+
+            case stparse.Name():
+                return self.var_name(node.name), atom_prec
+
+            case stparse.Member():
+                field = self.field_name(node.base, node.field)
+                return f"{self.operand(node.base, atom_prec)}.{field}", atom_prec
+
+            case stparse.Index():
+                indices = ''.join(f"[{self.expr(idx)}]" for idx in node.indices)
+                return f"{self.operand(node.base, atom_prec)}{indices}", atom_prec
+
+            case stparse.Call():
+                return f"{self.func_name(node.func)}({self.call_args(node.args, self.param_of(node.func))})", atom_prec
+
+            case stparse.UnaryOp(op='NOT'):
+                return f"not {self.operand(node.operand, not_prec)}", not_prec
+
+            case stparse.UnaryOp():
+                return f"-{self.operand(node.operand, neg_prec)}", neg_prec
+
+            case stparse.BinOp():
+                op, prec = py_binops[node.op]
+                if prec == cmp_prec:
+                    # python would chain a comparison nested in a comparison
+                    left_min, right_min = cmp_prec+1, cmp_prec+1
+                elif op == '**':
+                    left_min, right_min = atom_prec, neg_prec
+                else:
+                    left_min, right_min = prec, prec+1
+                left = self.operand(node.left, left_min)
+                right = self.operand(node.right, right_min)
+                return f"{left} {op} {right}", prec
 
-                extra_lines.append(f"{var_name} = {fb_var}.{fb_field}")
-                tail = copy.copy(argList[idx+1:])
-                argList = argList[:idx]
-                if len(tail) > 0:
-                    argList.extend(tail)
+        raise ValueError(f"cannot translate {type(node).__name__} as an expression")
 
-            args_str = ','.join(argList)
-            mod_line = f"{fb_var}.call({args_str})"
-            rtn.append(mod_line)
-            if len(extra_lines) > 0:
-                rtn.extend(extra_lines)
-        else:
-            rtn.append(line)
 
-    return '\n'.join(rtn)
- 
 def getArgs():
-    global st_file, python_file, location_file, intrfc_file
-
     parser = argparse.ArgumentParser()
     parser.add_argument(u'-st', metavar = u'name of file with ST code',
                         dest=u'st_file', required=True)
@@ -1193,6 +1606,18 @@ def getArgs():
     parser.add_argument(u'-intrfc', metavar = u'name of file with interface code',
                         dest=u'intrfc_file', required=True)
 
+    parser.add_argument(u'-cache', metavar = u'directory of cached translations',
+                        dest=u'cache_dir', default=stcache.cache_dir)
+
+    parser.add_argument(u'-nocache', action='store_true',
+                        dest=u'nocache', help=u'translate even if a cached translation exists')
+
+    parser.add_argument(u'-stream', action='store_true',
+                        dest=u'stream', help=u'translate a unit at a time, for very large ST files, without the build cache')
+
+    parser.add_argument(u'-incremental', action='store_true',
+                        dest=u'incremental', help=u'translate only what changed since the last -incremental translation, without the build cache')
+
     if len(sys.argv) < 2:
         print("Useage ST2pyFB.py -st ST-File -intrfc interface-file")
         exit(1)
@@ -1200,6 +1625,7 @@ def getArgs():
     args = parser.parse_args(sys.argv[1:])
     st_file = args.st_file
     intrfc_file = args.intrfc_file
+    stcache.cache_dir = args.cache_dir
 
     try:
         with open(st_file, 'r') as rf:
@@ -1215,152 +1641,51 @@ def getArgs():
         print(f"error: unable to open {st_file}")
         exit(1)
 
-    file_path = Path(st_file).stem
-    python_file   = file_path + '.py' 
-    location_file = file_path + '.json'
-
-def compute_mb_mapping():
-    mb_idx = 0
-    for subseq in IX_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-    mb_idx = 0
-    for subseq in IW_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-    mb_idx = 0
-    for subseq in QX_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-    mb_idx = 0
-    for subseq in QW_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-    for subseq in MW_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-    # make sure mb_idx is even
-    mb_idx += mb_idx%2
-    for subseq in MD_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += 2*len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-    # make sure mb_idx is multiple of 4 
-    if mb_idx%4 > 0:
-        mb_idx += (4-mb_idx%4)
-
-    for subseq in ML_seq.subseq:
-        subseq.mb_first = mb_idx
-        mb_idx += 4*len(subseq.values)
-        subseq.mb_last = mb_idx-1
-
-
-def indent_python_code(python_code):
-    # do alignment
-    lines = python_code.split('\n')
-    rtn = []
-    indentStep = '    '
-    indent = ''
-    indentCnt = 0
-
-    for line in lines:
-        line = line.strip()
-        if line.startswith('!@!START_BLK'):
-            indentCnt += 1
-            indentArray = [indentStep]*indentCnt
-            indent = ''.join(indentArray)
-            continue
-
-        if line.startswith('!@!END_BLK'):
-            if indentCnt > 0:
-                indentCnt -= 1
-
-            indentArray = [indentStep]*indentCnt
-            indent = ''.join(indentArray)
-            continue 
-
-        line = indent+line
-        rtn.append(line)
-
-    return('\n'.join(rtn))
-
-
-def strip_comments(blk):
-    lines = blk.split('\n')
-    rtn = []
-    for line in lines:
-        if line.find('(*') > -1 and line.find('*)') > -1:
-            continue
-        start = line.find('//')
-        if start > -1:
-            line = line[:start]
-        rtn.append(line.strip())
-
-    return '\n'.join(rtn)
-
-def get_condition(clause):
-    if clause.find('=')> -1 and clause.find('<=') == -1 and clause.find('>=') == -1:
-        clause = clause.replace('=','==') 
-    return clause.strip()
-    
-
-def trans_condition(pattern, code):
-        matches = re.finditer(pattern, code, re.IGNORECASE | re.DOTALL)
-        fill = []
-        for test_clause in matches:
-            # transform any '=' which is not part of '<=' or '>=' into '=='
-            (srt,end) = test_clause.span()
-            clause = code[srt:end+1]
-            if clause.find('=')> -1 and clause.find('<=') == -1 and clause.find('>=') == -1:
-                here = clause.find('=')
-                fill.append(here+srt)
-
-        for idx in reversed(range(0,len(fill))):
-            here = fill[idx]
-            code = code[:here]+'='+code[here:]
-
-        return code
-
-def old_find_instances(substr, mainstr, offset):
-    locs = []
-    start = 0
-    while True:
-        nxt_loc = mainstr.find(substr, start)
-        if nxt_loc > -1:
-            locs.append(nxt_loc+offset)
-            start = nxt_loc+len(substr)
-        else:
-            break
-    return locs
-
-def find_instances(substr, mainstr, start_idx, end_idx=None): 
-    locs = []
-    start = start_idx
-
-    if end_idx==None:
-        end_idx = len(mainstr)
-
-    while True:
-        nxt_loc = mainstr.find(substr, start, end_idx)
-        if nxt_loc > -1:
-            locs.append(nxt_loc)
-            start = nxt_loc+len(substr)
-        else:
-            break
-    return locs
+    if args.stream and args.incremental:
+        print("error: -stream and -incremental cannot be used together")
+        exit(1)
 
+    return TranslationJob(st_file, intrfc_file, use_cache=not args.nocache, stream=args.stream, \
+        incremental=args.incremental)
+
+# the memory classes whose variables share a range of Modbus indices starting at 0, in
+# the order they are laid out, and the indices taken by a variable of each (1 if not here)
+mb_ranges = (('IX',), ('IW',), ('QX',), ('QW', 'MW', 'MD', 'ML'))
+mb_width = {'MD': 2, 'ML': 4}
+
+# give each variable in the var_seqs its Modbus index, the variables of each class of a
+# range starting at a multiple of the class width.  prev_locs are the location map
+# entries of an earlier translation by name; a variable found there with the same type
+# and location keeps its index, and the rest follow the highest index those keep, so
+# that the variables a change to the program leaves alone keep their indices
+def compute_mb_mapping(seqs, prev_locs=None):
+    for mem_range in mb_ranges:
+        kept = {}
+        mb_idx = 0
+        if prev_locs is not None:
+            for mem_class in mem_range:
+                for subseq in seqs[mem_class].subseq:
+                    for vard in subseq.vards:
+                        prev = prev_locs.get(vard.name)
+                        if prev is not None and prev['var_type'] == vard.var_type and prev['mem_code'] == vard.mem_code:
+                            kept[vard.name] = prev['mb_idx']
+                            mb_idx = max(mb_idx, prev['mb_idx']+mb_width.get(mem_class, 1))
+
+        for mem_class in mem_range:
+            width = mb_width.get(mem_class, 1)
+            mb_idx += (-mb_idx)%width
+            for subseq in seqs[mem_class].subseq:
+                count = 0
+                for vard in subseq.vards:
+                    if vard.name in kept:
+                        vard.mb_idx = kept[vard.name]
+                    else:
+                        vard.mb_idx = mb_idx+count
+                        count += 1
+                mb_idx += width*count
 
+                subseq.mb_first = min(vard.mb_idx for vard in subseq.vards)
+                subseq.mb_last  = max(vard.mb_idx for vard in subseq.vards)
 
 
 def add_loc_desc(subseq, var_inst):
@@ -1372,32 +1697,32 @@ def add_loc_desc(subseq, var_inst):
         mem_code = vard.mem_code
         value = clean_value(subseq.values[idx])
         pos   = subseq.first+idx
-        mb_idx = subseq.mb_first+idx
+        mb_idx = vard.mb_idx
         var_dict = {'name':name, 'var_type': var_type, 'py_type': py_type, \
             'mem_code': mem_code, 'pos':pos, 'value':value, 'mb_idx': mb_idx}
         var_inst.append(var_dict)
 
-def build_location_map(output_file):
+def build_location_map(seqs, output_file):
     var_inst = []
-    for subseq in IX_seq.subseq:
+    for subseq in seqs['IX'].subseq:
         add_loc_desc(subseq, var_inst)
 
-    for subseq in QX_seq.subseq:
+    for subseq in seqs['QX'].subseq:
         add_loc_desc(subseq, var_inst)
 
-    for subseq in IW_seq.subseq:
+    for subseq in seqs['IW'].subseq:
         add_loc_desc(subseq, var_inst)
 
-    for subseq in QW_seq.subseq:
+    for subseq in seqs['QW'].subseq:
         add_loc_desc(subseq, var_inst)
 
-    for subseq in MW_seq.subseq:
+    for subseq in seqs['MW'].subseq:
         add_loc_desc(subseq, var_inst)
 
-    for subseq in MD_seq.subseq:
+    for subseq in seqs['MD'].subseq:
         add_loc_desc(subseq, var_inst)
 
-    for subseq in ML_seq.subseq:
+    for subseq in seqs['ML'].subseq:
         add_loc_desc(subseq, var_inst)
 
     with open(output_file,'w') as wf:
@@ -1415,7 +1740,7 @@ def mem_code_adv(mem_code, inc):
     pieces = pos.split('.')
     if len(pieces) == 1:
         pos = int(pos)+inc
-        return f"{mem_code[:2]}{inc}"
+        return f"{mem_code[:2]}{pos}"
 
     else:  
         word = int(pieces[0])
@@ -1426,9 +1751,9 @@ def mem_code_adv(mem_code, inc):
         bit  = pos%8
         return f"{mem_code[:2]}{word}.{bit}" 
 
-add_st2py  = '\ndef plc_thread_function(spc):\n'
+add_st2py  = "\ndef plc_thread_function(spc, catchup='skip'):\n"
 entry_call = '\nif __name__ == "__main__":\n    st2py()\n'
-imports    = ('sys','os','pdb','json','copy','math','mbs','mbaux','threading','time')
+imports    = ('sys','os','pdb','json','array','bisect','copy','functools','math','mbd','mbs','mbaux','mbstruct','operator','threading','time')
 
 def add_imports():
     rtn = []
@@ -1450,32 +1775,151 @@ def add_intrfc(intrfc_file):
 def add_functions():
     return functions
 
-def add_vars():
-    return '\n'.join(global_lines)
-    
-if __name__ == "__main__":
-    getArgs()
-
-    convertor = ConvertorApp(st_file)
-    python_code = convertor.convert()
-
-    compute_mb_mapping()
-    loc_map_str = build_location_map(location_file)
-
-    loc_map_str = f"loc_map_str = '{loc_map_str}'\n"
-    loc_map_str += "loc_map = json.loads(loc_map_str)\n\n" 
-
-    python_code = python_code.replace('!@!START_MAIN','build_loc_map(loc_map)\nwhile True:\n!@!START_BLK\ntime.sleep(spc/1000)\ntop_of_cycle_import()\n')
-    #python_code = add_imports()+'\n'+add_functions()+'\n'+add_vars()+add_st2py+'\n!@!START_BLK\n'+python_code+'\n!@!END_BLK\n'
+# A TranslationJob is the translation of one ST file, with everything the translation
+# builds up on the way: the declarations of the program variables, the python of the
+# user-defined function blocks and functions, and the var_seq of each memory class
+# that lays out the variables in the interface and in the Modbus tables.  Jobs share
+# nothing, so any number can run in one process, one after another or in a pool
+class TranslationJob:
+    def __init__(self, st_file, intrfc_file, out_dir='', use_cache=True, stream=False, incremental=False):
+        self.st_file = st_file
+        self.intrfc_file = intrfc_file
+        self.use_cache = use_cache
+        self.stream = stream
+        self.incremental = incremental
+
+        stem = Path(st_file).stem
+        self.python_file = os.path.join(out_dir, stem+'.py')
+        self.location_file = os.path.join(out_dir, stem+'.json')
+
+        # the record of an incremental translation, and the location map entries by
+        # name of the one before it
+        self.units_file = os.path.join(out_dir, stem+'.units.json')
+        self.prev_locs = None
+
+        self.global_lines = []
+        self.global_vars  = []
+        self.global_stmnt = ''
+
+        # the python classes and functions of the user-defined function blocks and functions
+        self.pou_lines = []
+
+        self.seqs = {mem_class: var_seq(mem_class) for mem_class in mem_classes}
+
+    # translate st_file into python_file and location_file, or copy those out of the
+    # build cache.  Returns 'cached' or 'translated', and raises STSyntaxError for ST
+    # it cannot translate
+    def run(self):
+        if self.stream:
+            self.translate_stream()
+            return 'translated'
+        if self.incremental:
+            self.translate_incremental()
+            return 'translated'
+
+        # an unchanged program comes straight out of the build cache
+        cache_key = stcache.build_key(self.st_file, self.intrfc_file, pyST_version)
+        if self.use_cache and stcache.restore(cache_key, self.python_file, self.location_file):
+            return 'cached'
+
+        python_code = ConvertorApp(self).convert()
+        python_code = add_imports()+add_intrfc(self.intrfc_file)+add_functions()+self.add_pous()+'\n'+self.add_vars()+ \
+            '\n'+self.loc_map_text()+self.add_main(python_code)
+
+        with open(self.python_file, 'w') as wf:
+            wf.write(python_code)
+
+        stcache.store(cache_key, self.python_file, self.location_file, python_code, self.use_cache)
+        return 'translated'
+
+    # translate st_file a unit at a time, writing the python as it goes to a temporary
+    # file that takes the place of python_file once complete.  Filing a translation in
+    # the build cache means compiling all of it at once, so the cache is not used
+    def translate_stream(self):
+        tmp_file = f"{self.python_file}.tmp"
+        convertor = ConvertorApp(self)
+        try:
+            with open(tmp_file, 'w') as wf:
+                wf.write(add_imports()+add_intrfc(self.intrfc_file)+add_functions())
+                python_code = convertor.convert_stream(wf)
+                wf.write('\n'+self.add_vars()+'\n'+self.loc_map_text()+self.add_main(python_code))
+        except stparse.STSyntaxError:
+            os.remove(tmp_file)
+            raise
+
+        os.replace(tmp_file, self.python_file)
+
+    # translate st_file again, reusing what units_file records of the last translation
+    # for the pieces of the source that have not changed, and laying the variables out
+    # in the interface and Modbus tables where location_file says they were.  Its python
+    # depends on that history as well as on the source, so the build cache is not used
+    def translate_incremental(self):
+        record = None
+        if os.path.isfile(self.units_file):
+            with open(self.units_file, 'r') as rf:
+                record = json.load(rf)
+            if record.get('translator') != stcache.translator_digest():
+                record = None
+
+        self.prev_locs = {}
+        if os.path.isfile(self.location_file):
+            with open(self.location_file, 'r') as rf:
+                self.prev_locs = {var_dict['name']: var_dict for var_dict in json.load(rf)}
+
+        convertor = ConvertorApp(self)
+        python_code = convertor.convert_incremental(record)
+        python_code = add_imports()+add_intrfc(self.intrfc_file)+add_functions()+self.add_pous()+'\n'+self.add_vars()+ \
+            '\n'+self.loc_map_text()+self.add_main(python_code)
+
+        with open(self.python_file, 'w') as wf:
+            wf.write(python_code)
+
+        convertor.units['translator'] = stcache.translator_digest()
+        stcache.write_atomic(self.units_file, json.dumps(convertor.units).encode())
+
+    def add_pous(self):
+        if len(self.pou_lines) == 0:
+            return ''
+        return '\n'.join(self.pou_lines)+'\n'
+
+    def add_vars(self):
+        return '\n'.join(self.global_lines)
+
+    # lay out the Modbus and interface locations of the variables, write the location
+    # map, and return the python that carries it into the PLC program
+    def loc_map_text(self):
+        compute_mb_mapping(self.seqs, self.prev_locs)
+        loc_map_str = build_location_map(self.seqs, self.location_file)
+
+        loc_map_str = f"loc_map_str = {loc_map_str!r}\n"
+        loc_map_str += "loc_map = json.loads(loc_map_str)\n"
+        return loc_map_str
+
+    # wrap the translated program body in the PLC scan loop
+    def add_main(self, python_body):
+        lines = []
+        for stmnt in self.global_stmnt.split('\n'):
+            if len(stmnt) > 0:
+                lines.append('    '+stmnt)
+
+        lines.append('    build_loc_map(loc_map)')
+        lines.append('    plc_scan.start(spc, catchup)')
+        lines.append('    while plc_scan.next_cycle():')
+        lines.append('        top_of_cycle_import()')
+        if len(python_body) > 0:
+            lines.append(python_body)
+        lines.append('        bottom_of_cycle_export()')
+
+        return add_st2py+'\n'.join(lines)+'\n'
 
-    python_code = add_vars()+'\n'+loc_map_str+add_st2py+'!@!START_BLK\n'+global_stmnt+'\n!@!END_BLK\n'+python_code+'\nbottom_of_cycle_export()\n!@!END_BLK\n'
-    python_code = fb_calls(python_code)
-    python_code = indent_python_code(python_code)
-    python_code = add_imports()+add_intrfc(intrfc_file)+'\n'+add_functions()+'\n'+python_code
-    #python_code += entry_call
-    python_code = convertor.clean_up_python_code(python_code)
+if __name__ == "__main__":
+    job = getArgs()
 
-    with open(python_file, 'w') as wf:
-        wf.write(python_code) 
+    try:
+        status = job.run()
+    except stparse.STSyntaxError as err:
+        print(f"error: {job.st_file} {err}")
+        exit(1)
 
-    
+    if status == 'cached':
+        print(f"{job.st_file} unchanged, using cached {job.python_file}")
@@ -0,0 +1,111 @@
+# shared memory segments holding the process images of the PLC and the Modbus
+# data tables, so that the Modbus server, the PLC, and the digital twin can each
+# run in a process of its own (mbp.py -roles processes)
+#
+import os
+import time
+
+from multiprocessing import shared_memory
+
+# the memory classes whose process images the PLC and the digital twin share
+image_classes = ('IX', 'IW', 'QX', 'QW', 'MW')
+
+# the Modbus tables, in the order mbd.create_tables takes them
+table_names = ('coil', 'data', 'input_reg', 'holding_reg')
+
+# bytes ahead of the data of a segment, holding its sequence number.  Being 8
+# keeps the data aligned for any format a process image uses
+header_bytes = 8
+
+# bytes in each Modbus table of tablesize entries, a byte per bit and two per register
+def table_bytes(tablesize):
+    return {'coil': tablesize, 'data': tablesize, 'input_reg': 2*tablesize, 'holding_reg': 2*tablesize}
+
+# A shared_segment is a block of shared memory whose data is guarded by a seqlock.
+# The sequence number in the header is odd while a writer is changing the data
+# and even otherwise.  A reader notes the number before it copies the data and
+# copies again if the number was odd or has changed by the time it is done, so
+# readers never block a writer and never see half of an update.
+# A segment written by only one process (each process image) needs nothing more;
+# one that several processes write (each Modbus table) is given a lock that its
+# writers take, readers still going without it
+class shared_segment():
+    def __init__(self, name, nbytes, create=False, lock=None):
+        self.name = name
+        self.nbytes = nbytes
+        self.created = create
+        self.lock = lock
+
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=header_bytes+nbytes)
+            except FileExistsError:
+                # left behind by an earlier run that died, so start over
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=header_bytes+nbytes)
+        else:
+            self.shm = attach_shared_memory(name)
+
+        self.seq = self.shm.buf[:header_bytes].cast('Q')
+        self.data = self.shm.buf[header_bytes:header_bytes+nbytes]
+
+    def begin_write(self):
+        if self.lock is not None:
+            self.lock.acquire()
+        self.seq[0] += 1
+
+    def end_write(self):
+        self.seq[0] += 1
+        if self.lock is not None:
+            self.lock.release()
+
+    # wait out a writer in the middle of an update and return the sequence number to check against
+    def begin_read(self):
+        seq = self.seq[0]
+        while seq & 1:
+            time.sleep(0)
+            seq = self.seq[0]
+        return seq
+
+    # whether what was read since begin_read returned seq has to be read again
+    def read_retry(self, seq):
+        return self.seq[0] != seq
+
+    # the process images laid over the data must have released their views of it
+    # first (release_process_images of aux.py)
+    def close(self):
+        self.seq.release()
+        self.data.release()
+        self.shm.close()
+
+    def unlink(self):
+        if self.created:
+            self.shm.unlink()
+
+# attach to a segment another process created.  The roles mbp.py starts share
+# its resource tracker, so the segment stays registered there just once, and is
+# removed by the tracker only if mbp.py dies without removing it itself
+def attach_shared_memory(name):
+    return shared_memory.SharedMemory(name=name)
+
+# create a segment for each entry of sizes, which maps a key (a memory class or a
+# table name) to the bytes of data it holds.  locks maps the key of each segment
+# that more than one process writes to the lock its writers share.  Returned are
+# the segments by key, and the specs another process passes to attach_segments
+def create_segments(sizes, locks):
+    segments = {}
+    specs = {}
+    for key, nbytes in sizes.items():
+        name = f"pyST_{os.getpid()}_{key}"
+        lock = locks.get(key)
+        segments[key] = shared_segment(name, nbytes, True, lock)
+        specs[key] = (name, nbytes, lock)
+    return segments, specs
+
+def attach_segments(specs):
+    segments = {}
+    for key, (name, nbytes, lock) in specs.items():
+        segments[key] = shared_segment(name, nbytes, False, lock)
+    return segments
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# translate many ST programs at once.  Each file named, and each .st file in each
+# directory named, is translated by pyST.py as a TranslationJob of its own, the jobs
+# spread over a pool of processes.  The python and .json of every program go to one
+# output directory, so no two programs may share a file name.  At the end comes a
+# report of the lines, outcome and translation time of every file
+#
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import pyST
+import stcache
+import stparse
+
+from pathlib import Path
+
+# the .st files named by paths, those in a directory in name order
+def st_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(str(st_path) for st_path in Path(path).glob('*.st')))
+        else:
+            files.append(path)
+    return files
+
+# run in a pool process: translate one file and return its name, the number of lines
+# in it, the outcome, and the seconds the translation took
+def translate_file(task):
+    st_file, intrfc_file, out_dir, cache_dir, use_cache = task
+    stcache.cache_dir = cache_dir
+
+    start = time.perf_counter()
+    num_lines = 0
+    try:
+        with open(st_file, 'r') as rf:
+            num_lines = sum(1 for line in rf)
+        status = pyST.TranslationJob(st_file, intrfc_file, out_dir, use_cache).run()
+    except stparse.STSyntaxError as err:
+        status = f"error: {err}"
+    except OSError as err:
+        status = f"error: {err.strerror}"
+    except SystemExit:
+        # the translator has printed why
+        status = 'error'
+    except Exception as err:
+        # whatever else goes wrong with one file is reported with it, not left to
+        # stop the whole batch
+        status = f"error: {type(err).__name__}: {err}"
+    return st_file, num_lines, status, time.perf_counter()-start
+
+def getArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(u'paths', metavar = u'ST file or directory of them', nargs='+')
+
+    parser.add_argument(u'-intrfc', metavar = u'name of file with interface code',
+                        dest=u'intrfc_file', required=True)
+
+    parser.add_argument(u'-out', metavar = u'directory for the python and .json files',
+                        dest=u'out_dir', default='.')
+
+    parser.add_argument(u'-jobs', metavar = u'number of processes translating at once',
+                        dest=u'jobs', default=str(os.cpu_count()))
+
+    parser.add_argument(u'-cache', metavar = u'directory of cached translations',
+                        dest=u'cache_dir', default=stcache.cache_dir)
+
+    parser.add_argument(u'-nocache', action='store_true',
+                        dest=u'nocache', help=u'translate even if a cached translation exists')
+
+    args = parser.parse_args(sys.argv[1:])
+
+    if not args.jobs.isdigit() or int(args.jobs) < 1:
+        print("number of jobs must be a positive integer")
+        exit(1)
+
+    if not os.path.isfile(args.intrfc_file):
+        print(f"error: unable to open {args.intrfc_file}")
+        exit(1)
+
+    return args
+
+def report(results, elapsed, jobs):
+    width = max(len('file'), max(len(st_file) for st_file, num_lines, status, seconds in results))
+    print(f"{'file':<{width}} {'lines':>8} {'seconds':>9}  outcome")
+    for st_file, num_lines, status, seconds in results:
+        print(f"{st_file:<{width}} {num_lines:>8} {seconds:>9.3f}  {status}")
+
+    failed = sum(1 for result in results if result[2].startswith('error'))
+    busy = sum(result[3] for result in results)
+    print(f"{len(results)} files, {failed} failed, {sum(result[1] for result in results)} lines")
+    print(f"{busy:.3f} seconds translating, {elapsed:.3f} seconds elapsed with {jobs} processes")
+    return failed
+
+def main():
+    args = getArgs()
+    files = st_files(args.paths)
+    if len(files) == 0:
+        print("no .st files to translate")
+        exit(1)
+
+    # the outputs of every program go to the same directory
+    stems = {}
+    for st_file in files:
+        stem = Path(st_file).stem
+        if stem in stems:
+            print(f"error: {st_file} and {stems[stem]} would both be translated to {stem}.py")
+            exit(1)
+        stems[stem] = st_file
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    tasks = [(st_file, args.intrfc_file, args.out_dir, args.cache_dir, not args.nocache) for st_file in files]
+    jobs = min(int(args.jobs), len(tasks))
+
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(jobs) as pool:
+        results = pool.map(translate_file, tasks, chunksize=1)
+    elapsed = time.perf_counter()-start
+
+    if report(results, elapsed, jobs) > 0:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
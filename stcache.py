@@ -0,0 +1,116 @@
+# build cache for pyST.py.
+#
+# A translation is keyed on a hash of the ST source, the interface file, and the
+# version of the translator.  Each cache entry holds the emitted python, the
+# json location map, and the marshalled code object of the emitted python, so a
+# program that has not changed is neither translated nor compiled again: its
+# files are copied out of the cache and the code object is written as the
+# module's .pyc, which the import of the PLC program then picks up directly.
+#
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+
+# directory holding one sub-directory per cached translation
+cache_dir = '.pyST_cache'
+
+# modules whose source determines the output of a translation
+translator_files = ('pyST.py', 'stparse.py', 'stcache.py')
+
+python_name = 'program.py'
+location_name = 'program.json'
+code_name = 'program.code'
+
+# digest of the translator source, so that editing the translator without
+# changing its version number still invalidates what it translated before
+def translator_digest():
+    h = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in translator_files:
+        try:
+            with open(os.path.join(here, name), 'rb') as rf:
+                h.update(rf.read())
+        except OSError:
+            h.update(name.encode())
+    return h.hexdigest()
+
+# the key naming the cache entry for translating st_file against intrfc_file.
+# The interpreter's cache tag is included because the marshal format follows it
+def build_key(st_file, intrfc_file, version):
+    h = hashlib.sha256()
+    h.update(f"{version}\0{translator_digest()}\0{sys.implementation.cache_tag}\0".encode())
+    for path in (st_file, intrfc_file):
+        with open(path, 'rb') as rf:
+            h.update(rf.read())
+        h.update(b'\0')
+    return h.hexdigest()
+
+def entry_dir(key):
+    return os.path.join(cache_dir, key)
+
+# write data to path through a temporary file, so that a reader never sees half of it
+def write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as wf:
+        wf.write(data)
+    os.replace(tmp, path)
+
+# write data to path only if it differs from what is there, leaving the file
+# (and its modification time) alone for an unchanged program
+def write_if_changed(path, data):
+    try:
+        with open(path, 'rb') as rf:
+            if rf.read() == data:
+                return
+    except OSError:
+        pass
+    write_atomic(path, data)
+
+# write the code object of python_file as the hash-checked .pyc the import system looks for
+def write_pyc(python_file, source, code_bytes):
+    pyc_file = importlib.util.cache_from_source(os.path.abspath(python_file))
+    os.makedirs(os.path.dirname(pyc_file), exist_ok=True)
+
+    # flags 0b11 mark a hash-based pyc whose source hash is checked on import
+    header = importlib.util.MAGIC_NUMBER + (0b11).to_bytes(4, 'little') \
+        + importlib.util.source_hash(source)
+    write_if_changed(pyc_file, header+code_bytes)
+
+# if the translation named by key is cached, write its python, location map,
+# and .pyc to the output files and return True
+def restore(key, python_file, location_file):
+    entry = entry_dir(key)
+    try:
+        with open(os.path.join(entry, code_name), 'rb') as rf:
+            code_bytes = rf.read()
+        with open(os.path.join(entry, python_name), 'rb') as rf:
+            source = rf.read()
+        with open(os.path.join(entry, location_name), 'rb') as rf:
+            location = rf.read()
+    except OSError:
+        return False
+
+    write_if_changed(python_file, source)
+    write_if_changed(location_file, location)
+    write_pyc(python_file, source, code_bytes)
+    return True
+
+# compile the emitted python, write its .pyc, and save the translation under key
+def store(key, python_file, location_file, python_code, use_cache=True):
+    source = python_code.encode()
+    code_bytes = marshal.dumps(compile(source, python_file, 'exec'))
+    write_pyc(python_file, source, code_bytes)
+
+    if not use_cache:
+        return
+
+    entry = entry_dir(key)
+    os.makedirs(entry, exist_ok=True)
+    with open(location_file, 'rb') as rf:
+        write_atomic(os.path.join(entry, location_name), rf.read())
+    write_atomic(os.path.join(entry, python_name), source)
+
+    # the code object goes last, its presence marks the entry complete
+    write_atomic(os.path.join(entry, code_name), code_bytes)
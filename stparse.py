@@ -0,0 +1,927 @@
+# tokenizer, abstract syntax tree, and recursive-descent parser for the
+# subset of Structured Text (ST) that pyST.py translates.
+#
+# The tokenizer makes a single pass over the source with one compiled
+# regular expression, and the parser consumes the token list front to back
+# without ever re-scanning, so the cost of building the tree grows linearly
+# with the size of the ST program.
+#
+import re
+
+
+# raised for any input the tokenizer or parser cannot make sense of
+class STSyntaxError(Exception):
+    def __init__(self, msg, line):
+        super().__init__(f"line {line}: {msg}")
+        self.msg = msg
+        self.line = line
+
+
+keywords = frozenset((
+    'PROGRAM', 'END_PROGRAM', 'FUNCTION', 'END_FUNCTION',
+    'FUNCTION_BLOCK', 'END_FUNCTION_BLOCK',
+    'CONFIGURATION', 'END_CONFIGURATION', 'TYPE', 'END_TYPE',
+    'VAR', 'VAR_INPUT', 'VAR_OUTPUT', 'VAR_IN_OUT', 'VAR_GLOBAL',
+    'VAR_EXTERNAL', 'VAR_TEMP', 'END_VAR',
+    'CONSTANT', 'RETAIN', 'NON_RETAIN', 'PERSISTENT', 'AT', 'ARRAY', 'OF',
+    'IF', 'THEN', 'ELSIF', 'ELSE', 'END_IF', 'CASE', 'END_CASE',
+    'FOR', 'TO', 'BY', 'DO', 'END_FOR', 'WHILE', 'END_WHILE',
+    'REPEAT', 'UNTIL', 'END_REPEAT', 'EXIT', 'CONTINUE', 'RETURN',
+    'AND', 'OR', 'XOR', 'NOT', 'MOD', 'TRUE', 'FALSE'))
+
+var_blk_kinds = ('VAR', 'VAR_INPUT', 'VAR_OUTPUT', 'VAR_IN_OUT', 'VAR_GLOBAL',
+    'VAR_EXTERNAL', 'VAR_TEMP')
+
+var_qualifiers = ('CONSTANT', 'RETAIN', 'NON_RETAIN', 'PERSISTENT')
+
+# keywords that close a program organization unit, or a section skipped like one
+pou_ends = frozenset(('END_PROGRAM', 'END_FUNCTION', 'END_FUNCTION_BLOCK',
+    'END_CONFIGURATION', 'END_TYPE'))
+
+# a line that might close a program organization unit
+pou_end_pattern = re.compile(r"END_(?:PROGRAM|FUNCTION|CONFIGURATION|TYPE)", re.IGNORECASE)
+
+# keywords that close a statement list
+stmt_list_ends = frozenset(('END_IF', 'ELSIF', 'ELSE', 'END_CASE', 'END_FOR',
+    'END_WHILE', 'UNTIL', 'END_REPEAT', 'END_PROGRAM', 'END_FUNCTION',
+    'END_FUNCTION_BLOCK'))
+
+token_pattern = re.compile(r"""
+     (?P<ws>[ \t\r\f\v]+)
+    |(?P<nl>\n)
+    |(?P<bcomment>\(\*.*?\*\))
+    |(?P<ocomment>\(\*)
+    |(?P<lcomment>//[^\n]*)
+    |(?P<pragma>\{[^}]*\})
+    |(?P<time>(?i:LTIME|LT|TIME|T)\#-?[0-9a-zA-Z_.]+)
+    |(?P<date>(?i:DATE_AND_TIME|TIME_OF_DAY|DATE|TOD|DT|D)\#[-0-9:._]+)
+    |(?P<based>(?:[A-Za-z]+\#)?(?:2|8|16)\#[0-9A-Fa-f_]+)
+    |(?P<real>(?:[A-Za-z]+\#)?\d[\d_]*(?:\.\d[\d_]*(?:[eE][+-]?\d+)?|[eE][+-]?\d+))
+    |(?P<int>(?:[A-Za-z]+\#)?\d[\d_]*)
+    |(?P<str>'(?:\$.|[^'$])*')
+    |(?P<wstr>"(?:\$.|[^"$])*")
+    |(?P<addr>%[IQM][XBWDL]?[\d.]*)
+    |(?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<op>:=|=>|<=|>=|<>|\*\*|\.\.|[-+*/()\[\],;:=<>.&])
+    |(?P<bad>.)
+    """, re.VERBOSE | re.DOTALL)
+
+time_units = {'d': 86400000.0, 'h': 3600000.0, 'm': 60000.0, 's': 1000.0,
+    'ms': 1.0, 'us': 0.001, 'ns': 0.000001}
+
+time_piece = re.compile(r"(\d+(?:\.\d+)?)(ms|us|ns|d|h|m|s)")
+
+str_escapes = {'$': '$', "'": "'", '"': '"', 'L': '\n', 'N': '\n', 'P': '\f',
+    'R': '\r', 'T': '\t'}
+
+
+class Token():
+    __slots__ = ('kind', 'value', 'line')
+
+    def __init__(self, kind, value, line):
+        self.kind  = kind
+        self.value = value
+        self.line  = line
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r}, {self.line})"
+
+
+# turn an ST duration like T#1h2m3s or TIME#1.5s into integer milliseconds
+def time_to_ms(text, line):
+    body = text[text.find('#')+1:].replace('_', '').lower()
+    sign = 1
+    if body.startswith('-'):
+        sign = -1
+        body = body[1:]
+
+    ms = 0.0
+    consumed = 0
+    for piece in time_piece.finditer(body):
+        if piece.start() != consumed:
+            break
+        ms += float(piece.group(1))*time_units[piece.group(2)]
+        consumed = piece.end()
+
+    if consumed == 0 or consumed != len(body):
+        raise STSyntaxError(f"malformed duration literal {text}", line)
+    return sign*int(round(ms))
+
+# replace the '$' escapes of an ST string literal
+def unescape(body):
+    if body.find('$') == -1:
+        return body
+
+    rtn = []
+    idx = 0
+    while idx < len(body):
+        c = body[idx]
+        if c == '$' and idx+1 < len(body):
+            nxt = body[idx+1]
+            if nxt.upper() in str_escapes:
+                rtn.append(str_escapes[nxt.upper()])
+                idx += 2
+                continue
+            if idx+2 < len(body):
+                try:
+                    rtn.append(chr(int(body[idx+1:idx+3], 16)))
+                    idx += 3
+                    continue
+                except ValueError:
+                    pass
+        rtn.append(c)
+        idx += 1
+    return ''.join(rtn)
+
+# split ST source text into a list of tokens.  Comments are kept as tokens
+# so that the parser can carry them into the translation.  line is the line
+# number of the first line of source
+def tokenize(source, line=1):
+    tokens = []
+    for m in token_pattern.finditer(source):
+        kind = m.lastgroup
+        text = m.group()
+        match kind:
+            case 'ws' | 'pragma':
+                line += text.count('\n')
+                continue
+            case 'nl':
+                line += 1
+                continue
+            case 'bcomment':
+                tokens.append(Token('COMMENT', text[2:-2].strip(), line))
+                line += text.count('\n')
+                continue
+            case 'lcomment':
+                tokens.append(Token('COMMENT', text[2:].strip(), line))
+                continue
+            case 'ocomment':
+                raise STSyntaxError("comment not closed", line)
+            case 'ident':
+                upper = text.upper()
+                if upper in keywords:
+                    tokens.append(Token('KW', upper, line))
+                else:
+                    tokens.append(Token('IDENT', text, line))
+            case 'int':
+                digits = text[text.find('#')+1:].replace('_', '')
+                tokens.append(Token('NUM', int(digits), line))
+            case 'based':
+                pieces = text.split('#')
+                tokens.append(Token('NUM', int(pieces[-1].replace('_', ''), int(pieces[-2])), line))
+            case 'real':
+                digits = text[text.find('#')+1:].replace('_', '')
+                tokens.append(Token('REAL', float(digits), line))
+            case 'time':
+                tokens.append(Token('TIME', time_to_ms(text, line), line))
+            case 'date':
+                tokens.append(Token('STR', text[text.find('#')+1:], line))
+            case 'str' | 'wstr':
+                tokens.append(Token('STR', unescape(text[1:-1]), line))
+            case 'addr':
+                tokens.append(Token('ADDR', text[1:], line))
+            case 'op':
+                tokens.append(Token('OP', text, line))
+            case _:
+                raise STSyntaxError(f"unexpected character {text!r}", line)
+
+    tokens.append(Token('EOF', None, line))
+    return tokens
+
+
+#
+# abstract syntax tree.  Statement and expression nodes are plain classes;
+# the emitter in pyST.py dispatches on their type.
+#
+
+# a program organization unit (POU) made of variable blocks and a statement body.
+# kind is 'PROGRAM', 'FUNCTION_BLOCK' or 'FUNCTION', and return_type the type name
+# of the value a FUNCTION returns
+class Program():
+    def __init__(self, name, var_blocks, body, line=0, kind='PROGRAM', return_type=None):
+        self.name = name
+        self.var_blocks = var_blocks
+        self.body = body
+        self.line = line
+        self.kind = kind
+        self.return_type = return_type
+
+class VarBlock():
+    def __init__(self, kind, qualifiers, decls):
+        self.kind = kind
+        self.qualifiers = qualifiers
+        self.decls = decls
+
+# one declaration line, possibly naming several variables.
+#   - dims     . list of (low, high) index pairs for ARRAY declarations, else empty
+#   - mem_code . ST direct address without the '%' (e.g. 'IX0.1'), or None
+#   - init     . expression (or ArrayInit) giving the initial value, or None
+class VarDecl():
+    def __init__(self, names, type_name, dims, mem_code, init, line=0):
+        self.names = names
+        self.type_name = type_name
+        self.dims = dims
+        self.mem_code = mem_code
+        self.init = init
+        self.line = line
+
+class ArrayInit():
+    def __init__(self, items):
+        self.items = items
+
+class Comment():
+    def __init__(self, text):
+        self.text = text
+
+class Assign():
+    def __init__(self, target, value):
+        self.target = target
+        self.value = value
+
+# argument to a function or function block call.  name is None for positional
+# arguments, output is True for the 'name => variable' form
+class Arg():
+    def __init__(self, name, value, output=False):
+        self.name = name
+        self.value = value
+        self.output = output
+
+class CallStmt():
+    def __init__(self, callee, args):
+        self.callee = callee
+        self.args = args
+
+# branches is a list of (condition, body) pairs, the first from IF and the rest from ELSIF
+class If():
+    def __init__(self, branches, else_body):
+        self.branches = branches
+        self.else_body = else_body
+
+# branches is a list of (labels, body) pairs; a label is an expression or a Range
+class Case():
+    def __init__(self, selector, branches, else_body):
+        self.selector = selector
+        self.branches = branches
+        self.else_body = else_body
+
+class Range():
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+class For():
+    def __init__(self, var, start, stop, step, body):
+        self.var = var
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.body = body
+
+class While():
+    def __init__(self, cond, body):
+        self.cond = cond
+        self.body = body
+
+class Repeat():
+    def __init__(self, body, cond):
+        self.body = body
+        self.cond = cond
+
+class Exit():
+    pass
+
+class Continue():
+    pass
+
+class Return():
+    pass
+
+class Literal():
+    def __init__(self, value):
+        self.value = value
+
+class Name():
+    def __init__(self, name):
+        self.name = name
+
+class Index():
+    def __init__(self, base, indices):
+        self.base = base
+        self.indices = indices
+
+class Member():
+    def __init__(self, base, field):
+        self.base = base
+        self.field = field
+
+class Call():
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+class BinOp():
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+class UnaryOp():
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+
+# binding strength of the ST binary operators, larger binds tighter.
+# Exponentiation and the unary operators are handled separately
+binary_prec = {'OR': 1, 'XOR': 2, 'AND': 3, '&': 3, '=': 4, '<>': 4,
+    '<': 5, '>': 5, '<=': 5, '>=': 5, '+': 6, '-': 6, '*': 7, '/': 7, 'MOD': 7}
+
+# how deep expressions and statement lists may nest.  The parser, and the translator
+# after it, recurse once per level, so deeper source is refused with its line number
+# rather than running out of stack
+max_nesting = 100
+
+
+class Parser():
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.depth = 0
+
+    #
+    # token access
+    #
+
+    # next token that is not a comment
+    def peek(self):
+        tokens = self.tokens
+        while tokens[self.pos].kind == 'COMMENT':
+            self.pos += 1
+        return tokens[self.pos]
+
+    # the token following peek()
+    def peek2(self):
+        if self.peek().kind == 'EOF':
+            return self.tokens[self.pos]
+        idx = self.pos+1
+        while self.tokens[idx].kind == 'COMMENT':
+            idx += 1
+        return self.tokens[idx]
+
+    def advance(self):
+        tok = self.peek()
+        if tok.kind != 'EOF':
+            self.pos += 1
+        return tok
+
+    # go one level deeper into the source, which is an error past max_nesting.  The
+    # caller goes back up with self.depth -= 1 once it has parsed that level
+    def nest(self):
+        self.depth += 1
+        if self.depth > max_nesting:
+            raise STSyntaxError(f"nested more than {max_nesting} levels deep", self.peek().line)
+
+    # gather comments sitting at the current position into Comment nodes
+    def comments(self):
+        rtn = []
+        while self.tokens[self.pos].kind == 'COMMENT':
+            rtn.append(Comment(self.tokens[self.pos].value))
+            self.pos += 1
+        return rtn
+
+    def at_kw(self, *names):
+        tok = self.peek()
+        return tok.kind == 'KW' and tok.value in names
+
+    def at_op(self, *ops):
+        tok = self.peek()
+        return tok.kind == 'OP' and tok.value in ops
+
+    def accept_kw(self, name):
+        if self.at_kw(name):
+            return self.advance()
+        return None
+
+    def accept_op(self, op):
+        if self.at_op(op):
+            return self.advance()
+        return None
+
+    def expect_kw(self, name):
+        tok = self.peek()
+        if tok.kind != 'KW' or tok.value != name:
+            raise STSyntaxError(f"expected {name}, found {describe(tok)}", tok.line)
+        return self.advance()
+
+    def expect_op(self, op):
+        tok = self.peek()
+        if tok.kind != 'OP' or tok.value != op:
+            raise STSyntaxError(f"expected '{op}', found {describe(tok)}", tok.line)
+        return self.advance()
+
+    def expect_ident(self):
+        tok = self.peek()
+        if tok.kind != 'IDENT':
+            raise STSyntaxError(f"expected a name, found {describe(tok)}", tok.line)
+        return self.advance().value
+
+    # skip tokens up to and including the keyword 'name'
+    def skip_past(self, name):
+        while not self.at_kw(name):
+            if self.peek().kind == 'EOF':
+                raise STSyntaxError(f"missing {name}", self.peek().line)
+            self.advance()
+        self.advance()
+
+    #
+    # program organization units
+    #
+
+    # parse a whole file, returning the list of POUs found in it
+    def parse_file(self):
+        pous = []
+        while True:
+            self.comments()
+            tok = self.peek()
+            if tok.kind == 'EOF':
+                return pous
+
+            if tok.kind == 'KW' and tok.value == 'PROGRAM':
+                pous.append(self.parse_program())
+            elif tok.kind == 'KW' and tok.value in ('CONFIGURATION', 'TYPE'):
+                self.advance()
+                self.skip_past('END_'+tok.value)
+                self.accept_op(';')
+            elif tok.kind == 'KW' and tok.value == 'FUNCTION_BLOCK':
+                pous.append(self.parse_function_block())
+            elif tok.kind == 'KW' and tok.value == 'FUNCTION':
+                pous.append(self.parse_function())
+            elif tok.kind == 'KW' and tok.value in var_blk_kinds:
+                # program body without a PROGRAM header
+                pous.append(self.parse_pou_body('', tok.line, None))
+            else:
+                raise STSyntaxError(f"unexpected {describe(tok)} outside a PROGRAM", tok.line)
+
+    def parse_program(self):
+        line = self.expect_kw('PROGRAM').line
+        name = self.expect_ident()
+        return self.parse_pou_body(name, line, 'END_PROGRAM')
+
+    def parse_function_block(self):
+        line = self.expect_kw('FUNCTION_BLOCK').line
+        name = self.expect_ident()
+        return self.parse_pou_body(name, line, 'END_FUNCTION_BLOCK', 'FUNCTION_BLOCK')
+
+    def parse_function(self):
+        line = self.expect_kw('FUNCTION').line
+        name = self.expect_ident()
+        self.expect_op(':')
+        return_type = self.expect_ident()
+        self.accept_op(';')
+        return self.parse_pou_body(name, line, 'END_FUNCTION', 'FUNCTION', return_type)
+
+    def parse_pou_body(self, name, line, end_kw, kind='PROGRAM', return_type=None):
+        var_blocks = []
+        while True:
+            # comments ahead of a VAR block belong to no statement
+            save = self.pos
+            self.comments()
+            if self.at_kw(*var_blk_kinds):
+                var_blocks.append(self.parse_var_block())
+            else:
+                self.pos = save
+                break
+
+        body = self.parse_stmt_list()
+        if end_kw is not None:
+            self.expect_kw(end_kw)
+            self.accept_op(';')
+        elif self.peek().kind != 'EOF':
+            tok = self.peek()
+            raise STSyntaxError(f"unexpected {describe(tok)}", tok.line)
+
+        return Program(name, var_blocks, body, line, kind, return_type)
+
+    #
+    # declarations
+    #
+
+    def parse_var_block(self):
+        kind = self.advance().value
+        qualifiers = []
+        while self.at_kw(*var_qualifiers):
+            qualifiers.append(self.advance().value)
+
+        decls = []
+        while True:
+            decls.extend(self.comments())
+            if self.accept_kw('END_VAR'):
+                return VarBlock(kind, qualifiers, decls)
+            if self.accept_op(';'):
+                continue
+            decls.append(self.parse_var_decl())
+
+    def parse_var_decl(self):
+        line = self.peek().line
+        names = [self.expect_ident()]
+        while self.accept_op(','):
+            names.append(self.expect_ident())
+
+        mem_code = None
+        if self.accept_kw('AT'):
+            tok = self.advance()
+            if tok.kind != 'ADDR':
+                raise STSyntaxError(f"expected a direct address after AT, found {describe(tok)}", tok.line)
+            mem_code = normal_mem_code(tok.value)
+
+        self.expect_op(':')
+        dims = []
+        while self.accept_kw('ARRAY'):
+            self.expect_op('[')
+            dims.append(self.parse_dim())
+            while self.accept_op(','):
+                dims.append(self.parse_dim())
+            self.expect_op(']')
+            self.expect_kw('OF')
+
+        type_name = self.expect_ident()
+
+        # STRING(20) or STRING[20]: the length is of no use to python
+        if self.at_op('(', '['):
+            close = ')' if self.advance().value == '(' else ']'
+            self.parse_expr()
+            self.expect_op(close)
+
+        init = None
+        if self.accept_op(':='):
+            if self.at_op('['):
+                init = self.parse_array_init()
+            else:
+                init = self.parse_expr()
+        self.accept_op(';')
+        return VarDecl(names, type_name, dims, mem_code, init, line)
+
+    def parse_dim(self):
+        line = self.peek().line
+        low = const_int(self.parse_expr(), line)
+        self.expect_op('..')
+        high = const_int(self.parse_expr(), line)
+        return (low, high)
+
+    # [v0, v1, n(v), ...] where n(v) repeats v n times
+    def parse_array_init(self):
+        self.expect_op('[')
+        items = []
+        while not self.at_op(']'):
+            if self.peek().kind == 'NUM' and self.peek2().kind == 'OP' and self.peek2().value == '(':
+                count = self.advance().value
+                self.expect_op('(')
+                item = self.parse_expr()
+                self.expect_op(')')
+                items.extend([item]*count)
+            else:
+                items.append(self.parse_expr())
+            if not self.accept_op(','):
+                break
+        self.expect_op(']')
+        return ArrayInit(items)
+
+    #
+    # statements
+    #
+
+    # parse statements until a keyword that closes the list.  When in_case is True
+    # the list also ends at the label of the next CASE branch
+    def parse_stmt_list(self, in_case=False):
+        self.nest()
+        stmts = []
+        while True:
+            stmts.extend(self.comments())
+            tok = self.peek()
+            if tok.kind == 'EOF':
+                break
+            if tok.kind == 'KW' and tok.value in stmt_list_ends:
+                break
+            if in_case and self.at_case_label():
+                break
+            if tok.kind == 'OP' and tok.value == ';':
+                self.advance()
+                continue
+            stmts.append(self.parse_stmt())
+        self.depth -= 1
+        return stmts
+
+    # statements never start with a number, nor with a name followed by ':', ',' or '..'
+    def at_case_label(self):
+        tok = self.peek()
+        if tok.kind == 'NUM':
+            return True
+        nxt = self.peek2()
+        if tok.kind == 'OP' and tok.value in ('-', '+'):
+            return nxt.kind == 'NUM'
+        if tok.kind == 'IDENT':
+            return nxt.kind == 'OP' and nxt.value in (':', ',', '..')
+        return False
+
+    def parse_stmt(self):
+        tok = self.peek()
+        if tok.kind == 'IDENT':
+            target = self.parse_designator()
+            if self.accept_op(':='):
+                stmt = Assign(target, self.parse_expr())
+            elif self.at_op('('):
+                stmt = CallStmt(target, self.parse_args(True))
+            else:
+                nxt = self.peek()
+                raise STSyntaxError(f"expected ':=' or '(' after {tok.value}, found {describe(nxt)}", nxt.line)
+            self.accept_op(';')
+            return stmt
+
+        if tok.kind != 'KW':
+            raise STSyntaxError(f"unexpected {describe(tok)} at start of statement", tok.line)
+
+        match tok.value:
+            case 'IF':
+                return self.parse_if()
+            case 'CASE':
+                return self.parse_case()
+            case 'FOR':
+                return self.parse_for()
+            case 'WHILE':
+                return self.parse_while()
+            case 'REPEAT':
+                return self.parse_repeat()
+            case 'EXIT':
+                stmt = Exit()
+            case 'CONTINUE':
+                stmt = Continue()
+            case 'RETURN':
+                stmt = Return()
+            case _:
+                raise STSyntaxError(f"unexpected {describe(tok)} at start of statement", tok.line)
+
+        self.advance()
+        self.accept_op(';')
+        return stmt
+
+    def parse_if(self):
+        self.expect_kw('IF')
+        branches = []
+        cond = self.parse_expr()
+        self.expect_kw('THEN')
+        branches.append((cond, self.parse_stmt_list()))
+
+        while self.accept_kw('ELSIF'):
+            cond = self.parse_expr()
+            self.expect_kw('THEN')
+            branches.append((cond, self.parse_stmt_list()))
+
+        else_body = None
+        if self.accept_kw('ELSE'):
+            else_body = self.parse_stmt_list()
+
+        self.expect_kw('END_IF')
+        self.accept_op(';')
+        return If(branches, else_body)
+
+    def parse_case(self):
+        self.expect_kw('CASE')
+        selector = self.parse_expr()
+        self.expect_kw('OF')
+
+        # comments ahead of the first label are kept with the first branch
+        lead = self.comments()
+        branches = []
+        else_body = None
+        while True:
+            if self.accept_kw('ELSE'):
+                self.accept_op(':')
+                else_body = lead+self.parse_stmt_list()
+                break
+            if self.at_kw('END_CASE'):
+                break
+
+            labels = [self.parse_case_label()]
+            while self.accept_op(','):
+                labels.append(self.parse_case_label())
+            self.expect_op(':')
+            branches.append((labels, lead+self.parse_stmt_list(True)))
+            lead = []
+
+        self.expect_kw('END_CASE')
+        self.accept_op(';')
+        return Case(selector, branches, else_body)
+
+    def parse_case_label(self):
+        low = self.parse_expr()
+        if self.accept_op('..'):
+            return Range(low, self.parse_expr())
+        return low
+
+    def parse_for(self):
+        self.expect_kw('FOR')
+        var = self.expect_ident()
+        self.expect_op(':=')
+        start = self.parse_expr()
+        self.expect_kw('TO')
+        stop = self.parse_expr()
+        step = None
+        if self.accept_kw('BY'):
+            step = self.parse_expr()
+        self.expect_kw('DO')
+        body = self.parse_stmt_list()
+        self.expect_kw('END_FOR')
+        self.accept_op(';')
+        return For(var, start, stop, step, body)
+
+    def parse_while(self):
+        self.expect_kw('WHILE')
+        cond = self.parse_expr()
+        self.expect_kw('DO')
+        body = self.parse_stmt_list()
+        self.expect_kw('END_WHILE')
+        self.accept_op(';')
+        return While(cond, body)
+
+    def parse_repeat(self):
+        self.expect_kw('REPEAT')
+        body = self.parse_stmt_list()
+        self.expect_kw('UNTIL')
+        cond = self.parse_expr()
+        self.expect_kw('END_REPEAT')
+        self.accept_op(';')
+        return Repeat(body, cond)
+
+    # arguments of a call.  In a call statement the non-standard 'name = value'
+    # form is read as a named input, elsewhere '=' is always a comparison
+    def parse_args(self, stmt_call):
+        self.expect_op('(')
+        args = []
+        while not self.at_op(')'):
+            tok = self.peek()
+            nxt = self.peek2()
+            if tok.kind == 'IDENT' and nxt.kind == 'OP' and nxt.value in (':=', '=>') \
+                    or (stmt_call and tok.kind == 'IDENT' and nxt.kind == 'OP' and nxt.value == '='):
+                self.advance()
+                output = self.advance().value == '=>'
+                args.append(Arg(tok.value, self.parse_expr(), output))
+            else:
+                args.append(Arg(None, self.parse_expr()))
+            if not self.accept_op(','):
+                break
+        self.expect_op(')')
+        return args
+
+    #
+    # expressions
+    #
+
+    # precedence climbing over the binary operators
+    def parse_expr(self, min_prec=1):
+        left = self.parse_unary()
+        while True:
+            tok = self.peek()
+            if tok.kind not in ('OP', 'KW') or tok.value not in binary_prec:
+                return left
+            prec = binary_prec[tok.value]
+            if prec < min_prec:
+                return left
+            self.advance()
+            right = self.parse_expr(prec+1)
+            left = BinOp('AND' if tok.value == '&' else tok.value, left, right)
+
+    # every operand, parenthesized ones included, is parsed here, so nesting is counted here
+    def parse_unary(self):
+        self.nest()
+        if self.accept_kw('NOT'):
+            expr = UnaryOp('NOT', self.parse_unary())
+        elif self.accept_op('-'):
+            expr = UnaryOp('-', self.parse_unary())
+        elif self.accept_op('+'):
+            expr = self.parse_unary()
+        else:
+            expr = self.parse_power()
+        self.depth -= 1
+        return expr
+
+    # exponentiation binds tighter than negation, and groups to the left
+    def parse_power(self):
+        left = self.parse_primary()
+        while self.accept_op('**'):
+            left = BinOp('**', left, self.parse_exponent())
+        return left
+
+    # the right operand of '**' may carry a sign, but does not take in a further '**'
+    def parse_exponent(self):
+        self.nest()
+        if self.accept_op('-'):
+            expr = UnaryOp('-', self.parse_exponent())
+        elif self.accept_op('+'):
+            expr = self.parse_exponent()
+        else:
+            expr = self.parse_primary()
+        self.depth -= 1
+        return expr
+
+    def parse_primary(self):
+        tok = self.peek()
+        match tok.kind:
+            case 'NUM' | 'REAL' | 'TIME' | 'STR':
+                self.advance()
+                return Literal(tok.value)
+            case 'KW':
+                if tok.value in ('TRUE', 'FALSE'):
+                    self.advance()
+                    return Literal(tok.value == 'TRUE')
+            case 'OP':
+                if tok.value == '(':
+                    self.advance()
+                    expr = self.parse_expr()
+                    self.expect_op(')')
+                    return expr
+            case 'IDENT':
+                if self.peek2().kind == 'OP' and self.peek2().value == '(':
+                    self.advance()
+                    return Call(tok.value, self.parse_args(False))
+                return self.parse_designator()
+
+        raise STSyntaxError(f"unexpected {describe(tok)} in expression", tok.line)
+
+    # a variable reference: name, then any sequence of .field and [index]
+    def parse_designator(self):
+        node = Name(self.expect_ident())
+        while True:
+            if self.accept_op('.'):
+                node = Member(node, self.expect_ident())
+            elif self.accept_op('['):
+                indices = [self.parse_expr()]
+                while self.accept_op(','):
+                    indices.append(self.parse_expr())
+                self.expect_op(']')
+                node = Index(node, indices)
+            else:
+                return node
+
+
+def describe(tok):
+    if tok.kind == 'EOF':
+        return 'end of file'
+    return f"'{tok.value}'"
+
+# evaluate an integer constant expression used as an array bound
+def const_int(expr, line):
+    if isinstance(expr, Literal) and isinstance(expr.value, int) and not isinstance(expr.value, bool):
+        return expr.value
+    if isinstance(expr, UnaryOp) and expr.op == '-':
+        return -const_int(expr.operand, line)
+    raise STSyntaxError("array bounds must be integer constants", line)
+
+# fill in the size code of a direct address written without one, e.g. I0.1 or QW
+def normal_mem_code(mem_code):
+    if len(mem_code) > 1 and mem_code[1] in 'XBWDL':
+        return mem_code
+    if mem_code.find('.') > -1:
+        return mem_code[0]+'X'+mem_code[1:]
+    return mem_code[0]+'W'+mem_code[1:]
+
+# parse ST source text and return the list of program organization units in it
+def parse(source):
+    return Parser(tokenize(source)).parse_file()
+
+# the ST source read from the open file rf, in pieces that each end with the first
+# line closing a program organization unit outside of any comment, the last piece
+# being whatever follows the last such line.  Yields the text of each piece, the
+# number of its first line, and its tokens
+def source_units(rf):
+    lines = []
+    first = 1
+    line = 0
+    for text in rf:
+        line += 1
+        lines.append(text)
+        if pou_end_pattern.search(text) is None:
+            continue
+
+        source = ''.join(lines)
+        try:
+            tokens = tokenize(source, first)
+        except STSyntaxError:
+            # a comment or string still open, reported if it is never closed
+            continue
+        if not any(tok.kind == 'KW' and tok.value in pou_ends for tok in tokens):
+            continue
+
+        yield source, first, tokens
+        lines = []
+        first = line+1
+
+    if len(lines) > 0:
+        source = ''.join(lines)
+        yield source, first, tokenize(source, first)
+
+# parse the ST source read from the open file rf a piece (of source_units) at a time,
+# yielding the list of program organization units in each, so that no more of the
+# source is held at once than the largest unit and the comments ahead of it
+def parse_stream(rf):
+    for source, first, tokens in source_units(rf):
+        yield Parser(tokens).parse_file()